@@ -1 +1,4 @@
 from .shell_command_adapter import FlashROMShellCommandAdapter
+from .async_shell_command_adapter import AsyncFlashROMShellCommandAdapter
+from .libflashrom_adapter import FlashROMLibraryAdapter
+from .emulated_adapter import EmulatedFlashChip, FlashROMEmulatedAdapter
@@ -0,0 +1,127 @@
+import asyncio
+import subprocess
+import time
+from collections import deque
+from logging import getLogger
+from typing import Optional
+from pyflex.output_parser import FlashROMOutputParser
+from pyflex.typing import (
+    AsyncFlashROMAdapter,
+    FlashROMExecResult,
+    FlashROMOpts,
+)
+from .shell_command_adapter import (
+    FlashROMShellCommandAdapter,
+    MAX_OUTPUT_LINES,
+    _LineTimer,
+    _READ_SIZE,
+    _Tail,
+    _TimedProcess,
+)
+
+
+_log = getLogger(__name__)
+
+
+class AsyncFlashROMShellCommandAdapter(FlashROMShellCommandAdapter, AsyncFlashROMAdapter):
+    """Execute the FlashROM utility from an asyncio event loop.
+
+    This adapter builds the same commands as FlashROMShellCommandAdapter but
+    drives the child process with asyncio so that a single event loop can
+    supervise many programmers at once without a thread per operation. The
+    blocking run method is still available for synchronous callers.
+
+    Arguments:
+        output_path:
+            The directory to write output files, if applicable.
+
+        env:
+            An optional dictionary of environment variables to pass to the
+            FlashROM utility.
+
+        on_output:
+            An optional callable that receives each line written by the FlashROM
+            utility as soon as it is available.
+
+    Methods:
+        run: Runs the FlashROM utility.
+        run_async: Runs the FlashROM utility without blocking the event loop.
+    """
+
+    async def _execute_subprocess_async(self, command: list) -> subprocess.CompletedProcess:
+        _log.info("Running subprocess: %s", command)
+
+        timeline = deque(maxlen=MAX_OUTPUT_LINES)
+        parser = FlashROMOutputParser()
+
+        started = time.monotonic()
+        process = await asyncio.create_subprocess_exec(
+            *command,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        spawn = time.monotonic() - started
+
+        try:
+            stdout, stderr = await asyncio.gather(
+                self._read_stream_async(process.stdout, timeline, started, parser),
+                self._read_stream_async(process.stderr, timeline, started, parser),
+            )
+            returncode = await process.wait()
+
+        except asyncio.CancelledError:
+            # Do not leave flashrom running against the chip when the caller
+            # gives up on the operation.
+            _log.warning("Operation cancelled. Terminating subprocess: %s", command)
+            process.kill()
+            await process.wait()
+            raise
+
+        return _TimedProcess(
+            args=command,
+            returncode=returncode,
+            stdout=stdout,
+            stderr=stderr,
+            spawn=spawn,
+            timeline=timeline,
+            parser=parser,
+        )
+
+    async def _read_stream_async(
+        self,
+        stream: asyncio.StreamReader,
+        timeline: Optional[deque] = None,
+        origin: Optional[float] = None,
+        parser: Optional[FlashROMOutputParser] = None,
+    ) -> bytes:
+        buffer = _Tail()
+        timer = _LineTimer(time.monotonic() if origin is None else origin)
+
+        while chunk := await stream.read(_READ_SIZE):
+            self._collect(timer.feed(chunk), buffer, timeline, parser)
+
+        self._collect(timer.flush(), buffer, timeline, parser)
+        return buffer.value()
+
+    async def run_async(self, opts: FlashROMOpts) -> FlashROMExecResult:
+        """Runs the flashrom utility with the given options without blocking the event loop.
+
+        Arguments:
+            opts:
+                A FlashROMOpts object that identifies the arguments
+                to pass to the flashrom utility.
+
+        Raises:
+            PyFlexExecutionError:
+                Raised when the exit code of FlashROM is non-zero.
+
+        Returns:
+            FlashROMExecResult:
+                contains the result data from FlashROM including the
+                message, a structured report and binary file, if applicable.
+        """
+
+        command, file_name = self._make_command(opts)
+        started = time.monotonic()
+        result = await self._execute_subprocess_async(command)
+        return self._make_result(result, file_name, time.monotonic() - started)
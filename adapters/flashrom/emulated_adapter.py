@@ -0,0 +1,420 @@
+import mmap
+import os
+import time
+from pathlib import Path
+from threading import Lock
+from uuid import uuid4 as uuid
+from typing import Callable, Optional
+from logging import getLogger
+from pyflex.exceptions import PyFlexExecutionError, PyFlexInvalidParameter
+from pyflex.layout import parse_layout
+from pyflex.output_parser import FlashROMOutputParser
+from pyflex.typing import (
+    FlashROMActionEnum,
+    FlashROMAdapter,
+    FlashROMExecResult,
+    FlashROMOpts,
+)
+
+
+_log = getLogger(__name__)
+
+
+class EmulatedFlashChip:
+    """A SPI NOR flash chip emulated in a memory mapped file.
+
+    Erasing sets a whole erase block to 0xFF. Programming can only clear bits,
+    so programming a byte that was not erased leaves the AND of the old and new
+    values behind, just like the real thing. Optional delays make operations
+    take roughly as long as they would on hardware.
+
+    The contents live in the backing file, so they survive restarts and are
+    shared with every process that maps the same file. Callers are expected to
+    serialize access between processes, e.g. with a DeviceManager.
+
+    Arguments:
+        path:
+            The backing file. It is created and erased if it does not exist.
+
+        size:
+            The size of the chip in bytes.
+
+        erase_block_size:
+            The size of an erase block in bytes. The chip size must be a
+            multiple of it.
+
+        read_time:
+            Seconds it takes to read a byte.
+
+        program_time:
+            Seconds it takes to program a byte.
+
+        erase_time:
+            Seconds it takes to erase a block.
+
+        vendor:
+            The vendor reported when the chip is probed.
+
+        name:
+            The chip name reported when the chip is probed.
+
+    Methods:
+        read: Read bytes from the chip.
+        erase_block: Erase a single erase block.
+        program: Program bytes into the chip.
+        close: Unmap the backing file.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        size: int = 1024 * 1024,
+        erase_block_size: int = 4096,
+        read_time: float = 0,
+        program_time: float = 0,
+        erase_time: float = 0,
+        vendor: str = "Emulated",
+        name: str = "EMULATED",
+    ) -> None:
+
+        if size <= 0 or size % erase_block_size:
+            raise ValueError("The chip size must be a multiple of the erase block size.")
+
+        self.size = size
+        self.erase_block_size = erase_block_size
+        self.vendor = vendor
+        self.name = name
+        self._read_time = read_time
+        self._program_time = program_time
+        self._erase_time = erase_time
+        self._lock = Lock()
+
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fresh = os.fstat(fd).st_size == 0
+            os.ftruncate(fd, size)
+            self._map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+        if fresh:
+            self._map[:] = b"\xff" * size
+
+    def read(self, offset: int = 0, length: Optional[int] = None) -> bytes:
+        """Read bytes from the chip.
+
+        Arguments:
+            offset:
+                The first byte to read.
+
+            length:
+                The number of bytes to read. Reads to the end of the chip if None.
+
+        Raises:
+            ValueError:
+                Raised when the range is outside of the chip.
+
+        Returns:
+            bytes:
+                The contents of the range.
+        """
+        length = self.size - offset if length is None else length
+        self._check_range(offset, length)
+
+        with self._lock:
+            data = self._map[offset:offset + length]
+            self._delay(self._read_time * length)
+        return data
+
+    def erase_block(self, index: int) -> None:
+        """Erase a single erase block.
+
+        Arguments:
+            index:
+                The number of the block, counted from the start of the chip.
+
+        Raises:
+            ValueError:
+                Raised when the block is outside of the chip.
+        """
+        offset = index * self.erase_block_size
+        self._check_range(offset, self.erase_block_size)
+
+        with self._lock:
+            self._map[offset:offset + self.erase_block_size] = b"\xff" * self.erase_block_size
+            self._delay(self._erase_time)
+
+    def program(self, offset: int, data: bytes) -> None:
+        """Program bytes into the chip.
+
+        Bits can only be cleared. Erase the block first to set them again.
+
+        Arguments:
+            offset:
+                The first byte to program.
+
+            data:
+                The bytes to program.
+
+        Raises:
+            ValueError:
+                Raised when the range is outside of the chip.
+        """
+        self._check_range(offset, len(data))
+
+        with self._lock:
+            old = int.from_bytes(self._map[offset:offset + len(data)])
+            new = int.from_bytes(data)
+            self._map[offset:offset + len(data)] = (old & new).to_bytes(len(data))
+            self._delay(self._program_time * len(data))
+
+    def close(self) -> None:
+        """Unmap the backing file.
+
+        Arguments:
+            Nothing
+
+        Raises:
+            Nothing
+        """
+        self._map.close()
+
+    def _check_range(self, offset: int, length: int) -> None:
+        if offset < 0 or length < 0 or offset + length > self.size:
+            raise ValueError(f"Range {offset}+{length} is outside of the chip.")
+
+    def _delay(self, seconds: float) -> None:
+        if seconds > 0:
+            time.sleep(seconds)
+
+
+class FlashROMEmulatedAdapter(FlashROMAdapter):
+    """Run operations against an EmulatedFlashChip.
+
+    This adapter stands in for FlashROMShellCommandAdapter where there is no
+    hardware, e.g. to load test the whole stack. It writes the same kind of
+    messages the FlashROM utility does, so output streaming and report parsing
+    behave the same. Like the utility, a write only erases and programs the
+    blocks that differ from the current contents, and is verified afterwards.
+
+    Regions of a layout file can be included like with the FlashROM utility.
+    Regions read from the chip's IFD or FMAP are not supported. Every
+    programmer string is accepted and refers to the same chip.
+
+    Arguments:
+        chip:
+            The emulated chip to operate on.
+
+        output_path:
+            The directory to write output files, if applicable.
+
+        on_output:
+            An optional callable that receives each line of output as soon as
+            it is available.
+
+    Methods:
+        run: Runs an operation against the emulated chip.
+    """
+
+    def __init__(
+        self,
+        chip: EmulatedFlashChip,
+        output_path: str,
+        on_output: Optional[Callable[[str], None]] = None,
+    ) -> None:
+
+        _log.debug(
+            "Initilized FlashROMEmulatedAdapter with "
+            "options: chip=%s, output_path=%s",
+            chip.name,
+            output_path
+        )
+
+        self._chip = chip
+        self._output_path = Path(output_path)
+        self._on_output = on_output
+
+    def run(self, opts: FlashROMOpts) -> FlashROMExecResult:
+        """Runs an operation against the emulated chip with the given options.
+
+        Arguments:
+            opts:
+                A FlashROMOpts object that identifies the operation.
+
+        Raises:
+            PyFlexExecutionError:
+                Raised when the operation fails, like FlashROM would.
+
+        Returns:
+            FlashROMExecResult:
+                contains the messages, a structured report and binary file, if
+                applicable.
+        """
+        lines = []
+        started = time.monotonic()
+
+        try:
+            file_name = self._run(opts, lines)
+        except PyFlexExecutionError as e:
+            self._say(lines, str(e))
+            _log.warning("Emulated operation failed: %s", e)
+            raise PyFlexExecutionError("\n".join(lines))
+
+        parser = FlashROMOutputParser()
+        for line in lines:
+            parser.feed(line)
+        parser.finish(0, time.monotonic() - started)
+
+        return FlashROMExecResult("\n".join(lines), file_name, parser.report())
+
+    def _run(self, opts: FlashROMOpts, lines: list) -> Optional[str]:
+        chip = self._chip
+
+        if opts.chip and opts.chip != chip.name:
+            raise PyFlexExecutionError("No EEPROM/flash device found.")
+
+        if opts.ifd or opts.fmap:
+            raise PyFlexExecutionError("The emulated chip has no IFD or FMAP.")
+
+        ranges = self._included(opts)
+
+        programmer = opts.programmer.partition(":")[0]
+        self._say(
+            lines,
+            f'Found {chip.vendor} flash chip "{chip.name}" '
+            f'({chip.size // 1024} kB, SPI) on {programmer}.'
+        )
+
+        if opts.action == FlashROMActionEnum.PROBE:
+            return None
+
+        elif opts.action == FlashROMActionEnum.READ:
+            self._say(lines, "Reading flash...")
+            data = chip.read()
+            if ranges is not None:
+                # Regions that are left out are not read.
+                data = self._merge(b"\xff" * chip.size, data, ranges)
+            file_name = f"{uuid()}.bin"
+            (self._output_path / file_name).write_bytes(data)
+            self._say(lines, "done.")
+            return file_name
+
+        elif opts.action == FlashROMActionEnum.ERASE:
+            self._say(lines, "Erasing flash chip...")
+            if ranges is None:
+                for index in range(chip.size // chip.erase_block_size):
+                    chip.erase_block(index)
+            else:
+                current = chip.read()
+                self._write(self._merge(current, b"\xff" * chip.size, ranges), current)
+            self._say(lines, "Erase/write done.")
+
+        elif opts.action == FlashROMActionEnum.VERIFY:
+            self._verify(self._load_image(opts.input_path), lines, ranges)
+
+        elif opts.action == FlashROMActionEnum.WRITE:
+            image = self._load_image(opts.input_path)
+
+            if opts.flash_contents:
+                current = self._load_image(opts.flash_contents)
+            else:
+                self._say(lines, "Reading old flash chip contents...")
+                current = chip.read()
+                self._say(lines, "done.")
+
+            # Regions that are left out keep what the chip is believed to
+            # hold, and are verified against that unless told otherwise.
+            if ranges is not None:
+                image = self._merge(current, image, ranges)
+
+            self._say(lines, "Erasing and writing flash chip...")
+            self._write(image, current)
+            self._say(lines, "Erase/write done.")
+            self._verify(image, lines, ranges if opts.verify_included_only else None)
+
+        return None
+
+    def _included(self, opts: FlashROMOpts) -> Optional[list[tuple[int, int]]]:
+        # The (start, end) byte ranges of the included regions, end exclusive,
+        # or None for the whole chip.
+        if not opts.include:
+            return None
+
+        if not opts.layout:
+            raise PyFlexExecutionError("Error: No layout given for the included regions.")
+
+        try:
+            regions = {region.name: region for region in parse_layout(Path(opts.layout).read_text())}
+        except PyFlexInvalidParameter as e:
+            raise PyFlexExecutionError(f"Error: {e}")
+
+        ranges = []
+        for name in opts.include:
+            region = regions.get(name)
+            if region is None:
+                raise PyFlexExecutionError(f'Error: Region "{name}" not found in layout file.')
+            if region.end >= self._chip.size:
+                raise PyFlexExecutionError(f'Error: Region "{name}" is outside of the flash chip.')
+            ranges.append((region.start, region.end + 1))
+        return ranges
+
+    def _merge(self, base: bytes, image: bytes, ranges: list[tuple[int, int]]) -> bytes:
+        merged = bytearray(base)
+        for start, end in ranges:
+            merged[start:end] = image[start:end]
+        return bytes(merged)
+
+    def _write(self, image: bytes, current: bytes) -> None:
+        block_size = self._chip.erase_block_size
+
+        for offset in range(0, len(image), block_size):
+            new = image[offset:offset + block_size]
+            old = current[offset:offset + block_size]
+
+            if new == old:
+                continue
+
+            # Bits can only be cleared by programming. Erase when any bit has
+            # to be set again.
+            if int.from_bytes(new) & ~int.from_bytes(old):
+                self._chip.erase_block(offset // block_size)
+
+            self._chip.program(offset, new)
+
+    def _verify(self, image: bytes, lines: list, ranges: Optional[list[tuple[int, int]]] = None) -> None:
+        self._say(lines, "Verifying flash...")
+        data = self._chip.read()
+        if ranges is None:
+            matches = data == image
+        else:
+            matches = all(data[start:end] == image[start:end] for start, end in ranges)
+        if not matches:
+            raise PyFlexExecutionError("FAILED")
+        self._say(lines, "VERIFIED.")
+
+    def _load_image(self, path: str) -> bytes:
+        data = Path(path).read_bytes()
+        if len(data) != self._chip.size:
+            raise PyFlexExecutionError(
+                f"Error: Image size ({len(data)} B) doesn't match the "
+                f"flash chip's size ({self._chip.size} B)!"
+            )
+        return data
+
+    def _say(self, lines: list, text: str) -> None:
+        # Progress is written the way FlashROM does, "Verifying flash... " and
+        # "VERIFIED." end up on the same line.
+        if lines and lines[-1].endswith("..."):
+            lines[-1] += " " + text
+        else:
+            lines.append(text)
+
+        if self._on_output is None:
+            return
+
+        try:
+            self._on_output(text)
+        except Exception:
+            _log.exception("Output listener failed.")
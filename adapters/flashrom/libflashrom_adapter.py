@@ -0,0 +1,421 @@
+import ctypes
+import ctypes.util
+from contextlib import contextmanager
+from pathlib import Path
+from threading import RLock
+from uuid import uuid4 as uuid
+from typing import Callable, Iterator, Optional
+from logging import getLogger
+from pyflex.exceptions import PyFlexExecutionError
+from pyflex.output_parser import FlashROMOutputParser
+from pyflex.typing import (
+    FlashROMActionEnum,
+    FlashROMAdapter,
+    FlashROMExecResult,
+    FlashROMOpts,
+    SessionFlashROMAdapter,
+)
+
+
+_log = getLogger(__name__)
+
+
+# enum flashrom_log_level
+_LOG_INFO = 2
+
+# enum flashrom_flag
+_FLAG_FORCE = 0
+_FLAG_VERIFY_AFTER_WRITE = 2
+
+# enum flashrom_progress_stage
+_PROGRESS_STAGES = {0: "read", 1: "write", 2: "erase"}
+
+
+_LOG_CALLBACK = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_int, ctypes.c_char_p, ctypes.c_void_p)
+_PROGRESS_CALLBACK = ctypes.CFUNCTYPE(None, ctypes.c_void_p)
+
+
+class _Progress(ctypes.Structure):
+    _fields_ = [
+        ("stage", ctypes.c_int),
+        ("current", ctypes.c_size_t),
+        ("total", ctypes.c_size_t),
+        ("user_data", ctypes.c_void_p),
+    ]
+
+
+class _Session:
+    # An initialized programmer and the chip probed on it.
+
+    def __init__(self, programmer: ctypes.c_void_p) -> None:
+        self.programmer = programmer
+        self.flashctx: Optional[ctypes.c_void_p] = None
+        self.chip: Optional[str] = None
+
+
+# libflashrom keeps global state, including the log callback, and is not safe
+# to call from several threads at once. All adapters share this lock.
+_library_lock = RLock()
+
+
+def _load_library(path: Optional[str]) -> ctypes.CDLL:
+    path = path or ctypes.util.find_library("flashrom")
+    if path is None:
+        raise PyFlexExecutionError("libflashrom is not available.")
+
+    lib = ctypes.CDLL(path)
+
+    lib.flashrom_init.argtypes = [ctypes.c_int]
+    lib.flashrom_set_log_callback.argtypes = [_LOG_CALLBACK]
+    lib.flashrom_set_log_callback.restype = None
+    lib.flashrom_programmer_init.argtypes = [
+        ctypes.POINTER(ctypes.c_void_p), ctypes.c_char_p, ctypes.c_char_p
+    ]
+    lib.flashrom_programmer_shutdown.argtypes = [ctypes.c_void_p]
+    lib.flashrom_flash_probe.argtypes = [
+        ctypes.POINTER(ctypes.c_void_p), ctypes.c_void_p, ctypes.c_char_p
+    ]
+    lib.flashrom_flash_getsize.argtypes = [ctypes.c_void_p]
+    lib.flashrom_flash_getsize.restype = ctypes.c_size_t
+    lib.flashrom_flash_release.argtypes = [ctypes.c_void_p]
+    lib.flashrom_flash_release.restype = None
+    lib.flashrom_flash_erase.argtypes = [ctypes.c_void_p]
+    lib.flashrom_flag_set.argtypes = [ctypes.c_void_p, ctypes.c_int, ctypes.c_bool]
+    lib.flashrom_flag_set.restype = None
+    lib.flashrom_image_read.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_size_t]
+    lib.flashrom_image_write.argtypes = [
+        ctypes.c_void_p, ctypes.c_void_p, ctypes.c_size_t, ctypes.c_void_p
+    ]
+    lib.flashrom_image_verify.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_size_t]
+
+    # Progress reporting only exists in newer releases.
+    if hasattr(lib, "flashrom_set_progress_callback"):
+        lib.flashrom_set_progress_callback.argtypes = [
+            ctypes.c_void_p, _PROGRESS_CALLBACK, ctypes.POINTER(_Progress)
+        ]
+        lib.flashrom_set_progress_callback.restype = None
+
+    return lib
+
+
+def _load_libc() -> ctypes.CDLL:
+    libc = ctypes.CDLL(ctypes.util.find_library("c"))
+    libc.vsnprintf.argtypes = [ctypes.c_char_p, ctypes.c_size_t, ctypes.c_char_p, ctypes.c_void_p]
+    return libc
+
+
+class FlashROMLibraryAdapter(FlashROMAdapter, SessionFlashROMAdapter):
+    """Drive flash chips through libflashrom.
+
+    This adapter calls libflashrom in-process with ctypes instead of running
+    the FlashROM utility for every operation. Inside a session, which the
+    FlashROMService opens while it holds the device, e.g. for a whole
+    pipeline, the programmer is initialized and the chip probed once and kept
+    open for every operation. A probe always probes the chip again. Outside
+    of a session the programmer is shut down after every operation, since the
+    chip may be swapped once the device is given back.
+
+    Like FlashROMShellCommandAdapter, this adapter expects well-formed options
+    and makes no consistency checks. Layouts, regions, IFD and FMAP are not
+    supported.
+
+    Arguments:
+        output_path:
+            The directory to write output files, if applicable.
+
+        library:
+            The path of libflashrom. It is searched for if None.
+
+        on_output:
+            An optional callable that receives each line logged by libflashrom.
+
+        on_progress:
+            An optional callable that receives the stage ("read", "write" or
+            "erase"), the current and the total bytes. Only called when the
+            library supports progress reporting.
+
+    Methods:
+        run: Runs an operation through libflashrom.
+        session: Keeps the programmer open for the operations inside the block.
+    """
+
+    def __init__(
+        self,
+        output_path: str,
+        library: Optional[str] = None,
+        on_output: Optional[Callable[[str], None]] = None,
+        on_progress: Optional[Callable[[str, int, int], None]] = None,
+    ) -> None:
+
+        _log.debug(
+            "Initilized FlashROMLibraryAdapter with "
+            "options: output_path=%s, library=%s",
+            output_path,
+            library
+        )
+
+        self._output_path = Path(output_path)
+        self._on_output = on_output
+        self._on_progress = on_progress
+        # Programmers in a session, with the session once it was opened.
+        self._held: dict[str, Optional[_Session]] = {}
+        self._lines: list[str] = []
+        self._partial = ""
+        self._verbosity = 0
+
+        with _library_lock:
+            self._lib = _load_library(library)
+            self._libc = _load_libc()
+
+            # Keep references to the callbacks or ctypes frees them while the
+            # library still points at them.
+            self._log_callback = _LOG_CALLBACK(self._log)
+            self._progress_callback = _PROGRESS_CALLBACK(self._progress)
+            self._progress_state = _Progress()
+
+            if self._lib.flashrom_init(1) != 0:
+                raise PyFlexExecutionError("Unable to initialize libflashrom.")
+
+    def run(self, opts: FlashROMOpts) -> FlashROMExecResult:
+        """Runs an operation through libflashrom with the given options.
+
+        Arguments:
+            opts:
+                A FlashROMOpts object that identifies the operation.
+
+        Raises:
+            PyFlexExecutionError:
+                Raised when libflashrom reports a failure or the options ask
+                for something that is not supported.
+
+        Returns:
+            FlashROMExecResult:
+                contains the result data from libflashrom including the
+                logged messages, a structured report and binary file, if
+                applicable.
+        """
+        self._check_supported(opts)
+
+        with _library_lock:
+            self._lines = []
+            self._partial = ""
+            self._verbosity = opts.verbosity
+            self._lib.flashrom_set_log_callback(self._log_callback)
+
+            try:
+                file_name = self._run(opts)
+
+            except PyFlexExecutionError:
+                self._flush()
+                msg = "\n".join(self._lines)
+                _log.warning("libflashrom operation failed: %s", msg)
+                raise PyFlexExecutionError(msg or "libflashrom operation failed.")
+
+            self._flush()
+            # Another operation may log into self._lines once the lock is
+            # released.
+            lines = list(self._lines)
+
+        msg = "\n".join(lines)
+        parser = FlashROMOutputParser()
+        for line in lines:
+            parser.feed(line)
+        parser.finish(0)
+
+        _log.debug("libflashrom operation succeeded")
+        return FlashROMExecResult(msg, file_name, parser.report())
+
+    @contextmanager
+    def session(self, programmer: str) -> Iterator[None]:
+        """Keeps the programmer open for the operations run inside the block.
+
+        The programmer is initialized by the first operation and shut down at
+        the end of the block. Only to be used while the device is held, e.g.
+        with a DeviceManager.
+
+        Arguments:
+            programmer:
+                The programmer string of the device.
+
+        Raises:
+            Nothing
+        """
+        with _library_lock:
+            self._held[programmer] = None
+        try:
+            yield
+        finally:
+            with _library_lock:
+                session = self._held.pop(programmer, None)
+                if session is not None:
+                    self._close_session(session)
+
+    def _check_supported(self, opts: FlashROMOpts) -> None:
+        # Running the whole chip instead would write or erase more than was
+        # asked for.
+        unsupported = [
+            name
+            for name, value in (
+                ("layout", opts.layout),
+                ("include", opts.include),
+                ("ifd", opts.ifd),
+                ("fmap", opts.fmap),
+                ("verify_included_only", opts.verify_included_only),
+            )
+            if value
+        ]
+        if unsupported:
+            raise PyFlexExecutionError(
+                f"libflashrom adapter does not support: {', '.join(unsupported)}."
+            )
+
+    def _run(self, opts: FlashROMOpts) -> Optional[str]:
+        held = opts.programmer in self._held
+        session = self._held.get(opts.programmer)
+
+        try:
+            if session is None:
+                session = self._open_session(opts.programmer)
+                self._probe(session, opts.chip)
+            elif opts.action == FlashROMActionEnum.PROBE or (opts.chip and opts.chip != session.chip):
+                self._probe(session, opts.chip)
+
+            file_name = self._run_session(session, opts)
+
+        except BaseException:
+            # The programmer may be in any state after a failure. Start over
+            # with the next operation.
+            if session is not None:
+                self._close_session(session)
+            if held:
+                self._held[opts.programmer] = None
+            raise
+
+        if held:
+            self._held[opts.programmer] = session
+        else:
+            self._close_session(session)
+        return file_name
+
+    def _run_session(self, session: _Session, opts: FlashROMOpts) -> Optional[str]:
+        ctx = session.flashctx
+        size = self._lib.flashrom_flash_getsize(ctx)
+
+        self._lib.flashrom_flag_set(ctx, _FLAG_FORCE, bool(opts.force))
+        self._lib.flashrom_flag_set(ctx, _FLAG_VERIFY_AFTER_WRITE, True)
+
+        if hasattr(self._lib, "flashrom_set_progress_callback"):
+            self._lib.flashrom_set_progress_callback(
+                ctx, self._progress_callback, ctypes.byref(self._progress_state)
+            )
+
+        if opts.action == FlashROMActionEnum.PROBE:
+            return None
+
+        elif opts.action == FlashROMActionEnum.ERASE:
+            self._check(self._lib.flashrom_flash_erase(ctx), "Erase")
+
+        elif opts.action == FlashROMActionEnum.READ:
+            buffer = ctypes.create_string_buffer(size)
+            self._check(self._lib.flashrom_image_read(ctx, buffer, size), "Read")
+            file_name = f"{uuid()}.bin"
+            (self._output_path / file_name).write_bytes(buffer.raw)
+            return file_name
+
+        elif opts.action == FlashROMActionEnum.WRITE:
+            buffer = self._load_image(opts.input_path, size)
+            reference = self._load_image(opts.flash_contents, size) if opts.flash_contents else None
+            self._check(self._lib.flashrom_image_write(ctx, buffer, size, reference), "Write")
+
+        elif opts.action == FlashROMActionEnum.VERIFY:
+            buffer = self._load_image(opts.input_path, size)
+            self._check(self._lib.flashrom_image_verify(ctx, buffer, size), "Verify")
+
+        return None
+
+    def _open_session(self, programmer: str) -> _Session:
+        name, _, params = programmer.partition(":")
+        handle = ctypes.c_void_p()
+        if self._lib.flashrom_programmer_init(
+            ctypes.byref(handle), name.encode(), params.encode() if params else None
+        ) != 0:
+            raise PyFlexExecutionError("Programmer initialization failed.")
+
+        return _Session(handle)
+
+    def _probe(self, session: _Session, chip: Optional[str]) -> None:
+        if session.flashctx is not None:
+            self._lib.flashrom_flash_release(session.flashctx)
+            session.flashctx = None
+
+        flashctx = ctypes.c_void_p()
+        result = self._lib.flashrom_flash_probe(
+            ctypes.byref(flashctx), session.programmer, chip.encode() if chip else None
+        )
+        if result != 0:
+            raise PyFlexExecutionError(
+                "Multiple flash chip definitions match the detected chip(s)."
+                if result == 3 else "No EEPROM/flash device found."
+            )
+
+        session.flashctx = flashctx
+        session.chip = chip
+
+    def _close_session(self, session: _Session) -> None:
+        if session.flashctx is not None:
+            self._lib.flashrom_flash_release(session.flashctx)
+        self._lib.flashrom_programmer_shutdown(session.programmer)
+
+    def _load_image(self, path: str, size: int) -> ctypes.Array:
+        data = Path(path).read_bytes()
+        if len(data) != size:
+            raise PyFlexExecutionError(
+                f"Error: Image size ({len(data)} B) doesn't match the flash chip's size ({size} B)!"
+            )
+        return ctypes.create_string_buffer(data, size)
+
+    def _check(self, result: int, operation: str) -> None:
+        if result != 0:
+            raise PyFlexExecutionError(f"{operation} operation failed!")
+
+    def _log(self, level: int, fmt: bytes, args: int) -> int:
+        # The message is formatted by vsnprintf because ctypes cannot unpack a
+        # va_list on its own.
+        buffer = ctypes.create_string_buffer(1024)
+        self._libc.vsnprintf(buffer, len(buffer), fmt, args)
+        text = buffer.value.decode('utf8', errors='replace')
+
+        if level > _LOG_INFO + self._verbosity:
+            return 0
+
+        # Messages are often logged in pieces, e.g. "Reading flash... " and
+        # "done.", so only complete lines are passed on.
+        *lines, self._partial = (self._partial + text).split("\n")
+        for line in lines:
+            self._add_line(line)
+
+        return 0
+
+    def _flush(self) -> None:
+        if self._partial:
+            self._add_line(self._partial)
+            self._partial = ""
+
+    def _add_line(self, line: str) -> None:
+        self._lines.append(line)
+        if self._on_output is None:
+            return
+        try:
+            self._on_output(line)
+        except Exception:
+            _log.exception("Output listener failed.")
+
+    def _progress(self, flashctx: int) -> None:
+        if self._on_progress is None:
+            return
+
+        state = self._progress_state
+        try:
+            self._on_progress(_PROGRESS_STAGES.get(state.stage, "unknown"), state.current, state.total)
+        except Exception:
+            _log.exception("Progress listener failed.")
@@ -1,10 +1,14 @@
 import subprocess
+import time
+from collections import deque
 from pathlib import Path
 from uuid import uuid4 as uuid
 from os import environ
-from typing import Optional
+from threading import Thread
+from typing import Callable, IO, Optional
 from logging import getLogger
 from pyflex.exceptions import PyFlexExecutionError
+from pyflex.output_parser import FlashROMOutputParser, phase_timings
 from pyflex.typing import (
     FlashROMActionEnum,
     FlashROMAdapter,
@@ -16,6 +20,107 @@ from pyflex.typing import (
 _log = getLogger(__name__)
 
 
+# The most read from a pipe at once.
+_READ_SIZE = 64 * 1024
+
+
+# Only the end of the output is kept for the result, all of it is passed to
+# on_output as it arrives. With -VVV FlashROM writes megabytes.
+MAX_OUTPUT_LINES = 1000
+
+
+class _TimedProcess(subprocess.CompletedProcess):
+    # A CompletedProcess that also knows when its output was written.
+    #
+    # timeline holds (started, finished, line) for the last lines of both
+    # streams, in seconds since the process was started. started is when the
+    # first part of the line arrived, which is when FlashROM announces a phase,
+    # e.g. "Reading flash... ", long before it writes "done." and the newline.
+    # Every line has been fed to parser as it arrived.
+
+    def __init__(
+        self,
+        *args,
+        spawn: float,
+        timeline: deque,
+        parser: Optional[FlashROMOutputParser] = None,
+        **kwargs,
+    ) -> None:
+        super().__init__(*args, **kwargs)
+        self.spawn = spawn
+        self.timeline = timeline
+        self.parser = parser
+
+
+class _Tail:
+    # Keeps the last lines of a stream and counts the ones that were dropped.
+
+    def __init__(self) -> None:
+        self.lines: deque[bytes] = deque(maxlen=MAX_OUTPUT_LINES)
+        self.dropped = 0
+
+    def append(self, line: bytes) -> None:
+        if len(self.lines) == self.lines.maxlen:
+            self.dropped += 1
+        self.lines.append(line)
+
+    def value(self) -> bytes:
+        omitted = f"[{self.dropped} earlier lines omitted]\n".encode() if self.dropped else b""
+        return omitted + b"".join(self.lines)
+
+
+class _LineTimer:
+    # Splits chunks read from a stream into lines and remembers when each line
+    # began and ended.
+
+    def __init__(self, origin: float) -> None:
+        self._origin = origin
+        self._pending = b""
+        self._started = 0.0
+
+    def feed(self, chunk: bytes) -> list[tuple[float, float, bytes]]:
+        now = time.monotonic() - self._origin
+        if not self._pending:
+            self._started = now
+        self._pending += chunk
+
+        lines = []
+        while (end := self._pending.find(b"\n")) >= 0:
+            lines.append((self._started, now, self._pending[:end + 1]))
+            self._pending = self._pending[end + 1:]
+            self._started = now
+        return lines
+
+    def flush(self) -> list[tuple[float, float, bytes]]:
+        if not self._pending:
+            return []
+        line, self._pending = self._pending, b""
+        return [(self._started, time.monotonic() - self._origin, line)]
+
+
+def _parse_response(result, elapsed=None):
+    # Lines are parsed while they are read, since only the last of them are
+    # kept. Anything else is parsed now.
+    parser = getattr(result, "parser", None)
+
+    if parser is None:
+        parser = FlashROMOutputParser()
+
+        timeline = getattr(result, "timeline", None)
+        if timeline is None:
+            timeline = [
+                (None, None, line)
+                for stream in (result.stdout, result.stderr)
+                for line in stream.splitlines()
+            ]
+
+        for started, finished, line in sorted(timeline, key=lambda event: event[0] or 0):
+            parser.feed(line.decode('utf8', errors='replace'), started, finished)
+
+    parser.finish(result.returncode, elapsed)
+    return parser.report()
+
+
 def _prepair_response(result):
     # TODO: Probably move this up to common library once it's needed.
 
@@ -51,11 +156,20 @@ class FlashROMShellCommandAdapter(FlashROMAdapter):
             An optional dictionary of environment variables to pass to the
             FlashROM utility.
 
+        on_output:
+            An optional callable that receives each line written by the FlashROM
+            utility as soon as it is available.
+
     Methods:
         run: Runs the FlashROM utility.
     """
 
-    def __init__(self, output_path: str, env: Optional[dict[str, str]] = None) -> None:
+    def __init__(
+        self,
+        output_path: str,
+        env: Optional[dict[str, str]] = None,
+        on_output: Optional[Callable[[str], None]] = None,
+    ) -> None:
 
         _log.debug(
             "Initilized FlashROMShellCommandAdapter with "
@@ -66,15 +180,97 @@ class FlashROMShellCommandAdapter(FlashROMAdapter):
 
         self._output_path = Path(output_path)
         self._env = env
+        self._on_output = on_output
 
     def _execute_subprocess(self, command: list) -> subprocess.CompletedProcess:
         _log.info("Running subprocess: %s", command)
-        return subprocess.run(
+
+        stdout, stderr = _Tail(), _Tail()
+        timeline = deque(maxlen=MAX_OUTPUT_LINES)
+        parser = FlashROMOutputParser()
+
+        started = time.monotonic()
+        with subprocess.Popen(
             args=command,
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE
+        ) as process:
+            spawn = time.monotonic() - started
+
+            # Both pipes are drained at the same time so that a chatty stderr
+            # cannot block the child while we are waiting on stdout.
+            readers = [
+                Thread(target=self._read_stream, args=(process.stdout, stdout, timeline, started, parser)),
+                Thread(target=self._read_stream, args=(process.stderr, stderr, timeline, started, parser)),
+            ]
+            for reader in readers:
+                reader.start()
+            for reader in readers:
+                reader.join()
+
+            returncode = self._reap(process)
+
+        return _TimedProcess(
+            args=command,
+            returncode=returncode,
+            stdout=stdout.value(),
+            stderr=stderr.value(),
+            spawn=spawn,
+            timeline=timeline,
+            parser=parser,
         )
 
+    def _reap(self, process: subprocess.Popen) -> int:
+        # Waits for the child once its output is drained. Subclasses may
+        # override it to measure the child, e.g. by reaping it with os.wait4.
+        return process.wait()
+
+    def _read_stream(
+        self,
+        stream: IO[bytes],
+        buffer: _Tail,
+        timeline: Optional[deque] = None,
+        origin: Optional[float] = None,
+        parser: Optional[FlashROMOutputParser] = None,
+    ) -> None:
+        # Read whatever is available rather than whole lines, so that we know
+        # when a line was started as well as when it was finished.
+        timer = _LineTimer(time.monotonic() if origin is None else origin)
+
+        while chunk := stream.read1(_READ_SIZE):
+            self._collect(timer.feed(chunk), buffer, timeline, parser)
+
+        self._collect(timer.flush(), buffer, timeline, parser)
+
+    def _collect(
+        self,
+        lines: list,
+        buffer: _Tail,
+        timeline: Optional[deque],
+        parser: Optional[FlashROMOutputParser] = None,
+    ) -> None:
+        for event in lines:
+            buffer.append(event[2])
+            if timeline is not None:
+                # deque.append is atomic, both readers may share the timeline.
+                timeline.append(event)
+            if parser is not None:
+                # Lines are parsed as they are finished, so the report does not
+                # depend on the tail that is kept.
+                parser.feed(event[2].decode('utf8', errors='replace'), event[0], event[1])
+            self._emit(event[2])
+
+    def _emit(self, line: bytes) -> None:
+        if self._on_output is None:
+            return
+
+        try:
+            self._on_output(line.decode('utf8', errors='replace').rstrip())
+        except Exception:
+            # A failing listener must not stop us from draining the pipe or
+            # the child process will block forever.
+            _log.exception("Output listener failed.")
+
     def _make_command(self, opts: FlashROMOpts) -> list:
 
         # This command is passed to subprocess which is considered safe.
@@ -94,6 +290,8 @@ class FlashROMShellCommandAdapter(FlashROMAdapter):
                 "-p", opts.programmer,
                 "-w", opts.input_path,
             ]);
+            if opts.flash_contents:
+                ret.extend(["--flash-contents", opts.flash_contents])
 
         elif opts.action == FlashROMActionEnum.ERASE:
             ret.extend([
@@ -113,10 +311,22 @@ class FlashROMShellCommandAdapter(FlashROMAdapter):
             file_name = f"{uuid()}.bin"
             ret.extend([
                 "-p", opts.programmer,
-                "-r", f'"{str(self._output_path / file_name)}"',
+                "-r", str(self._output_path / file_name),
             ])
 
         # Global Flags
+        if opts.chip:
+            ret.extend(["-c", opts.chip])
+        if opts.layout:
+            ret.extend(["-l", opts.layout])
+        if opts.ifd:
+            ret.append("--ifd")
+        if opts.fmap:
+            ret.append("--fmap")
+        for region in opts.include:
+            ret.extend(["--include", region])
+        if opts.verify_included_only:
+            ret.append("--noverify-all")
         if opts.force:
             ret.append("-f")
         if opts.verbosity > 0:
@@ -140,11 +350,21 @@ class FlashROMShellCommandAdapter(FlashROMAdapter):
         Returns:
             FlashROMExecResult:
                 contains the result data from FlashROM including the
-                message and binary file, if applicable.
+                message, a structured report and binary file, if applicable.
         """
 
         command, file_name = self._make_command(opts)
+        started = time.monotonic()
         result = self._execute_subprocess(command)
+        return self._make_result(result, file_name, time.monotonic() - started)
+
+    def _make_result(
+        self,
+        result: subprocess.CompletedProcess,
+        file_name: Optional[str],
+        elapsed: Optional[float] = None,
+    ) -> FlashROMExecResult:
+
         msg = _prepair_response(result)
 
         if result.returncode != 0:
@@ -161,4 +381,8 @@ class FlashROMShellCommandAdapter(FlashROMAdapter):
         else:
 
             _log.debug("FlashROM execution succeeded")
-            return FlashROMExecResult(msg, file_name)
+            report = _parse_response(result, elapsed)
+            timings = phase_timings(report)
+            if hasattr(result, "spawn"):
+                timings["spawn"] = result.spawn
+            return FlashROMExecResult(msg, file_name, report, timings)
@@ -0,0 +1,302 @@
+"""Load test the web tier in-process.
+
+Requests are made through the Flask test client, so no server or hardware is
+needed. FlashROM operations complete instantly, which leaves only the cost of
+the web tier: template rendering, upload handling and file serving. Run from
+the repository root, since the web tier finds its templates relative to it.
+Inputs, outputs and device locks are kept in a temporary directory which is
+removed afterwards, so a deployment on the same machine is not touched.
+
+Usage:
+    python -m benchmarks.http_load --concurrency 1,8,32 --requests 2000
+    python -m benchmarks.http_load --scenarios upload --upload-size 8 -o upload.json
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from itertools import count
+from pathlib import Path
+from threading import Lock
+from typing import Callable, Iterator, Optional
+from pyflex.chip_cache import ChipContentsCache, ChipProbeCache
+from pyflex.device_lock import DeviceManager
+from pyflex.exceptions import PyFlexNotFound
+from pyflex.image_store import ImageStore
+from pyflex.jobs import JobManager
+from pyflex.overview import OVERVIEW_PATTERN, DumpOverviews
+from pyflex.retention import DirectoryReaper
+from pyflex.typing import FlashROMAdapter, FlashROMExecResult, FlashROMOpts
+from webui import services, webapp
+
+
+SCENARIOS = ["index", "page", "upload", "output"]
+
+
+class InstantAdapter(FlashROMAdapter):
+    """A FlashROMAdapter that succeeds immediately without doing anything.
+
+    Methods:
+        run: Returns an empty result.
+    """
+
+    def __init__(self, output_path: str, on_output: Optional[Callable[[str], None]] = None) -> None:
+        self._on_output = on_output
+
+    def run(self, opts: FlashROMOpts) -> FlashROMExecResult:
+        if self._on_output is not None:
+            self._on_output("done.")
+        return FlashROMExecResult("done.")
+
+
+@contextmanager
+def _isolated() -> Iterator[None]:
+    # The web tier keeps its state in module globals of services and uses
+    # paths relative to the working directory and the root of the app. All of
+    # them are pointed at a temporary directory for the duration of the
+    # benchmark and put back afterwards. Templates and resources are linked
+    # into it from the repository.
+    names = [
+        "get_adapter", "_jobs", "_images", "_contents", "_probes",
+        "_devices", "_overviews", "_reapers", "_started",
+    ]
+    saved = {name: getattr(services, name) for name in names}
+    cwd = os.getcwd()
+    root_path = webapp.app.root_path
+
+    with tempfile.TemporaryDirectory(prefix="pyflex-http-load-") as root:
+        os.chdir(root)
+        Path("webui/inputs").mkdir(parents=True)
+        Path("webui/outputs").mkdir(parents=True)
+        for name in ("html", "resources"):
+            Path("webui", name).symlink_to(Path(root_path, "webui", name), target_is_directory=True)
+        webapp.app.root_path = root
+
+        images = ImageStore("webui/inputs/", max_file_size=services.MAX_INPUT_SIZE)
+        services.get_adapter = lambda on_output=None: InstantAdapter("webui/outputs/", on_output)
+        services._jobs = JobManager()
+        services._images = images
+        services._contents = ChipContentsCache(os.path.join(root, "locks"))
+        services._probes = ChipProbeCache()
+        services._devices = DeviceManager(os.path.join(root, "locks"))
+        overviews = DumpOverviews()
+        services._overviews = overviews
+        services._reapers = [
+            DirectoryReaper(
+                "webui/inputs/",
+                max_bytes=services.INPUT_QUOTA,
+                max_age=services.MAX_FILE_AGE,
+                delete=images.reclaim_path,
+            ),
+            DirectoryReaper(
+                "webui/outputs/",
+                max_bytes=services.OUTPUT_QUOTA,
+                max_age=services.MAX_FILE_AGE,
+                delete=overviews.delete,
+            ),
+            DirectoryReaper(
+                "webui/outputs/",
+                max_age=services.MAX_FILE_AGE,
+                pattern=OVERVIEW_PATTERN,
+            ),
+        ]
+        services._started = False
+
+        try:
+            yield
+        finally:
+            services._jobs.shutdown()
+            for reaper in services._reapers:
+                reaper.stop()
+            os.chdir(cwd)
+            webapp.app.root_path = root_path
+            for name, value in saved.items():
+                setattr(services, name, value)
+
+
+class _Scenario:
+    # Builds the requests of a scenario and cleans up after it.
+
+    def __init__(self, name: str, upload_size: int, output_size: int) -> None:
+        self.name = name
+        self._upload = os.urandom(upload_size)
+        self._output_size = output_size
+        self._output: Optional[Path] = None
+        self._counter = count()
+        self._jobs: list[str] = []
+        self._lock = Lock()
+
+    def setup(self) -> None:
+        if self.name == "output":
+            self._output = Path("webui/outputs") / "http-load.bin"
+            self._output.write_bytes(os.urandom(self._output_size))
+
+    def request(self, client) -> int:
+        if self.name == "index":
+            return client.get("/").status_code
+
+        if self.name == "page":
+            return client.get("/flashrom").status_code
+
+        if self.name == "output":
+            return client.get(f"/outputs/{self._output.name}").status_code
+
+        # Make every upload unique, otherwise the image store only keeps the
+        # first one and the rest are not written.
+        payload = next(self._counter).to_bytes(8) + self._upload[8:]
+        response = client.post("/api/flashrom", data={
+            "action": "write",
+            "programmer": "dummy",
+            "file-upload": (io.BytesIO(payload), "image.bin"),
+        })
+
+        if response.status_code == 202:
+            with self._lock:
+                self._jobs.append(response.json["id"])
+
+        return response.status_code
+
+    def teardown(self, before: set[Path]) -> None:
+        jobs = services.get_jobs()
+        for job_id in self._jobs:
+            try:
+                jobs.wait(job_id)
+            except PyFlexNotFound:
+                pass
+        self._jobs = []
+
+        if self._output is not None:
+            self._output.unlink()
+
+        images = services.get_images()
+        for path in set(Path("webui/inputs").glob("*/*.bin")) - before:
+            images.reclaim_path(path)
+
+
+def _percentile(latencies: list[float], percent: int) -> float:
+    if len(latencies) < 2:
+        return latencies[0]
+    return statistics.quantiles(latencies, n=100, method="inclusive")[percent - 1]
+
+
+def run_scenario(scenario: _Scenario, requests: int, concurrency: int) -> dict:
+    """Make a number of requests with a number of concurrent clients.
+
+    Arguments:
+        scenario:
+            The scenario to run.
+
+        requests:
+            The total number of requests to make.
+
+        concurrency:
+            The number of clients making requests at the same time.
+
+    Raises:
+        Nothing
+
+    Returns:
+        dict:
+            Latency percentiles in seconds, throughput in requests per second
+            and the number of failed requests.
+    """
+    before = set(Path("webui/inputs").glob("*/*.bin"))
+    scenario.setup()
+
+    def worker(share: int) -> list[tuple[float, int]]:
+        client = webapp.app.test_client()
+        samples = []
+        for _ in range(share):
+            started = time.perf_counter()
+            status = scenario.request(client)
+            samples.append((time.perf_counter() - started, status))
+        return samples
+
+    shares = [requests // concurrency + (i < requests % concurrency) for i in range(concurrency)]
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        samples = [sample for result in pool.map(worker, shares) for sample in result]
+    wall = time.perf_counter() - started
+
+    scenario.teardown(before)
+
+    latencies = [latency for latency, _ in samples]
+    return {
+        "scenario": scenario.name,
+        "concurrency": concurrency,
+        "requests": len(samples),
+        "errors": sum(status >= 400 for _, status in samples),
+        "throughput": len(samples) / wall,
+        "p50": _percentile(latencies, 50),
+        "p95": _percentile(latencies, 95),
+        "p99": _percentile(latencies, 99),
+    }
+
+
+def _format(result: dict) -> str:
+    return (
+        f"{result['scenario']:>7} x{result['concurrency']:<3} "
+        f"{result['throughput']:9.1f} req/s "
+        f"p50 {result['p50'] * 1000:8.2f}ms p95 {result['p95'] * 1000:8.2f}ms "
+        f"p99 {result['p99'] * 1000:8.2f}ms errors {result['errors']}"
+    )
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="Scenarios, comma separated.")
+    parser.add_argument("--concurrency", default="1,8,32", help="Concurrent clients, comma separated.")
+    parser.add_argument("--requests", type=int, default=1000, help="Requests per scenario and concurrency.")
+    parser.add_argument("--upload-size", type=float, default=1, help="Upload size in MiB.")
+    parser.add_argument("--output-size", type=float, default=1, help="Served file size in MiB.")
+    parser.add_argument("-o", "--output", help="Write the results to this JSON file.")
+    args = parser.parse_args(argv)
+
+    scenarios = args.scenarios.split(",")
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+    results = []
+    with _isolated():
+        for name in scenarios:
+            scenario = _Scenario(
+                name,
+                upload_size=int(args.upload_size * 1024 * 1024),
+                output_size=int(args.output_size * 1024 * 1024),
+            )
+            for concurrency in map(int, args.concurrency.split(",")):
+                result = run_scenario(scenario, args.requests, concurrency)
+                results.append(result)
+                print(_format(result), file=sys.stderr)
+
+    report = {
+        "environment": {
+            "date": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "upload_size": int(args.upload_size * 1024 * 1024),
+            "output_size": int(args.output_size * 1024 * 1024),
+        },
+        "results": results,
+    }
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+    else:
+        print(json.dumps(report, indent=2))
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,241 @@
+"""Measure end-to-end operation throughput against the dummy programmer.
+
+Every action is run through a FlashROMService against a chip emulated by
+the FlashROM dummy programmer. The adapter is MeasuredShellCommandAdapter,
+a FlashROMShellCommandAdapter that only changes how the child is reaped so
+that its resource usage is known. Unlike the web tier, the service has no
+caches, device lock, job queue or HTTP in front of it, so the results are
+the cost of the service and the FlashROM utility alone. Results are written
+as JSON so that releases can be compared.
+
+Usage:
+    python -m benchmarks.operations --sizes 1,4,16,64 --repeat 5 -o new.json
+    python -m benchmarks.operations --compare old.json new.json
+"""
+import argparse
+import json
+import os
+import platform
+import secrets
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Optional
+from pyflex import FlashROMService
+from adapters.flashrom import FlashROMShellCommandAdapter
+
+
+ACTIONS = ["probe", "read", "write", "verify", "erase"]
+
+
+# Actions that move the whole chip over the programmer.
+TRANSFER_ACTIONS = {"read", "write", "verify", "erase"}
+
+
+METRICS = ["wall", "spawn", "user", "system", "max_rss"]
+
+
+class MeasuredShellCommandAdapter(FlashROMShellCommandAdapter):
+    """A FlashROMShellCommandAdapter that records the cost of each process.
+
+    The child is reaped with wait4 through the _reap hook so that its own
+    resource usage is known, rather than the usage accumulated by all
+    children of this process. Everything else is inherited unchanged.
+
+    Methods:
+        run: Runs the FlashROM utility.
+    """
+
+    def __init__(self, output_path: str) -> None:
+        super().__init__(output_path)
+        self.last: Optional[dict] = None
+
+    def _reap(self, process: subprocess.Popen) -> int:
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+
+        self.last = {
+            "user": usage.ru_utime,
+            "system": usage.ru_stime,
+            # ru_maxrss is in KiB on Linux. The child starts out sharing our
+            # pages, so small chips report roughly our own size.
+            "max_rss": usage.ru_maxrss * 1024,
+        }
+        return process.returncode
+
+
+def _flashrom_version() -> Optional[str]:
+    try:
+        result = subprocess.run(["flashrom", "--version"], capture_output=True, check=False)
+    except FileNotFoundError:
+        return None
+    lines = result.stdout.decode('utf8', errors='replace').splitlines()
+    return lines[0] if lines else None
+
+
+def _run_once(workdir: Path, action: str, size: int, image: Path) -> dict:
+    chip = workdir / "chip.bin"
+    adapter = MeasuredShellCommandAdapter(workdir / "outputs")
+    service = FlashROMService(adapter, workdir / "inputs", output_directory=workdir / "outputs")
+    service.set_action(action)
+    service.set_programmer(f"dummy:emulate=VARIABLE_SIZE,size={size},image={chip}")
+
+    if action in ("write", "verify"):
+        with open(image, "rb") as stream:
+            service.set_file(stream)
+
+    started = time.perf_counter()
+    result = service.execute()
+    wall = time.perf_counter() - started
+
+    if result.path:
+        (workdir / "outputs" / result.path).unlink()
+
+    return {"wall": wall, "spawn": result.timings["spawn"], **adapter.last, "timings": result.timings}
+
+
+def _summarize(action: str, size: int, runs: list[dict]) -> dict:
+    median = {metric: statistics.median(run[metric] for run in runs) for metric in METRICS}
+    if action in TRANSFER_ACTIONS:
+        median["bytes_per_second"] = size / median["wall"]
+    return {"action": action, "size": size, "runs": runs, "median": median}
+
+
+def run(sizes: list[int], actions: list[str], repeat: int) -> dict:
+    """Run every action against every chip size.
+
+    Arguments:
+        sizes:
+            The chip sizes in bytes.
+
+        actions:
+            The actions to run, see ACTIONS.
+
+        repeat:
+            The number of times each action is run.
+
+    Raises:
+        PyFlexException:
+            Raised when an operation fails.
+
+    Returns:
+        dict:
+            The environment and the results, ready to be written as JSON.
+    """
+    results = []
+
+    for size in sizes:
+        with tempfile.TemporaryDirectory(prefix="pyflex-bench-") as workdir:
+            workdir = Path(workdir)
+            (workdir / "outputs").mkdir()
+            image = workdir / "image.bin"
+            image.write_bytes(secrets.token_bytes(size))
+
+            for action in actions:
+                # Verify compares against the image, so it must be on the chip.
+                if action == "verify":
+                    _run_once(workdir, "write", size, image)
+
+                runs = [_run_once(workdir, action, size, image) for _ in range(repeat)]
+                result = _summarize(action, size, runs)
+                results.append(result)
+                print(_format(result), file=sys.stderr)
+
+    return {
+        "environment": {
+            "date": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "flashrom": _flashrom_version(),
+            "repeat": repeat,
+        },
+        "results": results,
+    }
+
+
+def compare(baseline: dict, current: dict) -> list[str]:
+    """Compare the median wall time of two benchmark runs.
+
+    Arguments:
+        baseline:
+            The results of the earlier run.
+
+        current:
+            The results of the later run.
+
+    Raises:
+        Nothing
+
+    Returns:
+        list:
+            A line for each action and size found in both runs, with the
+            relative change. Positive changes are slower.
+    """
+    before = {(r["action"], r["size"]): r["median"]["wall"] for r in baseline["results"]}
+    lines = []
+
+    for result in current["results"]:
+        key = (result["action"], result["size"])
+        if key not in before:
+            continue
+        now = result["median"]["wall"]
+        change = (now - before[key]) / before[key] * 100
+        lines.append(
+            f"{result['action']:>7} {result['size'] // (1024 * 1024):>4} MiB "
+            f"{before[key]:9.3f}s -> {now:9.3f}s {change:+7.1f}%"
+        )
+
+    return lines
+
+
+def _format(result: dict) -> str:
+    median = result["median"]
+    line = (
+        f"{result['action']:>7} {result['size'] // (1024 * 1024):>4} MiB "
+        f"wall {median['wall']:8.3f}s spawn {median['spawn'] * 1000:7.2f}ms "
+        f"rss {median['max_rss'] / (1024 * 1024):7.1f}MiB"
+    )
+    if "bytes_per_second" in median:
+        line += f" {median['bytes_per_second'] / (1024 * 1024):8.2f}MiB/s"
+    return line
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="1,4,16,64", help="Chip sizes in MiB, comma separated.")
+    parser.add_argument("--actions", default=",".join(ACTIONS), help="Actions, comma separated.")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per action and size.")
+    parser.add_argument("-o", "--output", help="Write the results to this JSON file.")
+    parser.add_argument(
+        "--compare", nargs=2, metavar=("BASELINE", "CURRENT"),
+        help="Compare two result files instead of running.",
+    )
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        baseline, current = (json.loads(Path(path).read_text()) for path in args.compare)
+        print("\n".join(compare(baseline, current)))
+        return 0
+
+    actions = args.actions.split(",")
+    unknown = set(actions) - set(ACTIONS)
+    if unknown:
+        parser.error(f"Unknown actions: {', '.join(sorted(unknown))}")
+
+    sizes = [int(size) * 1024 * 1024 for size in args.sizes.split(",")]
+    report = run(sizes, actions, args.repeat)
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+    else:
+        print(json.dumps(report, indent=2))
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,261 @@
+import json
+import os
+import time
+from dataclasses import dataclass
+from logging import getLogger
+from pathlib import Path
+from threading import Lock
+from typing import Any, Optional
+from .device_lock import DEFAULT_LOCK_DIRECTORY, device_name
+from .models import FlashROMChip
+
+
+_log = getLogger(__name__)
+
+
+@dataclass
+class _Entry:
+    value: Any
+    recorded: float
+
+
+class _ProgrammerCache:
+    # Entries are kept per programmer string and expire after ttl seconds.
+
+    def __init__(self, ttl: float) -> None:
+        self._ttl = ttl
+        self._entries: dict[str, _Entry] = {}
+        self._lock = Lock()
+
+    def _record(self, programmer: str, value: Any) -> None:
+        with self._lock:
+            self._entries[programmer] = _Entry(value, time.monotonic())
+
+    def _get(self, programmer: str) -> Any:
+        with self._lock:
+            entry = self._entries.get(programmer)
+
+            if entry is None:
+                return None
+
+            if time.monotonic() - entry.recorded > self._ttl:
+                del self._entries[programmer]
+                return None
+
+            return entry.value
+
+    def invalidate(self, programmer: str) -> None:
+        """Forget what is known about the chip on a programmer.
+
+        Arguments:
+            programmer:
+                The programmer string the chip is accessed with.
+
+        Raises:
+            Nothing
+        """
+        with self._lock:
+            if self._entries.pop(programmer, None) is not None:
+                _log.debug("%s forgot chip on %s", type(self).__name__, programmer)
+
+
+class ChipContentsCache:
+    """Remember the last known contents of the chip on each programmer.
+
+    The FlashROM utility reads the whole chip before writing it so it knows which
+    blocks must be erased. When the contents are already known, from a read,
+    write or verify that just succeeded, that image can be given to the utility
+    instead and the read is skipped.
+
+    Entries are kept in files next to the lock files of the DeviceManager, so
+    every worker process sees what the others did to a chip. Operations on a
+    programmer hold its lock, so an entry cannot change during one. Entries are
+    keyed on the chip that was detected, so a different chip is not taken for
+    the one that was recorded.
+
+    A chip swapped for one of the same kind, or changed by anything but PyFlex,
+    cannot be noticed. Entries expire after a while for that reason, but they
+    may be stale until then. A write that uses a stale entry can skip erasing
+    blocks that needed it. It still fails as long as the FlashROM utility
+    verifies the whole chip afterwards, but the chip is left partly written.
+    Entries must not be used to skip verifying or erasing parts of the chip.
+
+    Arguments:
+        directory:
+            The directory to keep entries in. Use the lock directory of the
+            DeviceManager.
+
+        ttl:
+            The number of seconds an entry stays valid.
+
+    Methods:
+        record:
+            Remember the image that the chip on a programmer now contains.
+
+        get:
+            Get the image the chip on a programmer is known to contain.
+
+        invalidate:
+            Forget what is known about the chip on a programmer.
+    """
+
+    def __init__(self, directory: Optional[str] = None, ttl: float = 600) -> None:
+        self._directory = Path(directory or DEFAULT_LOCK_DIRECTORY)
+        self._ttl = ttl
+
+    def record(self, programmer: str, chip: Optional[str], path: Path) -> None:
+        """Remember the image that the chip on a programmer now contains.
+
+        Arguments:
+            programmer:
+                The programmer string the chip was accessed with.
+
+            chip:
+                The name of the chip that was detected. What is known about the
+                chip is forgotten if None, since the image cannot be tied to it.
+
+            path:
+                An image with the same content as the chip.
+
+        Raises:
+            Nothing
+        """
+        if chip is None:
+            self.invalidate(programmer)
+            return
+
+        entry = {"chip": chip, "path": str(Path(path).resolve()), "recorded": time.time()}
+
+        try:
+            self._directory.mkdir(parents=True, exist_ok=True)
+            partial = self._entry_path(programmer).with_suffix(f".{os.getpid()}.part")
+            partial.write_text(json.dumps(entry))
+            partial.replace(self._entry_path(programmer))
+        except OSError:
+            _log.exception("Unable to record the contents of the chip on %s", programmer)
+            self.invalidate(programmer)
+            return
+
+        _log.debug("Chip %s on %s contains %s", chip, programmer, path)
+
+    def get(self, programmer: str, chip: Optional[str]) -> Optional[Path]:
+        """Get the image the chip on a programmer is known to contain.
+
+        Arguments:
+            programmer:
+                The programmer string the chip is accessed with.
+
+            chip:
+                The name of the chip that is expected on the programmer.
+
+        Raises:
+            Nothing
+
+        Returns:
+            Path:
+                The image, or None if the contents are unknown, were recorded
+                for another chip, expired or the image no longer exists.
+        """
+        if chip is None:
+            return None
+
+        try:
+            entry = json.loads(self._entry_path(programmer).read_text())
+            path = Path(entry["path"])
+            valid = (
+                entry["chip"] == chip
+                and 0 <= time.time() - entry["recorded"] <= self._ttl
+                and path.exists()
+            )
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, TypeError):
+            _log.warning("Ignoring unreadable contents of the chip on %s", programmer)
+            valid = False
+
+        if not valid:
+            self.invalidate(programmer)
+            return None
+
+        return path
+
+    def invalidate(self, programmer: str) -> None:
+        """Forget what is known about the chip on a programmer.
+
+        Arguments:
+            programmer:
+                The programmer string the chip is accessed with.
+
+        Raises:
+            Nothing
+        """
+        try:
+            self._entry_path(programmer).unlink()
+        except FileNotFoundError:
+            return
+        except OSError:
+            _log.exception("Unable to forget the contents of the chip on %s", programmer)
+            return
+
+        _log.debug("%s forgot chip on %s", type(self).__name__, programmer)
+
+    def _entry_path(self, programmer: str) -> Path:
+        return self._directory / f"{device_name(programmer)}.contents"
+
+
+class ChipProbeCache(_ProgrammerCache):
+    """Remember the chip detected on each programmer.
+
+    Every operation makes the FlashROM utility probe its whole chip database
+    unless a chip is named. Remembering the result of a probe lets later
+    operations name the chip and skip that work.
+
+    Arguments:
+        ttl:
+            The number of seconds an entry stays valid.
+
+    Methods:
+        record:
+            Remember the chip detected on a programmer.
+
+        get:
+            Get the chip detected on a programmer.
+
+        invalidate:
+            Forget what is known about the chip on a programmer.
+    """
+
+    def __init__(self, ttl: float = 600) -> None:
+        super().__init__(ttl)
+
+    def record(self, programmer: str, chip: FlashROMChip) -> None:
+        """Remember the chip detected on a programmer.
+
+        Arguments:
+            programmer:
+                The programmer string the chip was detected with.
+
+            chip:
+                The chip that was detected.
+
+        Raises:
+            Nothing
+        """
+        self._record(programmer, chip)
+        _log.debug("Chip on %s is %s", programmer, chip.name)
+
+    def get(self, programmer: str) -> Optional[FlashROMChip]:
+        """Get the chip detected on a programmer.
+
+        Arguments:
+            programmer:
+                The programmer string the chip is accessed with.
+
+        Raises:
+            Nothing
+
+        Returns:
+            FlashROMChip:
+                The chip, or None if it is unknown or the entry expired.
+        """
+        return self._get(programmer)
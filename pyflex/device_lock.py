@@ -0,0 +1,289 @@
+import asyncio
+import fcntl
+import os
+import tempfile
+from collections import deque
+from contextlib import contextmanager
+from hashlib import sha256
+from logging import getLogger
+from pathlib import Path
+from threading import Condition
+from typing import Iterator, Optional
+
+
+_log = getLogger(__name__)
+
+
+DEFAULT_LOCK_DIRECTORY = Path(tempfile.gettempdir()) / "pyflex-locks"
+
+
+def device_name(programmer: str) -> str:
+    """Get the name of the files kept for a programmer in the lock directory.
+
+    Arguments:
+        programmer:
+            The programmer string of the device.
+
+    Raises:
+        Nothing
+
+    Returns:
+        str:
+            A name that is safe to use in a path.
+    """
+    return sha256(programmer.encode('utf8')).hexdigest()[:32]
+
+
+class _AsyncTicket:
+    # A place in the queue of a coroutine. It is woken through its event loop
+    # rather than the condition the threads wait on.
+
+    def __init__(self, loop: asyncio.AbstractEventLoop) -> None:
+        self._loop = loop
+        self.ready = asyncio.Event()
+
+    def wake(self) -> None:
+        self._loop.call_soon_threadsafe(self.ready.set)
+
+
+class _DeviceQueue:
+
+    def __init__(self) -> None:
+        self.waiting: deque[object] = deque()
+        self.fd: Optional[int] = None
+
+
+class DeviceManager:
+    """Serialize operations on each programmer.
+
+    Only one operation may use a programmer at a time, otherwise two FlashROM
+    processes end up fighting over the same bus. Operations on different
+    programmers run in parallel. Within a process, operations on the same
+    programmer are granted in the order they asked. Between processes a file
+    lock is used, so several workers of the web tier can share the hardware.
+
+    Programmers are identified by their full programmer string.
+
+    Arguments:
+        lock_directory:
+            The directory to keep lock files in. Every process that shares the
+            programmers must use the same directory.
+
+    Methods:
+        lock:
+            Context manager that holds a programmer for the duration of a block.
+
+        acquire:
+            Wait for and take a programmer.
+
+        acquire_async:
+            Wait for and take a programmer without blocking the event loop.
+
+        release:
+            Give a programmer back.
+
+        queue_depth:
+            Get the number of operations holding or waiting for a programmer.
+
+        queue_depths:
+            Get the queue depth of every programmer in use.
+    """
+
+    def __init__(self, lock_directory: Optional[str] = None) -> None:
+        self._lock_directory = Path(lock_directory or DEFAULT_LOCK_DIRECTORY)
+        self._queues: dict[str, _DeviceQueue] = {}
+        self._changed = Condition()
+
+    @contextmanager
+    def lock(self, programmer: str) -> Iterator[None]:
+        """Context manager that holds a programmer for the duration of a block.
+
+        Arguments:
+            programmer:
+                The programmer string of the device to hold.
+
+        Raises:
+            Nothing
+        """
+        self.acquire(programmer)
+        try:
+            yield
+        finally:
+            self.release(programmer)
+
+    def acquire(self, programmer: str) -> None:
+        """Wait for and take a programmer.
+
+        Arguments:
+            programmer:
+                The programmer string of the device to take.
+
+        Raises:
+            Nothing
+        """
+        ticket = object()
+
+        with self._changed:
+            queue = self._queues.setdefault(programmer, _DeviceQueue())
+            queue.waiting.append(ticket)
+            if queue.waiting[0] is not ticket:
+                _log.debug("Waiting for %s (%s queued)", programmer, len(queue.waiting) - 1)
+            self._changed.wait_for(lambda: queue.waiting[0] is ticket)
+
+        # Only the head of the queue gets here, so the file lock is taken by one
+        # thread per process. Other processes may still hold it.
+        try:
+            queue.fd = self._lock_file(programmer)
+        except BaseException:
+            self._leave(programmer, queue)
+            raise
+
+        _log.debug("Acquired %s", programmer)
+
+    async def acquire_async(self, programmer: str) -> None:
+        """Wait for and take a programmer without blocking the event loop.
+
+        Waiting for other operations of this process does not take a thread.
+        Only waiting for the file lock, held by another process, does. When the
+        caller is cancelled, its place in the queue is given up, or the
+        programmer is given back as soon as the file lock is taken.
+
+        Arguments:
+            programmer:
+                The programmer string of the device to take.
+
+        Raises:
+            Nothing
+        """
+        loop = asyncio.get_running_loop()
+        ticket = _AsyncTicket(loop)
+
+        with self._changed:
+            queue = self._queues.setdefault(programmer, _DeviceQueue())
+            queue.waiting.append(ticket)
+            if queue.waiting[0] is ticket:
+                ticket.ready.set()
+            else:
+                _log.debug("Waiting for %s (%s queued)", programmer, len(queue.waiting) - 1)
+
+        try:
+            await ticket.ready.wait()
+        except asyncio.CancelledError:
+            self._give_up(programmer, queue, ticket)
+            raise
+
+        locking = loop.run_in_executor(None, self._lock_file, programmer)
+
+        def abandon(future: asyncio.Future) -> None:
+            if not future.cancelled() and future.exception() is None:
+                fd = future.result()
+                fcntl.flock(fd, fcntl.LOCK_UN)
+                os.close(fd)
+            self._leave(programmer, queue)
+
+        try:
+            queue.fd = await asyncio.shield(locking)
+        except asyncio.CancelledError:
+            locking.add_done_callback(abandon)
+            raise
+        except BaseException:
+            self._leave(programmer, queue)
+            raise
+
+        _log.debug("Acquired %s", programmer)
+
+    def release(self, programmer: str) -> None:
+        """Give a programmer back.
+
+        Arguments:
+            programmer:
+                The programmer string of the device taken with acquire.
+
+        Raises:
+            Nothing
+        """
+        with self._changed:
+            queue = self._queues[programmer]
+            fd, queue.fd = queue.fd, None
+
+        if fd is not None:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+        self._leave(programmer, queue)
+        _log.debug("Released %s", programmer)
+
+    def queue_depth(self, programmer: str) -> int:
+        """Get the number of operations holding or waiting for a programmer.
+
+        Only operations of this process are counted.
+
+        Arguments:
+            programmer:
+                The programmer string of the device.
+
+        Raises:
+            Nothing
+
+        Returns:
+            int:
+                The number of operations in the queue.
+        """
+        with self._changed:
+            queue = self._queues.get(programmer)
+            return len(queue.waiting) if queue else 0
+
+    def queue_depths(self) -> dict[str, int]:
+        """Get the queue depth of every programmer in use.
+
+        Arguments:
+            Nothing
+
+        Raises:
+            Nothing
+
+        Returns:
+            dict:
+                The number of operations in the queue by programmer string.
+        """
+        with self._changed:
+            return {
+                programmer: len(queue.waiting)
+                for programmer, queue in self._queues.items()
+            }
+
+    def _leave(self, programmer: str, queue: _DeviceQueue) -> None:
+        with self._changed:
+            queue.waiting.popleft()
+            self._wake(queue)
+            if not queue.waiting:
+                del self._queues[programmer]
+            self._changed.notify_all()
+
+    def _give_up(self, programmer: str, queue: _DeviceQueue, ticket: _AsyncTicket) -> None:
+        with self._changed:
+            if queue.waiting[0] is not ticket:
+                queue.waiting.remove(ticket)
+                return
+        # Woken, but cancelled before it could take the file lock.
+        self._leave(programmer, queue)
+
+    def _wake(self, queue: _DeviceQueue) -> None:
+        # Threads are woken by notify_all.
+        while queue.waiting and isinstance(queue.waiting[0], _AsyncTicket):
+            try:
+                queue.waiting[0].wake()
+                return
+            except RuntimeError:
+                # The event loop was closed, nobody is waiting any more.
+                queue.waiting.popleft()
+
+    def _lock_file(self, programmer: str) -> int:
+        self._lock_directory.mkdir(parents=True, exist_ok=True)
+        fd = os.open(self._lock_directory / f"{device_name(programmer)}.lock", os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        except BaseException:
+            os.close(fd)
+            raise
+        return fd
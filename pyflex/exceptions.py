@@ -8,3 +8,7 @@ class PyFlexExecutionError(PyFlexException):
 
 class PyFlexInvalidParameter(PyFlexException):
     ...
+
+
+class PyFlexNotFound(PyFlexException):
+    ...
@@ -1,10 +1,25 @@
+import asyncio
+import hashlib
+import tempfile
+import time
+import weakref
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import replace
 from pathlib import Path
 from logging import getLogger
-from uuid import uuid4 as uuid
-from . import exceptions
-from .typing import CommandDispatcher, FlashROMAdapter
+from typing import AsyncIterator, BinaryIO, Iterator, Optional, Union
+from . import exceptions, imagediff
+from .chip_cache import ChipContentsCache, ChipProbeCache
+from .device_lock import DeviceManager
+from .layout import parse_layout, render_layout, validate_region_name
+from .image_store import ImageStore
+from .metrics import OperationMetrics
+from .overview import DumpOverviews
+from .typing import AsyncFlashROMAdapter, CommandDispatcher, FlashROMAdapter, SessionFlashROMAdapter
 from .models import (
     FlashROMActionEnum,
+    FlashROMBlankCheck,
+    FlashROMHashCheck,
     FlashROMOpts,
     FlashROMExecResult,
 )
@@ -13,6 +28,16 @@ from .models import (
 _log = getLogger(__name__)
 
 
+_ACTIONS = {
+    "probe": FlashROMActionEnum.PROBE,
+    "erase": FlashROMActionEnum.ERASE,
+    "write": FlashROMActionEnum.WRITE,
+    "read": FlashROMActionEnum.READ,
+    "verify": FlashROMActionEnum.VERIFY,
+    "blank-check": FlashROMActionEnum.BLANK_CHECK,
+}
+
+
 class FlashROMService(CommandDispatcher[FlashROMExecResult]):
     """Manage execution of the FlashROM utility.
 
@@ -26,17 +51,56 @@ class FlashROMService(CommandDispatcher[FlashROMExecResult]):
 
         input_directory:
             The path used to store input files that are passed the the FlashROM utiity.
+            Files are stored by content, see ImageStore.
+
+        max_file_size:
+            The largest input file, in bytes, that will be accepted. Input files
+            are not limited if None.
+
+        output_directory:
+            The path the adapter writes output files to. Needed to remember the
+            contents of chips that are read.
+
+        contents_cache:
+            An optional ChipContentsCache, shared between services, used to skip
+            reading the chip before a write when its contents are already known.
+            Only used for chips named by the probe_cache.
+
+        probe_cache:
+            An optional ChipProbeCache, shared between services, used to name the
+            chip found by the last probe so that other actions skip detection.
+
+        device_manager:
+            An optional DeviceManager, shared between services, used to make
+            operations on the same programmer wait for each other.
+
+        metrics:
+            An optional OperationMetrics, shared between services, that counts
+            operations and records how long the adapter takes for them.
+
+        overviews:
+            An optional DumpOverviews used to summarize every file that is read
+            from a chip, so that the summary is ready when it is looked at.
 
     Methods:
         set_action:
             Set the action for this execution.
 
+        set_pipeline:
+            Run several actions, in order, as one execution.
+
         set_programmer:
             Set the programmer to use for this execution.
 
         set_file:
             Set the data to use as the input file.
 
+        set_image:
+            Use an image that is already held in the input directory as the input file.
+
+        set_expected_hash:
+            Verify the chip against the SHA-256 of an image instead of the image.
+
         set_verbosity:
             Set the verbosity level for this execution.
 
@@ -46,27 +110,105 @@ class FlashROMService(CommandDispatcher[FlashROMExecResult]):
         unset_force:
             Disable the Force option when executing the FlashROM utility.
 
+        set_reuse_contents:
+            Allow writes to skip reading the chip when its contents are known.
+
+        unset_reuse_contents:
+            Always read the chip before writing it.
+
+        set_partial_write:
+            Allow writes to only touch the blocks that changed when the chip
+            contents are known.
+
+        unset_partial_write:
+            Always write the whole image.
+
+        set_partial_erase:
+            Allow erases to skip the blocks that are known to be erased.
+
+        unset_partial_erase:
+            Always erase the whole chip.
+
+        set_layout:
+            Use a FlashROM layout file to name the regions of the chip.
+
+        set_ifd:
+            Read the regions of the chip from its Intel Firmware Descriptor.
+
+        set_fmap:
+            Read the regions of the chip from its flashmap.
+
+        set_include:
+            Limit read, write and verify to the named regions.
+
+        set_autodetect:
+            Always let the FlashROM utility detect the chip.
+
+        unset_autodetect:
+            Name the chip found by the last probe when it is known.
+
+        validate:
+            Check the configured options without executing the FlashROM utility.
+
         execute:
             Execute the FlashROM utililty with the configured options.
+
+        execute_async:
+            Execute the FlashROM utililty without blocking the event loop.
     """
 
-    def __init__(self, adapter: FlashROMAdapter, input_directory: str) -> None:
+    def __init__(
+        self,
+        adapter: FlashROMAdapter,
+        input_directory: str,
+        max_file_size: Optional[int] = None,
+        output_directory: Optional[str] = None,
+        contents_cache: Optional[ChipContentsCache] = None,
+        probe_cache: Optional[ChipProbeCache] = None,
+        device_manager: Optional[DeviceManager] = None,
+        metrics: Optional[OperationMetrics] = None,
+        overviews: Optional[DumpOverviews] = None,
+    ) -> None:
         self._adapter = adapter
-        self._input_directory = Path(input_directory)
+        self._images = ImageStore(input_directory, max_file_size)
+        self._output_directory = Path(output_directory) if output_directory else None
+        self._contents = contents_cache
+        self._probes = probe_cache
+        self._devices = device_manager
+        self._metrics = metrics
+        self._overviews = overviews
 
         self._action = None
+        self._pipeline: list[FlashROMActionEnum] = []
         self._programmer = None
         self._verbosity = 0
         self._force = False
-        self._file_name = None
+        self._reuse_contents = True
+        self._partial_write = True
+        self._partial_erase = True
+        self._autodetect = False
+        self._layout = None
+        self._ifd = False
+        self._fmap = False
+        self._include: list[str] = []
+        self._file_hash = None
+        self._file_reference = None
+        self._expected_hash = None
+        self._timings: dict[str, float] = {}
+        # A file known to match the chip because it was read, written or
+        # verified while the device is held. Unlike the contents cache, it is
+        # never stale.
+        self._held_contents: Optional[Path] = None
 
     def set_action(self, action: str) -> None:
         """Set the action for this execution.
 
         Arguments:
             action:
-                A string containing one of "probe", "erase", "write", "read", or
-                "verify". Any other option will result in an error.
+                A string containing one of "probe", "erase", "write", "read",
+                "verify" or "blank-check". Any other option will result in an
+                error. A blank check reads the chip and reports the blocks that
+                are not erased.
 
         Raises:
             PyFlexInvalidParameter:
@@ -74,19 +216,44 @@ class FlashROMService(CommandDispatcher[FlashROMExecResult]):
         """
 
         try:
-            self._action = {
-                "probe": FlashROMActionEnum.PROBE,
-                "erase": FlashROMActionEnum.ERASE,
-                "write": FlashROMActionEnum.WRITE,
-                "read": FlashROMActionEnum.READ,
-                "verify": FlashROMActionEnum.VERIFY,
-            }[action]
+            self._action = _ACTIONS[action]
             _log.debug("Action: %s", self._action)
 
         except KeyError as ex:
             _log.error("Invalid value for ACTION: %s", action)
             raise exceptions.PyFlexInvalidParameter("Invalid value for ACTION.")
 
+    def set_pipeline(self, actions: list[str]) -> None:
+        """Run several actions, in order, as one execution.
+
+        The programmer is held for the whole pipeline and what a step learns
+        about the chip is used by the next, e.g. a probe names the chip for the
+        steps after it. The pipeline stops at the first step that fails.
+
+        A verify after a write is skipped when the write verified the whole
+        chip already. A read after a write also compares the SHA-256 of the
+        dump with the input file, and fails the pipeline if they differ.
+
+        Arguments:
+            actions:
+                The actions, as accepted by set_action.
+
+        Raises:
+            PyFlexInvalidParameter:
+                Raised if there are no actions or an action is invalid.
+        """
+        try:
+            pipeline = [_ACTIONS[action] for action in actions]
+        except KeyError:
+            _log.error("Invalid value for PIPELINE: %s", actions)
+            raise exceptions.PyFlexInvalidParameter("Invalid value for PIPELINE.")
+
+        if not pipeline:
+            raise exceptions.PyFlexInvalidParameter("Invalid value for PIPELINE.")
+
+        self._pipeline = pipeline
+        _log.debug("Pipeline: %s", self._pipeline)
+
     def set_programmer(self, programmer: str) -> None:
         """Set the programmer to use for this execution.
 
@@ -100,27 +267,80 @@ class FlashROMService(CommandDispatcher[FlashROMExecResult]):
         self._programmer = programmer
         _log.debug("Programmer: %s", programmer)
 
-    def set_file(self, data: bytes) -> None:
+    def set_file(self, data: Union[bytes, BinaryIO]) -> None:
         """Set the data to use as the input file.
 
+        The data is copied to the input directory in fixed-size chunks and hashed
+        along the way, so a file-like object is never read into memory at once.
+        Data that is already held by the input directory is not written again.
+        The file is referenced until it has been used or the service is
+        discarded, so it cannot be reclaimed in the meantime.
+
         Arguments:
             data:
-                Bytes to use as the input file.
+                Bytes or a readable binary file-like object to use as the input
+                file.
 
         Raises:
-            Nothing
+            PyFlexInvalidParameter:
+                Raised if the data is empty or larger than max_file_size.
         """
         try:
-            file_path = self._file_path(f"{uuid()}.bin")
-            with open(file_path, 'wb') as fd:
-                fd.write(data)
-            _log.debug("File uploaded to %s", file_path)
+            started = time.monotonic()
+            self._hold_file(self._images.put(data, acquire=True))
+            self._timings["upload"] = time.monotonic() - started
+            _log.debug("File uploaded with sha256=%s", self._file_hash)
+
+        except exceptions.PyFlexException:
+            raise
+
         except Exception:
             # Trapping this because it could fail and it will bubble all the way
             # out to the UI. Logs should capture this event if it happens.
             _log.error("Unexpected error while writing input file.")
             raise
 
+    def set_image(self, digest: str) -> None:
+        """Use an image that is already held in the input directory as the input file.
+
+        Arguments:
+            digest:
+                The hex SHA-256 digest of the image.
+
+        Raises:
+            PyFlexInvalidParameter:
+                Raised if the digest is malformed or the image is unknown.
+        """
+        try:
+            self._images.acquire(digest)
+        except exceptions.PyFlexNotFound:
+            _log.error("Unknown input image: %s", digest)
+            raise exceptions.PyFlexInvalidParameter("Unknown input image.")
+
+        self._hold_file(digest.lower())
+        _log.debug("File selected with sha256=%s", self._file_hash)
+
+    def set_expected_hash(self, digest: str) -> None:
+        """Verify the chip against the SHA-256 of an image instead of the image.
+
+        The chip is read and the SHA-256 of its contents is compared with the
+        digest, so the image need not be uploaded. The execution fails if they
+        differ. When the input directory holds the image, the first block that
+        differs is reported as well.
+
+        Arguments:
+            digest:
+                The hex SHA-256 digest of the expected image.
+
+        Raises:
+            PyFlexInvalidParameter:
+                Raised if the digest is malformed.
+        """
+        # The store knows what a well-formed digest looks like.
+        self._images.path(digest)
+        self._expected_hash = digest.lower()
+        _log.debug("Expected sha256=%s", self._expected_hash)
+
     def set_verbosity(self, value: int) -> None:
         """Set the verbosity level for this execution.
 
@@ -163,6 +383,220 @@ class FlashROMService(CommandDispatcher[FlashROMExecResult]):
         self._force = False
         _log.debug("Force flag: False")
 
+    def set_reuse_contents(self) -> None:
+        """Allow writes to skip reading the chip when its contents are known.
+
+        This is the default when a ChipContentsCache is given.
+
+        Arguments:
+            Nothing
+
+        Raises:
+            Nothing
+        """
+        self._reuse_contents = True
+        _log.debug("Reuse contents: True")
+
+    def unset_reuse_contents(self) -> None:
+        """Always read the chip before writing it.
+
+        Arguments:
+            Nothing
+
+        Raises:
+            Nothing
+        """
+        self._reuse_contents = False
+        _log.debug("Reuse contents: False")
+
+    def set_partial_write(self) -> None:
+        """Allow writes to only touch the blocks that changed when the chip contents are known.
+
+        The image is compared with the known contents of the chip and a layout
+        that covers only the changed erase blocks is given to the FlashROM
+        utility. The whole chip is still verified afterwards, unless its
+        contents were read, written or verified earlier in the same pipeline.
+        This is the default when a ChipContentsCache is given.
+
+        Arguments:
+            Nothing
+
+        Raises:
+            Nothing
+        """
+        self._partial_write = True
+        _log.debug("Partial write: True")
+
+    def unset_partial_write(self) -> None:
+        """Always write the whole image.
+
+        Arguments:
+            Nothing
+
+        Raises:
+            Nothing
+        """
+        self._partial_write = False
+        _log.debug("Partial write: False")
+
+    def set_partial_erase(self) -> None:
+        """Allow erases to skip the blocks that are known to be erased.
+
+        When the contents of the chip were read, written or verified earlier
+        in the same pipeline, e.g. by a blank check, they are scanned for
+        blocks that are not all 0xFF. The erase is skipped if there are none,
+        otherwise only those blocks are erased when they are less than half of
+        the chip. Otherwise the whole chip is erased. This is the default.
+
+        Arguments:
+            Nothing
+
+        Raises:
+            Nothing
+        """
+        self._partial_erase = True
+        _log.debug("Partial erase: True")
+
+    def unset_partial_erase(self) -> None:
+        """Always erase the whole chip.
+
+        Arguments:
+            Nothing
+
+        Raises:
+            Nothing
+        """
+        self._partial_erase = False
+        _log.debug("Partial erase: False")
+
+    def set_layout(self, text: Union[str, bytes]) -> None:
+        """Use a FlashROM layout file to name the regions of the chip.
+
+        Arguments:
+            text:
+                The content of the layout file. Each line holds a region as
+                "start:end name" with hexadecimal, inclusive offsets.
+
+        Raises:
+            PyFlexInvalidParameter:
+                Raised if the layout is malformed.
+        """
+        if isinstance(text, bytes):
+            try:
+                text = text.decode("ascii")
+            except UnicodeDecodeError:
+                raise exceptions.PyFlexInvalidParameter("Invalid value for LAYOUT.")
+
+        self._layout = parse_layout(text)
+        _log.debug("Layout: %s", self._layout)
+
+    def set_ifd(self) -> None:
+        """Read the regions of the chip from its Intel Firmware Descriptor.
+
+        Arguments:
+            Nothing
+
+        Raises:
+            Nothing
+        """
+        self._ifd = True
+        _log.debug("IFD: True")
+
+    def set_fmap(self) -> None:
+        """Read the regions of the chip from its flashmap.
+
+        Arguments:
+            Nothing
+
+        Raises:
+            Nothing
+        """
+        self._fmap = True
+        _log.debug("FMAP: True")
+
+    def set_include(self, regions: list[str]) -> None:
+        """Limit read, write and verify to the named regions.
+
+        The regions are named by the layout, the IFD or the flashmap. Only the
+        included regions are written and verified, the rest of the chip is left
+        alone.
+
+        Arguments:
+            regions:
+                The names of the regions.
+
+        Raises:
+            PyFlexInvalidParameter:
+                Raised if a name is not a valid region name.
+        """
+        self._include = list(dict.fromkeys(validate_region_name(name) for name in regions))
+        _log.debug("Include: %s", self._include)
+
+    def set_autodetect(self) -> None:
+        """Always let the FlashROM utility detect the chip.
+
+        Arguments:
+            Nothing
+
+        Raises:
+            Nothing
+        """
+        self._autodetect = True
+        _log.debug("Autodetect: True")
+
+    def unset_autodetect(self) -> None:
+        """Name the chip found by the last probe when it is known.
+
+        This is the default when a ChipProbeCache is given.
+
+        Arguments:
+            Nothing
+
+        Raises:
+            Nothing
+        """
+        self._autodetect = False
+        _log.debug("Autodetect: False")
+
+    def add_timing(self, name: str, seconds: float) -> None:
+        """Add a timing measured by the caller to the result.
+
+        Use this for work done on behalf of the execution before it starts,
+        e.g. receiving the request that asked for it.
+
+        Arguments:
+            name:
+                The name of the timing.
+
+            seconds:
+                The duration in seconds.
+
+        Raises:
+            Nothing
+        """
+        self._timings[name] = seconds
+
+    def validate(self) -> None:
+        """Check the configured options without executing the FlashROM utility.
+
+        This is useful when execution is deferred, so that invalid requests can be
+        rejected before they are queued.
+
+        Arguments:
+            Nothing
+
+        Raises:
+            PyFlexInvalidParameter:
+                Raised when the service detects a missing or inconsistant parameters.
+
+            PyFlexExecutionError:
+                Raised when the input file is expected but missing.
+        """
+        if self._pipeline:
+            self._check_pipeline()
+        else:
+            self._build_opts()
+
     def execute(self) -> FlashROMExecResult:
         """Execute the FlashROM utililty with the configured options.
 
@@ -182,18 +616,200 @@ class FlashROMService(CommandDispatcher[FlashROMExecResult]):
             PyFlexInvalidParameter:
                 Raised when the service detects a missing or inconsistant parameters.
         """
+        if self._pipeline:
+            return self._execute_pipeline()
+
+        try:
+            opts = self._build_opts()
+            with self._input_reference(), self._device_lock(), self._forgetting():
+                # The options are built again once the device is ours, since
+                # what is known about the chip may have changed while waiting.
+                opts, result = self._run(self._build_opts())
+                self._finish(opts, result, self._expected_hash)
+            self._count("success")
+            return result
+
+        except exceptions.PyFlexException:
+            _log.error("PyFlex Execution Failure")
+            self._count("failure")
+            raise
+
+        except Exception as ex:
+            _log.error("General Execution Failure")
+            self._count("failure")
+            raise exceptions.PyFlexExecutionError("Unable to execute FlashROM utility.") from ex
+
+    async def execute_async(self) -> FlashROMExecResult:
+        """Execute the FlashROM utililty without blocking the event loop.
+
+        Behaves like execute. Adapters that implement AsyncFlashROMAdapter are
+        awaited directly; any other adapter is run in a worker thread.
+
+        Arguments:
+            Nothing
+
+        Raises:
+            PyFlexException:
+                Raised when any unexpected failure occures. This might be an issue
+                with the adapter or a bug in how it is called. Consult logs for
+                more information.
+
+            PyFlexInvalidParameter:
+                Raised when the service detects a missing or inconsistant parameters.
+        """
+        if self._pipeline or not isinstance(self._adapter, AsyncFlashROMAdapter):
+            return await asyncio.to_thread(self.execute)
+
         try:
             opts = self._build_opts()
-            return self._adapter.run(opts)
+            with self._input_reference():
+                async with self._device_lock_async():
+                    with self._forgetting():
+                        opts, result = await self._run_async(self._build_opts())
+                        self._finish(opts, result, self._expected_hash)
+            self._count("success")
+            return result
 
         except exceptions.PyFlexException:
             _log.error("PyFlex Execution Failure")
+            self._count("failure")
             raise
 
         except Exception as ex:
             _log.error("General Execution Failure")
+            self._count("failure")
             raise exceptions.PyFlexExecutionError("Unable to execute FlashROM utility.") from ex
 
+    def _run(self, opts: FlashROMOpts) -> tuple[FlashROMOpts, FlashROMExecResult]:
+        with self._prepared(opts) as (opts, result):
+            if result is None:
+                result = self._adapter.run(opts)
+            return opts, result
+
+    async def _run_async(self, opts: FlashROMOpts) -> tuple[FlashROMOpts, FlashROMExecResult]:
+        with self._prepared(opts) as (opts, result):
+            if result is None:
+                result = await self._adapter.run_async(opts)
+            return opts, result
+
+    @contextmanager
+    def _prepared(self, opts: FlashROMOpts) -> Iterator[tuple[FlashROMOpts, Optional[FlashROMExecResult]]]:
+        # Yields the options to run the adapter with, or the result when there
+        # is nothing left for the adapter to do.
+        erased = self._known_erased(opts)
+        if erased is not None and not erased.dirty:
+            yield opts, self._already_erased(erased)
+            return
+
+        with (
+            self._layout_file(opts) as opts,
+            self._changed_regions(opts) as opts,
+            self._dirty_regions(opts, erased) as opts,
+            self._timed(),
+        ):
+            yield opts, None
+
+    def _finish(self, opts: FlashROMOpts, result: FlashROMExecResult, expected: Optional[str]) -> None:
+        self._check_blank(result)
+        self._check_hash(result, expected)
+        self._remember_contents(opts, result)
+        self._remember_held(opts, result)
+        self._remember_chip(opts, result)
+        self._create_overview(opts, result)
+        self._add_timings(result)
+
+    def _check_pipeline(self) -> None:
+        if self._action:
+            raise exceptions.PyFlexInvalidParameter(
+                "Invalid Parameter. ACTION and PIPELINE cannot be used together."
+            )
+
+        elif self._expected_hash or self._include:
+            raise exceptions.PyFlexInvalidParameter(
+                "Invalid Parameter. PIPELINE cannot use an expected hash or regions."
+            )
+
+        elif not self._file_hash and any(
+            action in {FlashROMActionEnum.WRITE, FlashROMActionEnum.VERIFY} for action in self._pipeline
+        ):
+            raise exceptions.PyFlexInvalidParameter(
+                "Invalid Parameter. PIPELINE requires an input file."
+            )
+
+        elif not self._output_directory and any(
+            action in {FlashROMActionEnum.READ, FlashROMActionEnum.BLANK_CHECK} for action in self._pipeline
+        ):
+            raise exceptions.PyFlexInvalidParameter(
+                "Invalid Parameter. PIPELINE requires an output directory."
+            )
+
+        try:
+            for action in self._pipeline:
+                self._action = action
+                self._build_opts()
+        finally:
+            self._action = None
+
+    def _execute_pipeline(self) -> FlashROMExecResult:
+        results = []
+        timings = {}
+
+        try:
+            self._check_pipeline()
+            with self._input_reference(), self._device_lock(), self._forgetting():
+                # Upload and queue are shared by all steps.
+                timings.update(self._timings)
+                written = False
+                verified = False
+
+                for action in self._pipeline:
+                    self._action = action
+                    self._timings = {}
+
+                    if action == FlashROMActionEnum.VERIFY and verified:
+                        result = FlashROMExecResult("Verified while writing.")
+                    else:
+                        # A read after a write shows what the chip holds now.
+                        expected = self._file_hash if action == FlashROMActionEnum.READ and written else None
+                        opts, result = self._run(self._build_opts())
+                        self._finish(opts, result, expected)
+
+                    self._count("success")
+                    results.append(result)
+                    for name, value in result.timings.items():
+                        timings[f"{self._action_name()}.{name}"] = value
+
+                    if action == FlashROMActionEnum.WRITE:
+                        written = True
+                        # A write narrowed down to the changed regions only
+                        # verified those.
+                        verified = not opts.verify_included_only
+                    elif action == FlashROMActionEnum.ERASE:
+                        written = False
+                        verified = False
+
+        except exceptions.PyFlexException:
+            _log.error("PyFlex Execution Failure")
+            self._count("failure")
+            raise
+
+        except Exception as ex:
+            _log.error("General Execution Failure")
+            self._count("failure")
+            raise exceptions.PyFlexExecutionError("Unable to execute FlashROM utility.") from ex
+
+        finally:
+            self._action = None
+
+        return FlashROMExecResult(
+            "\n".join(result.message for result in results if result.message),
+            next((result.path for result in reversed(results) if result.path), None),
+            report=results[-1].report,
+            timings=timings,
+            blank_check=next((result.blank_check for result in reversed(results) if result.blank_check), None),
+            hash_check=next((result.hash_check for result in reversed(results) if result.hash_check), None),
+        )
+
     def _build_opts(self) -> FlashROMOpts:
 
         file_path = self._file_path()
@@ -201,39 +817,514 @@ class FlashROMService(CommandDispatcher[FlashROMExecResult]):
         if not self._action:
             raise exceptions.PyFlexInvalidParameter("Invalid value for ACTION.")
 
-        elif self._action in [FlashROMActionEnum.ERASE, FlashROMActionEnum.PROBE] and self._file_name:
+        elif self._action in [
+            FlashROMActionEnum.ERASE,
+            FlashROMActionEnum.PROBE,
+            FlashROMActionEnum.BLANK_CHECK,
+        ] and self._file_hash and not self._pipeline:
             raise exceptions.PyFlexInvalidParameter(
                 f"Invalid Parameter. Action={self._action} cannot use an input file."
             )
 
-        elif self._action in [FlashROMActionEnum.WRITE, FlashROMActionEnum.VERIFY] and not self._file_name:
+        elif self._expected_hash and self._action != FlashROMActionEnum.VERIFY:
+            raise exceptions.PyFlexInvalidParameter(
+                f"Invalid Parameter. Action={self._action} cannot use an expected hash."
+            )
+
+        elif self._expected_hash and self._file_hash:
+            raise exceptions.PyFlexInvalidParameter(
+                "Invalid Parameter. An input file and an expected hash cannot be used together."
+            )
+
+        elif self._expected_hash and self._include:
+            raise exceptions.PyFlexInvalidParameter(
+                "Invalid Parameter. Regions and an expected hash cannot be used together."
+            )
+
+        elif self._expected_hash and not self._output_directory:
+            raise exceptions.PyFlexInvalidParameter(
+                "Invalid Parameter. An expected hash requires an output directory."
+            )
+
+        elif self._action in [FlashROMActionEnum.WRITE, FlashROMActionEnum.VERIFY] and not (
+            self._file_hash or self._expected_hash
+        ):
             raise exceptions.PyFlexInvalidParameter(
                 f"Invalid Parameter. Action={self._action} requires an input file."
             )
 
-        elif self._action in {FlashROMActionEnum.WRITE, FlashROMActionEnum.VERIFY} and not file_path.exists():
+        elif self._action in {FlashROMActionEnum.WRITE, FlashROMActionEnum.VERIFY} and file_path and not file_path.exists():
             _log.error("Input file missing. Aborting execution. This is a bug!")
             raise exceptions.PyFlexExecutionError(
                 f"File expected but does not exist. Cannot continue."
             )
 
+        elif self._action == FlashROMActionEnum.BLANK_CHECK and not self._output_directory:
+            raise exceptions.PyFlexInvalidParameter(
+                f"Invalid Parameter. Action={self._action} requires an output directory."
+            )
+
+        self._check_regions()
+
+        # Steps of a pipeline share the input file, only some use it.
+        input_path = None
+        if self._action in {FlashROMActionEnum.WRITE, FlashROMActionEnum.VERIFY}:
+            input_path = file_path
+
+        chip = None
+        if self._action != FlashROMActionEnum.PROBE and self._probes and not self._autodetect:
+            detected = self._probes.get(self._programmer)
+            chip = detected.name if detected else None
+
+        # The contents are only used when the chip is named, so the FlashROM
+        # utility makes sure it is the chip they were recorded for.
+        flash_contents = None
+        if self._action == FlashROMActionEnum.WRITE and self._reuse_contents:
+            if self._held_contents is not None:
+                flash_contents = self._held_contents
+            elif self._contents:
+                flash_contents = self._contents.get(self._programmer, chip)
+
+        # A blank check and a verify against a hash are reads as far as the
+        # FlashROM utility knows.
+        action = self._action
+        if action == FlashROMActionEnum.BLANK_CHECK or self._expected_hash:
+            action = FlashROMActionEnum.READ
+
         opts = FlashROMOpts(
-            action=self._action,
+            action=action,
             force=self._force,
             verbosity=self._verbosity,
             programmer=self._programmer,
-            input_path=file_path,
+            input_path=input_path,
+            flash_contents=flash_contents,
+            chip=chip,
+            ifd=self._ifd,
+            fmap=self._fmap,
+            include=list(self._include),
+            # The regions that are left out were not touched.
+            verify_included_only=bool(self._include) and self._action == FlashROMActionEnum.WRITE,
         )
 
         _log.debug("PyFlex FlashROM execution options: %s", opts)
         return opts
 
-    def _file_path(self, file_name: str = None) -> Path:
-        if file_name is not None:
-            self._file_name = file_name
+    def _check_regions(self) -> None:
+        sources = []
+        if self._layout is not None:
+            sources.append("LAYOUT")
+        if self._ifd:
+            sources.append("IFD")
+        if self._fmap:
+            sources.append("FMAP")
+
+        if not sources and not self._include:
+            return
+
+        elif len(sources) > 1:
+            raise exceptions.PyFlexInvalidParameter(
+                f"Invalid Parameter. {' and '.join(sources)} cannot be used together."
+            )
+
+        elif not sources:
+            raise exceptions.PyFlexInvalidParameter(
+                "Invalid Parameter. INCLUDE requires a LAYOUT, IFD or FMAP."
+            )
+
+        elif not self._include:
+            raise exceptions.PyFlexInvalidParameter(
+                f"Invalid Parameter. {sources[0]} requires INCLUDE."
+            )
+
+        elif self._action not in {
+            FlashROMActionEnum.READ,
+            FlashROMActionEnum.WRITE,
+            FlashROMActionEnum.VERIFY,
+        }:
+            raise exceptions.PyFlexInvalidParameter(
+                f"Invalid Parameter. Action={self._action} cannot use regions."
+            )
+
+        # Regions of the IFD and the flashmap are only known to the utility.
+        if self._layout is not None:
+            names = {region.name for region in self._layout}
+            for name in self._include:
+                if name not in names:
+                    raise exceptions.PyFlexInvalidParameter(
+                        f"Invalid Parameter. Region {name} is not in the LAYOUT."
+                    )
+
+    def _file_path(self) -> Optional[Path]:
+        if self._file_hash is None:
+            return None
+
+        return self._images.path(self._file_hash)
+
+    def _action_name(self) -> str:
+        return self._action.name.lower() if self._action else "unknown"
+
+    def _count(self, outcome: str) -> None:
+        if self._metrics is not None:
+            self._metrics.record_operation(self._action_name(), outcome)
+
+    @contextmanager
+    def _timed(self) -> Iterator[None]:
+        # Only the adapter is timed, not the wait for the device.
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - started
+            self._timings["adapter"] = elapsed
+            if self._metrics is not None:
+                self._metrics.record_duration(self._action_name(), elapsed)
+
+    def _add_timings(self, result: FlashROMExecResult) -> None:
+        # Timings measured by the adapter are more specific than ours.
+        if isinstance(result, FlashROMExecResult):
+            result.timings = {**self._timings, **result.timings}
+
+    @contextmanager
+    def _layout_file(self, opts: FlashROMOpts) -> Iterator[FlashROMOpts]:
+        if self._layout is None:
+            yield opts
+            return
+
+        with tempfile.TemporaryDirectory(prefix="pyflex-layout-") as directory:
+            layout = Path(directory) / "layout.txt"
+            layout.write_text(render_layout(self._layout))
+            yield replace(opts, layout=str(layout))
+
+    @contextmanager
+    def _changed_regions(self, opts: FlashROMOpts) -> Iterator[FlashROMOpts]:
+        # Only a write against known contents can be narrowed down, and only
+        # when the caller did not pick regions already.
+        if (
+            opts.action != FlashROMActionEnum.WRITE
+            or not opts.flash_contents
+            or not self._partial_write
+            or opts.layout
+            or opts.include
+        ):
+            yield opts
+            return
+
+        started = time.monotonic()
+        try:
+            regions = imagediff.changed_regions(opts.flash_contents, opts.input_path)
+        except OSError:
+            _log.exception("Unable to compare %s with the chip contents.", opts.input_path)
+            regions = None
+        self._timings["diff"] = time.monotonic() - started
+
+        size = Path(opts.input_path).stat().st_size
+        if not regions or sum(end - start for start, end in regions) > size // 2:
+            # FlashROM already skips blocks that did not change. The layout
+            # saves verifying the rest, which is not worth it when most of the
+            # image changed.
+            yield opts
+            return
+
+        # Only contents seen while the device is held are known to be right.
+        # Cached contents may be stale, e.g. when the chip was swapped for one
+        # of the same model, and then only a verify of the whole chip notices.
+        held = self._held_contents is not None and Path(opts.flash_contents) == self._held_contents
 
-        if self._file_name is None:
+        with tempfile.TemporaryDirectory(prefix="pyflex-layout-") as directory:
+            layout = Path(directory) / "layout.txt"
+            include = imagediff.write_layout(regions, layout)
+            _log.info("Writing %s changed regions of %s", len(regions), opts.input_path)
+            # When the rest of the chip is known to hold the same as the image,
+            # there is no need to read it back.
+            yield replace(opts, layout=str(layout), include=include, verify_included_only=held)
+
+    def _known_erased(self, opts: FlashROMOpts) -> Optional[FlashROMBlankCheck]:
+        # Only an erase of the whole chip with contents seen while the device
+        # is held can be narrowed down. Cached contents may be stale, and a
+        # block wrongly believed to be erased would be left as it is.
+        if (
+            opts.action != FlashROMActionEnum.ERASE
+            or self._held_contents is None
+            or not self._partial_erase
+            or opts.include
+        ):
+            return None
+
+        contents = self._held_contents
+
+        started = time.monotonic()
+        try:
+            return imagediff.blank_check(contents, max_regions=imagediff.MAX_REGIONS)
+        except OSError:
+            _log.exception("Unable to scan the chip contents %s.", contents)
             return None
+        finally:
+            self._timings["scan"] = time.monotonic() - started
+
+    def _already_erased(self, erased: FlashROMBlankCheck) -> FlashROMExecResult:
+        _log.info("Skipping erase, the chip on %s is already erased.", self._programmer)
+        return FlashROMExecResult("Chip is already erased.", blank_check=erased)
 
-        return self._input_directory / self._file_name
+    @contextmanager
+    def _dirty_regions(
+        self,
+        opts: FlashROMOpts,
+        erased: Optional[FlashROMBlankCheck],
+    ) -> Iterator[FlashROMOpts]:
+        # Erasing the whole chip at once is faster than erasing most of it
+        # block by block.
+        if erased is None or sum(end - start for start, end in erased.dirty) > erased.size // 2:
+            yield opts
+            return
+
+        with tempfile.TemporaryDirectory(prefix="pyflex-layout-") as directory:
+            layout = Path(directory) / "layout.txt"
+            include = imagediff.write_layout(erased.dirty, layout)
+            _log.info("Erasing %s dirty regions on %s", len(erased.dirty), opts.programmer)
+            yield replace(opts, layout=str(layout), include=include)
+
+    def _check_blank(self, result: FlashROMExecResult) -> None:
+        if self._action != FlashROMActionEnum.BLANK_CHECK:
+            return
+
+        if not result.path:
+            raise exceptions.PyFlexExecutionError("The chip contents were not read.")
+
+        started = time.monotonic()
+        check = imagediff.blank_check(self._output_directory / result.path)
+        self._timings["scan"] = time.monotonic() - started
+
+        total = -(-check.size // check.block_size)
+        if check.dirty:
+            summary = f"{check.dirty_blocks} of {total} blocks are not erased."
+        else:
+            summary = "Chip is erased."
+
+        result.blank_check = check
+        result.message = f"{result.message}\n{summary}" if result.message else summary
+
+    def _check_hash(self, result: FlashROMExecResult, expected: Optional[str]) -> None:
+        if not expected:
+            return
+
+        if not result.path:
+            raise exceptions.PyFlexExecutionError("The chip contents were not read.")
+
+        dump = self._output_directory / result.path
+        started = time.monotonic()
+        with open(dump, "rb") as fd:
+            actual = hashlib.file_digest(fd, "sha256").hexdigest()
+
+        check = FlashROMHashCheck(expected, actual, actual == expected)
+        if not check.match:
+            check.first_difference = self._first_difference(expected, dump)
+        self._timings["hash"] = time.monotonic() - started
+
+        if check.match:
+            summary = "VERIFIED."
+        elif check.first_difference is not None:
+            summary = f"FAILED at 0x{check.first_difference:08x}."
+        else:
+            summary = "FAILED."
+
+        line = f"Verifying flash by hash... {summary}"
+        result.hash_check = check
+        result.message = f"{result.message}\n{line}" if result.message else line
+
+        if not check.match:
+            _log.warning("The chip does not hold the expected image.")
+            raise exceptions.PyFlexExecutionError(result.message)
+
+    def _first_difference(self, expected: str, dump: Path) -> Optional[int]:
+        # Only known when the expected image is at hand.
+        try:
+            self._images.acquire(expected)
+        except exceptions.PyFlexNotFound:
+            return None
+
+        try:
+            regions = imagediff.changed_regions(self._images.path(expected), dump, max_regions=None)
+        finally:
+            self._images.release(expected)
+
+        return regions[0][0] if regions else None
+
+    @contextmanager
+    def _device_lock(self) -> Iterator[None]:
+        if self._devices is None:
+            with self._holding():
+                yield
+            return
+
+        started = time.monotonic()
+        with self._devices.lock(self._programmer), self._holding():
+            self._timings["queue"] = time.monotonic() - started
+            yield
+
+    @asynccontextmanager
+    async def _device_lock_async(self) -> AsyncIterator[None]:
+        if self._devices is None:
+            with self._holding():
+                yield
+            return
+
+        started = time.monotonic()
+        await self._devices.acquire_async(self._programmer)
+        self._timings["queue"] = time.monotonic() - started
+        try:
+            with self._holding():
+                yield
+        finally:
+            self._devices.release(self._programmer)
+
+    @contextmanager
+    def _holding(self) -> Iterator[None]:
+        # What is learned about the chip is only certain until the device is
+        # given back. Adapters may keep the programmer open until then.
+        self._held_contents = None
+        try:
+            if isinstance(self._adapter, SessionFlashROMAdapter):
+                with self._adapter.session(self._programmer):
+                    yield
+            else:
+                yield
+        finally:
+            self._held_contents = None
+
+    def _hold_file(self, digest: str) -> None:
+        # The reference taken when the file was set is dropped once an
+        # execution holds its own, or when the service is discarded.
+        self._drop_file()
+        self._file_hash = digest
+        self._file_reference = weakref.finalize(self, self._images.release, digest)
+
+    def _drop_file(self) -> None:
+        if self._file_reference is not None:
+            self._file_reference()
+            self._file_reference = None
+
+    @contextmanager
+    def _input_reference(self) -> Iterator[None]:
+        # Hold a reference to the input file while the adapter uses it so that
+        # it cannot be reclaimed underneath a running operation.
+        if self._file_hash is None:
+            yield
+            return
+
+        try:
+            self._images.acquire(self._file_hash)
+        except exceptions.PyFlexNotFound:
+            _log.error("Input file missing. Aborting execution.")
+            raise exceptions.PyFlexExecutionError(
+                f"File expected but does not exist. Cannot continue."
+            )
+
+        self._drop_file()
+
+        try:
+            yield
+        finally:
+            self._images.release(self._file_hash)
+
+    def _remember_contents(self, opts: FlashROMOpts, result: FlashROMExecResult) -> None:
+        if self._contents is None:
+            return
+
+        if self._include:
+            # The image and the output only match the chip in the included
+            # regions. A write leaves the rest of the chip unknown.
+            if opts.action == FlashROMActionEnum.WRITE:
+                self._contents.invalidate(opts.programmer)
+
+        elif opts.action in {FlashROMActionEnum.WRITE, FlashROMActionEnum.VERIFY}:
+            self._contents.record(opts.programmer, self._detected_chip(opts, result), opts.input_path)
+
+        elif opts.action == FlashROMActionEnum.READ and result.path and self._output_directory:
+            self._contents.record(
+                opts.programmer,
+                self._detected_chip(opts, result),
+                self._output_directory / result.path,
+            )
+
+        elif opts.action == FlashROMActionEnum.ERASE and (result.blank_check is None or result.blank_check.dirty):
+            # Unless the erase was skipped, the contents are gone.
+            self._contents.invalidate(opts.programmer)
+
+    def _remember_held(self, opts: FlashROMOpts, result: FlashROMExecResult) -> None:
+        if self._include:
+            # The files only match the chip in the included regions.
+            if opts.action == FlashROMActionEnum.WRITE:
+                self._held_contents = None
+
+        elif opts.action in {FlashROMActionEnum.WRITE, FlashROMActionEnum.VERIFY}:
+            self._held_contents = Path(opts.input_path)
+
+        elif opts.action == FlashROMActionEnum.READ and result.path and self._output_directory:
+            self._held_contents = self._output_directory / result.path
+
+        elif opts.action == FlashROMActionEnum.ERASE and (result.blank_check is None or result.blank_check.dirty):
+            self._held_contents = None
+
+    def _detected_chip(self, opts: FlashROMOpts, result: FlashROMExecResult) -> Optional[str]:
+        # A named chip was checked by the FlashROM utility, otherwise only an
+        # unambiguous report identifies it.
+        if opts.chip:
+            return opts.chip
+
+        chips = result.report.chips if result.report else []
+        if len(chips) == 1 and not chips[0].name.startswith("unknown"):
+            return chips[0].name
+        return None
+
+    def _create_overview(self, opts: FlashROMOpts, result: FlashROMExecResult) -> None:
+        if (
+            self._overviews is None
+            or opts.action != FlashROMActionEnum.READ
+            or not result.path
+            or not self._output_directory
+        ):
+            return
+
+        started = time.monotonic()
+        try:
+            self._overviews.create(self._output_directory / result.path)
+        except OSError:
+            # The overview is computed again when it is asked for.
+            _log.exception("Unable to create the overview of %s.", result.path)
+        self._timings["overview"] = time.monotonic() - started
+
+    @contextmanager
+    def _forgetting(self) -> Iterator[None]:
+        # After a failure, including an unexpected one, the chip may hold
+        # anything. What was known is forgotten while the device is still
+        # held, so the next operation cannot use it.
+        try:
+            yield
+        except BaseException:
+            self._forget_contents()
+            self._forget_chip()
+            raise
+
+    def _forget_contents(self) -> None:
+        # After a failure the chip may hold anything.
+        if self._contents is not None and self._programmer is not None:
+            self._contents.invalidate(self._programmer)
+
+    def _remember_chip(self, opts: FlashROMOpts, result: FlashROMExecResult) -> None:
+        if self._probes is None or opts.action != FlashROMActionEnum.PROBE:
+            return
+
+        # The report was built from every line as it arrived, the message may
+        # only hold the last of them.
+        chips = result.report.chips if result.report else []
+
+        # Only an unambiguous, fully identified chip is safe to name later.
+        if len(chips) == 1 and chips[0].size and not chips[0].name.startswith("unknown"):
+            self._probes.record(opts.programmer, chips[0])
+        else:
+            self._probes.invalidate(opts.programmer)
 
+    def _forget_chip(self) -> None:
+        # The chip may have been swapped or the named chip may be wrong.
+        if self._probes is not None and self._programmer is not None:
+            self._probes.invalidate(self._programmer)
@@ -0,0 +1,69 @@
+import mmap
+from pathlib import Path
+from .exceptions import PyFlexInvalidParameter
+from .models import HexPage, HexRow
+
+
+BYTES_PER_ROW = 16
+
+
+# Large enough to fill a screen many times over, small enough to answer fast.
+MAX_PAGE_SIZE = 64 * 1024
+
+
+def _printable(byte: int) -> str:
+    return chr(byte) if 0x20 <= byte < 0x7f else "."
+
+
+def read_page(path: str, offset: int = 0, length: int = 4096) -> HexPage:
+    """Read part of a file rendered as hex and ASCII.
+
+    The file is memory mapped and only the requested bytes are read, so a page
+    costs the same regardless of the size of the file.
+
+    Arguments:
+        path:
+            The file to read.
+
+        offset:
+            The first byte to read.
+
+        length:
+            The number of bytes to read, at most MAX_PAGE_SIZE. Fewer bytes are
+            read at the end of the file.
+
+    Raises:
+        PyFlexInvalidParameter:
+            Raised if the offset is beyond the end of the file or the length is
+            out of range.
+
+        OSError:
+            Raised if the file cannot be read.
+
+    Returns:
+        HexPage:
+            The rows of the page, BYTES_PER_ROW bytes each.
+    """
+    if not 0 < length <= MAX_PAGE_SIZE:
+        raise PyFlexInvalidParameter("Invalid value for LENGTH.")
+
+    with open(path, "rb") as file:
+        size = Path(path).stat().st_size
+        if not 0 <= offset <= size:
+            raise PyFlexInvalidParameter("Invalid value for OFFSET.")
+
+        if offset == size:
+            # Empty files cannot be memory mapped.
+            return HexPage(size, offset, [])
+
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as view:
+            data = view[offset:offset + length]
+
+    return HexPage(size, offset, [
+        HexRow(
+            offset + start,
+            data[start:start + BYTES_PER_ROW].hex(" "),
+            "".join(_printable(byte) for byte in data[start:start + BYTES_PER_ROW]),
+        )
+        for start in range(0, len(data), BYTES_PER_ROW)
+    ])
@@ -0,0 +1,457 @@
+import fcntl
+import os
+import re
+from contextlib import contextmanager
+from hashlib import sha256
+from io import BytesIO
+from logging import getLogger
+from pathlib import Path
+from typing import BinaryIO, Iterator, Optional, Union
+from uuid import uuid4 as uuid
+from . import exceptions, retention
+
+
+_log = getLogger(__name__)
+
+
+# Images are copied in pieces of this size so memory use does not grow with the
+# size of the image.
+CHUNK_SIZE = 1024 * 1024
+
+
+_DIGEST_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+
+class ImageStore:
+    """Store input images by the SHA-256 of their content.
+
+    Each image is written once to `<directory>/ab/cdef....bin`, where `abcdef...`
+    is the hex digest of its content, so uploading the same image again does not
+    write it again. Images also carry a reference count that is shared between
+    processes. An image may only be reclaimed while nobody holds a reference.
+
+    References are counted per process, so the references of a process that
+    exits without releasing them, e.g. because it crashed, no longer count.
+
+    Arguments:
+        directory:
+            The directory to store images in.
+
+        max_file_size:
+            The largest image, in bytes, that will be accepted. Images are not
+            limited if None.
+
+    Methods:
+        put:
+            Add an image to the store and return its digest.
+
+        path:
+            Get the path of an image.
+
+        exists:
+            Check if an image is held by the store.
+
+        size:
+            Get the size of an image.
+
+        index:
+            Move loose images in the store directory into the store.
+
+        acquire:
+            Take a reference to an image.
+
+        release:
+            Drop a reference to an image.
+
+        references:
+            Get the number of references to an image.
+
+        reclaim:
+            Delete an image if nobody holds a reference to it.
+
+        reclaim_path:
+            Delete the image stored at a path if nobody holds a reference to it.
+    """
+
+    def __init__(self, directory: str, max_file_size: Optional[int] = None) -> None:
+        self._directory = Path(directory)
+        self._max_file_size = max_file_size
+
+    def put(self, data: Union[bytes, BinaryIO], acquire: bool = False) -> str:
+        """Add an image to the store and return its digest.
+
+        Seekable streams are hashed before anything is written so that known
+        images cause no writes at all. Other streams are copied to a temporary
+        file which is discarded if the image is already held.
+
+        Arguments:
+            data:
+                Bytes or a readable binary file-like object containing the image.
+
+            acquire:
+                Take a reference to the image as it is stored, so that it cannot
+                be reclaimed before the caller uses it. Drop it with release.
+
+        Raises:
+            PyFlexInvalidParameter:
+                Raised if the image is empty or larger than max_file_size.
+
+        Returns:
+            str:
+                The hex SHA-256 digest that identifies the image.
+        """
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            data = BytesIO(data)
+
+        if data.seekable():
+            start = data.tell()
+            digest = self._copy(data, None)
+            if self._touch(digest, acquire):
+                return digest
+            data.seek(start)
+
+        self._directory.mkdir(parents=True, exist_ok=True)
+        partial_path = self._directory / f".{uuid()}.part"
+
+        try:
+            with open(partial_path, 'wb') as fd:
+                digest = self._copy(data, fd)
+
+            with self._references(digest) as (count, update):
+                if self._touch(digest, False):
+                    partial_path.unlink()
+                else:
+                    partial_path.rename(self.path(digest))
+                    _log.debug("Stored image %s", digest)
+
+                if acquire:
+                    update(1)
+
+        except Exception:
+            partial_path.unlink(missing_ok=True)
+            raise
+
+        return digest
+
+    def path(self, digest: str) -> Path:
+        """Get the path of an image.
+
+        Arguments:
+            digest:
+                The hex SHA-256 digest of the image.
+
+        Raises:
+            PyFlexInvalidParameter:
+                Raised if the digest is malformed.
+
+        Returns:
+            Path:
+                The location of the image. The image might not exist.
+        """
+        digest = digest.lower()
+        if not _DIGEST_PATTERN.match(digest):
+            raise exceptions.PyFlexInvalidParameter("Invalid image digest.")
+        return self._directory / digest[:2] / f"{digest[2:]}.bin"
+
+    def exists(self, digest: str) -> bool:
+        """Check if an image is held by the store.
+
+        Arguments:
+            digest:
+                The hex SHA-256 digest of the image.
+
+        Raises:
+            PyFlexInvalidParameter:
+                Raised if the digest is malformed.
+
+        Returns:
+            bool:
+                True if the image exists.
+        """
+        return self.path(digest).exists()
+
+    def size(self, digest: str) -> int:
+        """Get the size of an image.
+
+        Arguments:
+            digest:
+                The hex SHA-256 digest of the image.
+
+        Raises:
+            PyFlexNotFound:
+                Raised if the image does not exist.
+
+        Returns:
+            int:
+                The size of the image in bytes.
+        """
+        try:
+            return self.path(digest).stat().st_size
+        except FileNotFoundError:
+            raise exceptions.PyFlexNotFound("Image not found.")
+
+    def index(self) -> list[str]:
+        """Move loose images in the store directory into the store.
+
+        Images written to the top of the directory, for example by older versions
+        of PyFlex, are hashed and moved to their content address so they can be
+        found by digest. Reference files left behind by images that no longer
+        exist are removed.
+
+        Arguments:
+            Nothing
+
+        Raises:
+            Nothing
+
+        Returns:
+            list:
+                The digests of the images that were indexed.
+        """
+        indexed = []
+
+        for file_path in sorted(self._directory.glob("*.bin")):
+            try:
+                with open(file_path, 'rb') as fd:
+                    digest = self._copy(fd, None)
+            except exceptions.PyFlexInvalidParameter:
+                _log.warning("Skipping image that cannot be stored: %s", file_path)
+                continue
+
+            with self._references(digest):
+                if self._touch(digest, False):
+                    file_path.unlink()
+                else:
+                    file_path.rename(self.path(digest))
+
+            _log.debug("Indexed %s as %s", file_path, digest)
+            indexed.append(digest)
+
+        for ref_path in sorted(self._directory.glob("*/*.refs")):
+            digest = ref_path.parent.name + ref_path.stem
+            if _DIGEST_PATTERN.match(digest) and not self.exists(digest):
+                self.reclaim(digest)
+
+        return indexed
+
+    def acquire(self, digest: str) -> int:
+        """Take a reference to an image.
+
+        Arguments:
+            digest:
+                The hex SHA-256 digest of the image.
+
+        Raises:
+            PyFlexNotFound:
+                Raised if the image does not exist.
+
+        Returns:
+            int:
+                The number of references after this one was taken.
+        """
+        # Checked first so that no reference file is created for images that
+        # do not exist. Checked again once the references are locked, since
+        # the image may have been reclaimed in between.
+        if not self.exists(digest):
+            raise exceptions.PyFlexNotFound("Image not found.")
+
+        with self._references(digest) as (count, update):
+            if not self.exists(digest):
+                if count == 0:
+                    self._references_path(digest).unlink()
+                raise exceptions.PyFlexNotFound("Image not found.")
+            retention.touch(self.path(digest))
+            return update(1)
+
+    def release(self, digest: str) -> int:
+        """Drop a reference to an image.
+
+        Arguments:
+            digest:
+                The hex SHA-256 digest of the image.
+
+        Raises:
+            Nothing
+
+        Returns:
+            int:
+                The number of references that remain.
+        """
+        with self._references(digest, create=False) as (count, update):
+            return update(-1)
+
+    def references(self, digest: str) -> int:
+        """Get the number of references to an image.
+
+        Arguments:
+            digest:
+                The hex SHA-256 digest of the image.
+
+        Raises:
+            Nothing
+
+        Returns:
+            int:
+                The number of references currently held.
+        """
+        with self._references(digest, create=False) as (count, _):
+            return count
+
+    def reclaim(self, digest: str) -> bool:
+        """Delete an image if nobody holds a reference to it.
+
+        Arguments:
+            digest:
+                The hex SHA-256 digest of the image.
+
+        Raises:
+            Nothing
+
+        Returns:
+            bool:
+                True if the image was deleted.
+        """
+        with self._references(digest) as (count, _):
+            if count > 0:
+                return False
+            # Processes waiting on the lock of the reference file notice that
+            # it was deleted and start over with a new one.
+            self.path(digest).unlink(missing_ok=True)
+            self._references_path(digest).unlink()
+            _log.debug("Reclaimed image %s", digest)
+            return True
+
+    def reclaim_path(self, path: Path) -> bool:
+        """Delete the image stored at a path if nobody holds a reference to it.
+
+        Arguments:
+            path:
+                The path of an image, as returned by path.
+
+        Raises:
+            PyFlexInvalidParameter:
+                Raised if the path is not the location of an image.
+
+        Returns:
+            bool:
+                True if the image was deleted.
+        """
+        path = Path(path)
+        digest = path.parent.name + path.stem
+        if self.path(digest).resolve() != path.resolve():
+            raise exceptions.PyFlexInvalidParameter("Path is not an image.")
+        return self.reclaim(digest)
+
+    def _copy(self, data: BinaryIO, fd: Optional[BinaryIO]) -> str:
+        digest = sha256()
+        size = 0
+
+        while chunk := data.read(CHUNK_SIZE):
+            size += len(chunk)
+            if self._max_file_size is not None and size > self._max_file_size:
+                _log.error("Image exceeds %s bytes.", self._max_file_size)
+                raise exceptions.PyFlexInvalidParameter("Input file is too large.")
+            digest.update(chunk)
+            if fd is not None:
+                fd.write(chunk)
+
+        if size == 0:
+            _log.error("Image is empty.")
+            raise exceptions.PyFlexInvalidParameter("Input file is empty.")
+
+        return digest.hexdigest()
+
+    def _touch(self, digest: str, acquire: bool) -> bool:
+        # Refreshing the modification time of a known image keeps it from being
+        # reclaimed for age right after it has been uploaded again.
+        if acquire:
+            try:
+                self.acquire(digest)
+            except exceptions.PyFlexNotFound:
+                return False
+
+        try:
+            os.utime(self.path(digest))
+        except FileNotFoundError:
+            return False
+
+        _log.debug("Image %s already stored", digest)
+        return True
+
+    def _references_path(self, digest: str) -> Path:
+        return self.path(digest).with_suffix(".refs")
+
+    def _lock_references(self, digest: str, create: bool) -> Optional[int]:
+        ref_path = self._references_path(digest)
+
+        while True:
+            if create:
+                ref_path.parent.mkdir(parents=True, exist_ok=True)
+
+            try:
+                fd = os.open(ref_path, os.O_RDWR | (os.O_CREAT if create else 0), 0o644)
+            except FileNotFoundError:
+                return None
+
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                # Reclaim deletes the file while holding the lock. Counting on
+                # a deleted file would be lost, so start over.
+                if os.path.samestat(os.fstat(fd), os.stat(ref_path)):
+                    return fd
+            except FileNotFoundError:
+                pass
+            except BaseException:
+                os.close(fd)
+                raise
+
+            os.close(fd)
+
+    @contextmanager
+    def _references(self, digest: str, create: bool = True) -> Iterator:
+        # The references live in a file next to the image and are locked so
+        # that several worker processes can share the store. Each line holds
+        # the pid of a process and the number of references it holds.
+        fd = self._lock_references(digest, create)
+
+        if fd is None:
+            def nothing(delta: int) -> int:
+                return 0
+
+            yield 0, nothing
+            return
+
+        try:
+            holders = {}
+            for line in os.read(fd, os.fstat(fd).st_size).decode(errors="replace").splitlines():
+                pid, _, count = line.partition(" ")
+                if pid.isdigit() and count.isdigit() and _is_running(int(pid)):
+                    holders[int(pid)] = int(count)
+
+            def update(delta: int) -> int:
+                count = max(0, holders.get(os.getpid(), 0) + delta)
+                if count:
+                    holders[os.getpid()] = count
+                else:
+                    holders.pop(os.getpid(), None)
+
+                os.lseek(fd, 0, os.SEEK_SET)
+                os.ftruncate(fd, 0)
+                os.write(fd, "".join(f"{pid} {count}\n" for pid, count in holders.items()).encode())
+                return sum(holders.values())
+
+            yield sum(holders.values()), update
+
+        finally:
+            os.close(fd)
+
+
+def _is_running(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Running, but owned by someone else.
+        pass
+    return True
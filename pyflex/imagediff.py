@@ -0,0 +1,354 @@
+import mmap
+from logging import getLogger
+from pathlib import Path
+from typing import Optional
+from .layout import MAX_REGIONS, render_layout
+from .models import FlashROMBlankCheck, FlashROMRegion, ImageDiff
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover - depends on the environment
+    numpy = None
+
+
+_log = getLogger(__name__)
+
+
+# The smallest erase block of nearly every SPI flash chip.
+DEFAULT_BLOCK_SIZE = 4096
+
+
+def _changed_blocks_numpy(old: memoryview, new: memoryview, block_size: int) -> list[int]:
+    blocks = len(new) // block_size
+    # Compare eight bytes at a time when the blocks allow it.
+    dtype = numpy.uint64 if block_size % 8 == 0 else numpy.uint8
+    width = block_size // numpy.dtype(dtype).itemsize
+
+    a = numpy.frombuffer(old, dtype=dtype, count=blocks * width).reshape(blocks, width)
+    b = numpy.frombuffer(new, dtype=dtype, count=blocks * width).reshape(blocks, width)
+    changed = numpy.flatnonzero((a != b).any(axis=1)).tolist()
+
+    if len(new) % block_size and old[blocks * block_size:] != new[blocks * block_size:]:
+        changed.append(blocks)
+
+    return changed
+
+
+def _changed_blocks_python(old: memoryview, new: memoryview, block_size: int) -> list[int]:
+    return [
+        offset // block_size
+        for offset in range(0, len(new), block_size)
+        if old[offset:offset + block_size] != new[offset:offset + block_size]
+    ]
+
+
+def changed_blocks(old: bytes, new: bytes, block_size: int = DEFAULT_BLOCK_SIZE) -> list[int]:
+    """Find the blocks that differ between two images of the same size.
+
+    The comparison is vectorized with numpy when it is installed.
+
+    Arguments:
+        old:
+            The current image.
+
+        new:
+            The image to compare with.
+
+        block_size:
+            The size of a block in bytes.
+
+    Raises:
+        ValueError:
+            Raised if the images are not the same size.
+
+    Returns:
+        list:
+            The numbers of the blocks that differ, in increasing order.
+    """
+    if len(old) != len(new):
+        raise ValueError("Images must be the same size.")
+
+    old, new = memoryview(old), memoryview(new)
+
+    if numpy is not None:
+        return _changed_blocks_numpy(old, new, block_size)
+
+    return _changed_blocks_python(old, new, block_size)
+
+
+def _dirty_blocks_numpy(image: memoryview, block_size: int) -> list[int]:
+    blocks = len(image) // block_size
+    # Scan eight bytes at a time when the blocks allow it.
+    dtype = numpy.uint64 if block_size % 8 == 0 else numpy.uint8
+    width = block_size // numpy.dtype(dtype).itemsize
+    erased = numpy.iinfo(dtype).max
+
+    a = numpy.frombuffer(image, dtype=dtype, count=blocks * width).reshape(blocks, width)
+    dirty = numpy.flatnonzero((a != erased).any(axis=1)).tolist()
+
+    tail = image[blocks * block_size:]
+    if len(tail) and tail != b"\xff" * len(tail):
+        dirty.append(blocks)
+
+    return dirty
+
+
+def _dirty_blocks_python(image: memoryview, block_size: int) -> list[int]:
+    erased = b"\xff" * block_size
+    return [
+        offset // block_size
+        for offset in range(0, len(image), block_size)
+        if image[offset:offset + block_size] != erased[:len(image) - offset]
+    ]
+
+
+def dirty_blocks(image: bytes, block_size: int = DEFAULT_BLOCK_SIZE) -> list[int]:
+    """Find the blocks of an image that are not erased, i.e. not all 0xFF.
+
+    The scan is vectorized with numpy when it is installed.
+
+    Arguments:
+        image:
+            The image to scan.
+
+        block_size:
+            The size of a block in bytes.
+
+    Raises:
+        Nothing
+
+    Returns:
+        list:
+            The numbers of the blocks that are not erased, in increasing order.
+    """
+    image = memoryview(image)
+
+    if numpy is not None:
+        return _dirty_blocks_numpy(image, block_size)
+
+    return _dirty_blocks_python(image, block_size)
+
+
+def merge_blocks(
+    blocks: list[int],
+    block_size: int,
+    size: int,
+    max_regions: Optional[int] = MAX_REGIONS,
+) -> list[tuple[int, int]]:
+    """Turn block numbers into as few byte ranges as possible.
+
+    Adjacent blocks are merged. When there are still more than max_regions
+    ranges, the ranges separated by the smallest gaps are merged as well.
+
+    Arguments:
+        blocks:
+            Block numbers in increasing order.
+
+        block_size:
+            The size of a block in bytes.
+
+        size:
+            The size of the image in bytes. The last range ends here at most.
+
+        max_regions:
+            The most ranges to return. Not limited if None.
+
+    Raises:
+        Nothing
+
+    Returns:
+        list:
+            (start, end) byte ranges, end exclusive, in increasing order.
+    """
+    regions = []
+    for block in blocks:
+        if regions and regions[-1][1] == block:
+            regions[-1][1] = block + 1
+        else:
+            regions.append([block, block + 1])
+
+    while max_regions is not None and len(regions) > max_regions:
+        gap = min(range(len(regions) - 1), key=lambda i: regions[i + 1][0] - regions[i][1])
+        regions[gap][1] = regions.pop(gap + 1)[1]
+
+    return [(start * block_size, min(end * block_size, size)) for start, end in regions]
+
+
+def changed_regions(
+    old_path: str,
+    new_path: str,
+    block_size: int = DEFAULT_BLOCK_SIZE,
+    max_regions: int = MAX_REGIONS,
+) -> Optional[list[tuple[int, int]]]:
+    """Find the byte ranges that differ between two image files.
+
+    Arguments:
+        old_path:
+            The current image.
+
+        new_path:
+            The image to compare with.
+
+        block_size:
+            The size of a block in bytes. Ranges are aligned to blocks.
+
+        max_regions:
+            The most ranges to return.
+
+    Raises:
+        OSError:
+            Raised if a file cannot be read.
+
+    Returns:
+        list:
+            (start, end) byte ranges, end exclusive, or None if the files are
+            not the same size or are empty.
+    """
+    with open(old_path, "rb") as old_file, open(new_path, "rb") as new_file:
+        size = Path(new_path).stat().st_size
+        if size == 0 or Path(old_path).stat().st_size != size:
+            return None
+
+        with (
+            mmap.mmap(old_file.fileno(), 0, access=mmap.ACCESS_READ) as old,
+            mmap.mmap(new_file.fileno(), 0, access=mmap.ACCESS_READ) as new,
+        ):
+            blocks = changed_blocks(old, new, block_size)
+
+    return merge_blocks(blocks, block_size, size, max_regions)
+
+
+def blank_check(
+    path: str,
+    block_size: int = DEFAULT_BLOCK_SIZE,
+    max_regions: Optional[int] = None,
+) -> FlashROMBlankCheck:
+    """Find the blocks of an image file that are not erased.
+
+    Arguments:
+        path:
+            The image, usually a dump of the chip.
+
+        block_size:
+            The size of a block in bytes, usually the erase block size of the
+            chip. Ranges are aligned to blocks.
+
+        max_regions:
+            The most ranges to return. Not limited if None.
+
+    Raises:
+        OSError:
+            Raised if the file cannot be read.
+
+    Returns:
+        FlashROMBlankCheck:
+            The ranges that are not erased.
+    """
+    with open(path, "rb") as image_file:
+        size = Path(path).stat().st_size
+        if size == 0:
+            return FlashROMBlankCheck(0, block_size, [], 0)
+
+        with mmap.mmap(image_file.fileno(), 0, access=mmap.ACCESS_READ) as image:
+            blocks = dirty_blocks(image, block_size)
+
+    return FlashROMBlankCheck(
+        size,
+        block_size,
+        merge_blocks(blocks, block_size, size, max_regions),
+        len(blocks),
+    )
+
+
+def _count_changed_bytes(old: memoryview, new: memoryview, ranges: list[tuple[int, int]]) -> int:
+    if numpy is not None:
+        return sum(
+            int(numpy.count_nonzero(
+                numpy.frombuffer(old[start:end], dtype=numpy.uint8)
+                != numpy.frombuffer(new[start:end], dtype=numpy.uint8)
+            ))
+            for start, end in ranges
+        )
+
+    return sum(
+        sum(a != b for a, b in zip(old[start:end], new[start:end]))
+        for start, end in ranges
+    )
+
+
+def diff_images(old_path: str, new_path: str, block_size: int = DEFAULT_BLOCK_SIZE) -> ImageDiff:
+    """Compare two image files of the same size.
+
+    The files are memory mapped and compared block by block, then byte by byte
+    within the blocks that differ.
+
+    Arguments:
+        old_path:
+            The first image.
+
+        new_path:
+            The image to compare with.
+
+        block_size:
+            The size of a block in bytes, usually the erase block size of the
+            chip. Ranges are aligned to blocks.
+
+    Raises:
+        ValueError:
+            Raised if the images are not the same size.
+
+        OSError:
+            Raised if a file cannot be read.
+
+    Returns:
+        ImageDiff:
+            The ranges that differ and how much differs.
+    """
+    with open(old_path, "rb") as old_file, open(new_path, "rb") as new_file:
+        size = Path(new_path).stat().st_size
+        if Path(old_path).stat().st_size != size:
+            raise ValueError("Images must be the same size.")
+
+        if size == 0:
+            return ImageDiff(0, block_size, [], 0, 0)
+
+        with (
+            mmap.mmap(old_file.fileno(), 0, access=mmap.ACCESS_READ) as old,
+            mmap.mmap(new_file.fileno(), 0, access=mmap.ACCESS_READ) as new,
+        ):
+            blocks = changed_blocks(old, new, block_size)
+            ranges = merge_blocks(blocks, block_size, size, max_regions=None)
+            with memoryview(old) as old_view, memoryview(new) as new_view:
+                changed_bytes = _count_changed_bytes(old_view, new_view, ranges)
+
+    return ImageDiff(size, block_size, ranges, len(blocks), changed_bytes)
+
+
+def write_layout(regions: list[tuple[int, int]], path: str) -> list[str]:
+    """Write a flashrom layout file with a region for every range.
+
+    Arguments:
+        regions:
+            (start, end) byte ranges, end exclusive.
+
+        path:
+            The file to write.
+
+    Raises:
+        OSError:
+            Raised if the file cannot be written.
+
+    Returns:
+        list:
+            The names of the regions, to pass with --include.
+    """
+    names = [f"changed{index}" for index in range(len(regions))]
+
+    with open(path, "w") as layout:
+        layout.write(render_layout(
+            FlashROMRegion(start, end - 1, name)
+            for name, (start, end) in zip(names, regions)
+        ))
+
+    _log.debug("Wrote layout %s with %s regions", path, len(regions))
+    return names
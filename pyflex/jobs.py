@@ -0,0 +1,370 @@
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from logging import getLogger
+from threading import Condition
+from typing import Hashable, Iterator, Optional
+from uuid import uuid4 as uuid
+from . import exceptions
+from .typing import CommandDispatcher
+from .models import Job, JobStatusEnum
+
+
+_log = getLogger(__name__)
+
+
+_FINISHED = {JobStatusEnum.SUCCEEDED, JobStatusEnum.FAILED}
+
+
+class JobManager:
+    """Run CommandDispatchers in the background.
+
+    This manager hands each submitted dispatcher to a pool of worker threads and
+    tracks the state of the resulting job so that callers can return right away
+    and poll for the result later. Output produced while the job is running can
+    be recorded on the job and followed by any number of readers.
+
+    Jobs submitted with the same key, e.g. for the same programmer, run one at
+    a time in the order they were submitted. A job waiting for its turn does not
+    take a worker, so jobs with other keys are not held up behind it.
+
+    Arguments:
+        max_workers:
+            The number of jobs that may execute at the same time.
+
+        max_history:
+            The number of finished jobs to remember. The oldest finished jobs are
+            forgotten once this limit is exceeded.
+
+        max_output_lines:
+            The number of output lines to keep per job. Older lines are dropped
+            once this limit is exceeded.
+
+        max_output_bytes:
+            The number of characters of output to keep per job. Older lines are
+            dropped once this limit is exceeded, so that very verbose output
+            does not pile up in memory.
+
+    Methods:
+        create:
+            Create a job that has not been queued yet.
+
+        submit:
+            Queue a dispatcher for execution and return the job.
+
+        discard:
+            Forget a job that was created but never submitted.
+
+        get:
+            Lookup a job by its id.
+
+        wait:
+            Block until a job has finished.
+
+        append_output:
+            Record a line of output for a job.
+
+        follow:
+            Iterate the output of a job as it is produced.
+
+        shutdown:
+            Stop accepting jobs and wait for running jobs to finish.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = 4,
+        max_history: int = 100,
+        max_output_lines: int = 10000,
+        max_output_bytes: int = 256 * 1024,
+    ) -> None:
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix="pyflex-job",
+        )
+        self._max_history = max_history
+        self._max_output_lines = max_output_lines
+        self._max_output_bytes = max_output_bytes
+        self._jobs: OrderedDict[str, Job] = OrderedDict()
+        self._futures: dict[str, Future] = {}
+        self._waiting: dict[Hashable, deque[tuple[Job, CommandDispatcher]]] = {}
+        self._changed = Condition()
+
+    def create(self) -> Job:
+        """Create a job that has not been queued yet.
+
+        This allows the job id to be handed out, for example to an output
+        listener, before the dispatcher is submitted.
+
+        Arguments:
+            Nothing
+
+        Raises:
+            Nothing
+
+        Returns:
+            Job:
+                A new job in the PENDING state.
+        """
+        job = Job(str(uuid()))
+
+        with self._changed:
+            self._jobs[job.id] = job
+
+        return job
+
+    def submit(
+        self,
+        dispatcher: CommandDispatcher,
+        job: Optional[Job] = None,
+        key: Optional[Hashable] = None,
+    ) -> Job:
+        """Queue a dispatcher for execution and return the job.
+
+        Arguments:
+            dispatcher:
+                The CommandDispatcher to execute. It should be fully configured
+                before it is submitted.
+
+            job:
+                A job returned by create. A new job is created if None.
+
+            key:
+                Jobs with the same key run one at a time. Jobs without a key
+                run as soon as a worker is free.
+
+        Raises:
+            Nothing
+
+        Returns:
+            Job:
+                The job tracking the execution. The job is updated in place as
+                the execution progresses.
+        """
+        job = job or self.create()
+
+        with self._changed:
+            self._futures[job.id] = Future()
+            if key is not None and key in self._waiting:
+                self._waiting[key].append((job, dispatcher))
+            else:
+                if key is not None:
+                    self._waiting[key] = deque()
+                self._executor.submit(self._run, job, dispatcher, key)
+            self._evict()
+
+        _log.debug("Job %s submitted", job.id)
+        return job
+
+    def discard(self, job_id: str) -> None:
+        """Forget a job that was created but never submitted.
+
+        Arguments:
+            job_id:
+                The id of the job given by create.
+
+        Raises:
+            Nothing
+        """
+        with self._changed:
+            if job_id not in self._futures:
+                self._jobs.pop(job_id, None)
+
+    def get(self, job_id: str) -> Job:
+        """Lookup a job by its id.
+
+        Arguments:
+            job_id:
+                The id of the job given by submit.
+
+        Raises:
+            PyFlexNotFound:
+                Raised if the job does not exist or has been forgotten.
+
+        Returns:
+            Job:
+                The requested job.
+        """
+        with self._changed:
+            try:
+                return self._jobs[job_id]
+            except KeyError:
+                raise exceptions.PyFlexNotFound("Job not found.")
+
+    def wait(self, job_id: str, timeout: Optional[float] = None) -> Job:
+        """Block until a job has finished.
+
+        Arguments:
+            job_id:
+                The id of the job given by submit.
+
+            timeout:
+                The maximum number of seconds to wait. Waits forever if None.
+
+        Raises:
+            PyFlexNotFound:
+                Raised if the job does not exist or has been forgotten.
+
+        Returns:
+            Job:
+                The requested job. The job might still be running if the
+                timeout expired.
+        """
+        job = self.get(job_id)
+        with self._changed:
+            future = self._futures.get(job_id)
+        if future is not None:
+            wait([future], timeout=timeout)
+        return job
+
+    def append_output(self, job_id: str, line: str) -> None:
+        """Record a line of output for a job.
+
+        Arguments:
+            job_id:
+                The id of the job that produced the output.
+
+            line:
+                A single line of output without the line terminator.
+
+        Raises:
+            Nothing
+        """
+        with self._changed:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+
+            job.output.append(line)
+            job.output_size += len(line)
+
+            overflow = max(0, len(job.output) - self._max_output_lines)
+            job.output_size -= sum(len(line) for line in job.output[:overflow])
+            while job.output_size > self._max_output_bytes and overflow < len(job.output) - 1:
+                job.output_size -= len(job.output[overflow])
+                overflow += 1
+
+            if overflow > 0:
+                del job.output[:overflow]
+                job.output_dropped += overflow
+
+            self._changed.notify_all()
+
+    def follow(self, job_id: str, heartbeat: Optional[float] = None) -> Iterator[Optional[str]]:
+        """Iterate the output of a job as it is produced.
+
+        The iterator starts with the output recorded so far and ends once the job
+        has finished and all of its output has been consumed.
+
+        Arguments:
+            job_id:
+                The id of the job given by submit.
+
+            heartbeat:
+                If given, None is yielded whenever no output was produced for
+                this many seconds. This lets callers keep idle connections open.
+
+        Raises:
+            PyFlexNotFound:
+                Raised if the job does not exist or has been forgotten.
+
+        Returns:
+            Iterator:
+                Yields the lines of output in the order they were recorded.
+        """
+        job = self.get(job_id)
+        return self._follow(job, heartbeat)
+
+    def shutdown(self) -> None:
+        """Stop accepting jobs and wait for running jobs to finish.
+
+        Arguments:
+            Nothing
+
+        Raises:
+            Nothing
+        """
+        # Queued jobs are handed to the pool by the jobs before them.
+        with self._changed:
+            futures = list(self._futures.values())
+        wait(futures)
+        self._executor.shutdown(wait=True)
+
+    def _follow(self, job: Job, heartbeat: Optional[float]) -> Iterator[Optional[str]]:
+        position = 0
+
+        while True:
+            with self._changed:
+                available = job.output_dropped + len(job.output)
+                if position >= available and job.status not in _FINISHED:
+                    if not self._changed.wait(timeout=heartbeat):
+                        pending = None
+                    else:
+                        continue
+                else:
+                    # Lines that were dropped before we read them are skipped.
+                    position = max(position, job.output_dropped)
+                    pending = job.output[position - job.output_dropped:]
+                    finished = job.status in _FINISHED
+
+            if pending is None:
+                yield None
+                continue
+
+            for line in pending:
+                yield line
+            position += len(pending)
+
+            if finished and not pending:
+                return
+
+    def _run(self, job: Job, dispatcher: CommandDispatcher, key: Optional[Hashable]) -> None:
+        with self._changed:
+            # Kept, since the job may be forgotten as soon as it has finished.
+            future = self._futures[job.id]
+
+        self._set_status(job, JobStatusEnum.RUNNING)
+        _log.debug("Job %s running", job.id)
+
+        try:
+            job.result = dispatcher.execute()
+
+        except Exception as ex:
+            # The dispatcher is expected to emit client-safe exceptions. Anything
+            # else is logged and stored so the job does not hang in RUNNING.
+            _log.warning("Job %s failed: %s", job.id, ex)
+            job.error = ex
+            self._set_status(job, JobStatusEnum.FAILED)
+
+        else:
+            _log.debug("Job %s succeeded", job.id)
+            self._set_status(job, JobStatusEnum.SUCCEEDED)
+
+        finally:
+            self._next(key)
+            future.set_result(None)
+
+    def _next(self, key: Optional[Hashable]) -> None:
+        if key is None:
+            return
+
+        with self._changed:
+            waiting = self._waiting[key]
+            if waiting:
+                job, dispatcher = waiting.popleft()
+                self._executor.submit(self._run, job, dispatcher, key)
+            else:
+                del self._waiting[key]
+
+    def _set_status(self, job: Job, status: JobStatusEnum) -> None:
+        with self._changed:
+            job.status = status
+            self._changed.notify_all()
+
+    def _evict(self) -> None:
+        finished = [
+            job_id for job_id, job in self._jobs.items()
+            if job.status in _FINISHED
+        ]
+        for job_id in finished[:max(0, len(self._jobs) - self._max_history)]:
+            del self._jobs[job_id]
+            del self._futures[job_id]
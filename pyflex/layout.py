@@ -0,0 +1,106 @@
+import re
+from typing import Iterable
+from .exceptions import PyFlexInvalidParameter
+from .models import FlashROMRegion
+
+
+# Layout files are read by FlashROM with "%x:%x %s". Names are restricted
+# further so they are safe to show and pass around.
+_REGION = re.compile(
+    r"^\s*(?:0[xX])?(?P<start>[0-9a-fA-F]{1,8}):(?:0[xX])?(?P<end>[0-9a-fA-F]{1,8})"
+    r"\s+(?P<name>\S+)\s*$"
+)
+
+
+_NAME = re.compile(r"^[A-Za-z0-9_][A-Za-z0-9_.+-]{0,62}$")
+
+
+# FlashROM refuses layouts with more regions than this.
+MAX_REGIONS = 64
+
+
+def validate_region_name(name: str) -> str:
+    """Check that a region name is safe to pass to the FlashROM utility.
+
+    Arguments:
+        name:
+            The region name.
+
+    Raises:
+        PyFlexInvalidParameter:
+            Raised if the name is empty, too long, starts with one of ".+-" or
+            has characters other than letters, digits and "_.+-".
+
+    Returns:
+        str:
+            The name.
+    """
+    if not _NAME.match(name):
+        raise PyFlexInvalidParameter(f"Invalid region name: {name[:64]!r}.")
+    return name
+
+
+def parse_layout(text: str) -> list[FlashROMRegion]:
+    """Parse a FlashROM layout file.
+
+    Each line holds a region as "start:end name" with hexadecimal, inclusive
+    offsets. Blank lines are ignored.
+
+    Arguments:
+        text:
+            The content of the layout file.
+
+    Raises:
+        PyFlexInvalidParameter:
+            Raised if a line is malformed, a region ends before it starts, a
+            name is used twice or there are too many regions.
+
+    Returns:
+        list:
+            The regions, in the order of the file.
+    """
+    regions = []
+
+    for number, line in enumerate(text.splitlines(), start=1):
+        if not line.strip():
+            continue
+
+        match = _REGION.match(line)
+        if not match:
+            raise PyFlexInvalidParameter(f"Invalid layout on line {number}.")
+
+        region = FlashROMRegion(
+            int(match["start"], 16),
+            int(match["end"], 16),
+            validate_region_name(match["name"]),
+        )
+        if region.end < region.start:
+            raise PyFlexInvalidParameter(f"Region {region.name} ends before it starts.")
+        if any(other.name == region.name for other in regions):
+            raise PyFlexInvalidParameter(f"Region {region.name} is defined twice.")
+        regions.append(region)
+
+    if not regions:
+        raise PyFlexInvalidParameter("The layout has no regions.")
+
+    if len(regions) > MAX_REGIONS:
+        raise PyFlexInvalidParameter(f"The layout has more than {MAX_REGIONS} regions.")
+
+    return regions
+
+
+def render_layout(regions: Iterable[FlashROMRegion]) -> str:
+    """Render regions as a FlashROM layout file.
+
+    Arguments:
+        regions:
+            The regions to render.
+
+    Raises:
+        Nothing
+
+    Returns:
+        str:
+            The content of the layout file.
+    """
+    return "".join(f"{region.start:08x}:{region.end:08x} {region.name}\n" for region in regions)
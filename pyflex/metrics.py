@@ -0,0 +1,372 @@
+import math
+from bisect import bisect_left
+from logging import getLogger
+from threading import Lock
+from typing import Callable, Iterable, Optional
+
+
+_log = getLogger(__name__)
+
+
+# Seconds. FlashROM operations take from well under a second to probe to
+# several minutes to write a large chip.
+DEFAULT_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str]) -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    # Common parts of every metric: a name, help text and label names.
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._lock = Lock()
+
+    def _key(self, labels: dict[str, str]) -> tuple:
+        if set(labels) != set(self.labels):
+            raise ValueError(f"{self.name} expects labels {self.labels}, got {tuple(labels)}.")
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def render(self) -> list[str]:
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+            *self._samples(),
+        ]
+
+    def _samples(self) -> list[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """A value that only goes up, such as the number of operations.
+
+    Arguments:
+        name:
+            The metric name.
+
+        documentation:
+            A line describing the metric.
+
+        labels:
+            The names of the labels that tell series apart.
+
+    Methods:
+        inc: Add to the counter.
+        value: Get the current value of a series.
+    """
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = ()) -> None:
+        super().__init__(name, documentation, labels)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        """Add to the counter.
+
+        Arguments:
+            amount:
+                The amount to add. Must not be negative.
+
+            labels:
+                A value for every label of the metric.
+
+        Raises:
+            ValueError:
+                Raised if the amount is negative or the labels do not match.
+        """
+        if amount < 0:
+            raise ValueError("Counters can only go up.")
+
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        """Get the current value of a series.
+
+        Arguments:
+            labels:
+                A value for every label of the metric.
+
+        Raises:
+            ValueError:
+                Raised if the labels do not match.
+
+        Returns:
+            float:
+                The value, 0 if the series has not been counted yet.
+        """
+        key = self._key(labels)
+        with self._lock:
+            return self._values.get(key, 0)
+
+    def _samples(self) -> list[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [
+            f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+            for key, value in values
+        ]
+
+
+class Histogram(_Metric):
+    """Observations counted in buckets, such as the duration of operations.
+
+    Arguments:
+        name:
+            The metric name.
+
+        documentation:
+            A line describing the metric.
+
+        labels:
+            The names of the labels that tell series apart.
+
+        buckets:
+            The upper bounds of the buckets, in increasing order.
+
+    Methods:
+        observe: Record an observation.
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Iterable[str] = (),
+        buckets: Iterable[float] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labels)
+        self._buckets = tuple(sorted(buckets))
+        # Per series: a count per bucket plus one for +Inf, and the sum.
+        self._series: dict[tuple, tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        """Record an observation.
+
+        Arguments:
+            value:
+                The observed value.
+
+            labels:
+                A value for every label of the metric.
+
+        Raises:
+            ValueError:
+                Raised if the labels do not match.
+        """
+        key = self._key(labels)
+        index = bisect_left(self._buckets, value)
+
+        with self._lock:
+            counts, total = self._series.setdefault(
+                key, ([0] * (len(self._buckets) + 1), [0.0])
+            )
+            counts[index] += 1
+            total[0] += value
+
+    def _samples(self) -> list[str]:
+        with self._lock:
+            series = sorted((key, list(counts), total[0]) for key, (counts, total) in self._series.items())
+
+        lines = []
+        for key, counts, total in series:
+            cumulative = 0
+            for bound, count in zip((*self._buckets, math.inf), counts):
+                cumulative += count
+                labels = _format_labels((*self.labels, "le"), (*key, _format_value(bound)))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Gauge(_Metric):
+    """A value read when the metrics are collected, such as a queue depth.
+
+    Arguments:
+        name:
+            The metric name.
+
+        documentation:
+            A line describing the metric.
+
+        labels:
+            The names of the labels that tell series apart.
+
+        collect:
+            A callable returning the current value of every series as a
+            dictionary keyed by a tuple of label values.
+    """
+
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Iterable[str] = (),
+        collect: Optional[Callable[[], dict[tuple, float]]] = None,
+    ) -> None:
+        super().__init__(name, documentation, labels)
+        self._collect = collect or dict
+
+    def _samples(self) -> list[str]:
+        try:
+            values = sorted(self._collect().items())
+        except Exception:
+            _log.exception("Unable to collect %s", self.name)
+            return []
+
+        return [
+            f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+            for key, value in values
+        ]
+
+
+class MetricsRegistry:
+    """A set of metrics rendered together in the Prometheus text format.
+
+    Methods:
+        counter: Create and register a Counter.
+        histogram: Create and register a Histogram.
+        gauge: Create and register a Gauge.
+        render: Render every metric.
+    """
+
+    # https://prometheus.io/docs/instrumenting/exposition_formats/
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self) -> None:
+        self._metrics: dict[str, _Metric] = {}
+        self._lock = Lock()
+
+    def counter(self, name: str, documentation: str, labels: Iterable[str] = ()) -> Counter:
+        """Create and register a Counter. See Counter for the arguments."""
+        return self._register(Counter(name, documentation, labels))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labels: Iterable[str] = (),
+        buckets: Iterable[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        """Create and register a Histogram. See Histogram for the arguments."""
+        return self._register(Histogram(name, documentation, labels, buckets))
+
+    def gauge(
+        self,
+        name: str,
+        documentation: str,
+        labels: Iterable[str] = (),
+        collect: Optional[Callable[[], dict[tuple, float]]] = None,
+    ) -> Gauge:
+        """Create and register a Gauge. See Gauge for the arguments."""
+        return self._register(Gauge(name, documentation, labels, collect))
+
+    def render(self) -> str:
+        """Render every metric.
+
+        Arguments:
+            Nothing
+
+        Raises:
+            Nothing
+
+        Returns:
+            str:
+                The metrics in the Prometheus text exposition format.
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "".join(line + "\n" for metric in metrics for line in metric.render())
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered.")
+            self._metrics[metric.name] = metric
+        return metric
+
+
+class OperationMetrics:
+    """The metrics FlashROMService records about the operations it executes.
+
+    Arguments:
+        registry:
+            The registry to add the metrics to.
+
+    Methods:
+        record_operation:
+            Count a finished operation.
+
+        record_duration:
+            Record how long the adapter took for an operation.
+    """
+
+    def __init__(self, registry: MetricsRegistry) -> None:
+        self.operations = registry.counter(
+            "pyflex_operations_total",
+            "Operations executed, by action and outcome.",
+            ["action", "outcome"],
+        )
+        self.duration = registry.histogram(
+            "pyflex_flashrom_duration_seconds",
+            "Time the FlashROM adapter took per operation, by action.",
+            ["action"],
+        )
+
+    def record_operation(self, action: str, outcome: str) -> None:
+        """Count a finished operation.
+
+        Arguments:
+            action:
+                The action, e.g. "write".
+
+            outcome:
+                "success" or "failure".
+
+        Raises:
+            Nothing
+        """
+        self.operations.inc(action=action, outcome=outcome)
+
+    def record_duration(self, action: str, seconds: float) -> None:
+        """Record how long the adapter took for an operation.
+
+        Arguments:
+            action:
+                The action, e.g. "write".
+
+            seconds:
+                The time the adapter took.
+
+        Raises:
+            Nothing
+        """
+        self.duration.observe(seconds, action=action)
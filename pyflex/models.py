@@ -1,6 +1,6 @@
-from typing import Optional
+from typing import Any, Optional
 from enum import Enum, auto as enum_auto
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
 
 class FlashROMActionEnum(Enum):
@@ -9,6 +9,27 @@ class FlashROMActionEnum(Enum):
     READ = enum_auto()
     VERIFY = enum_auto()
     WRITE = enum_auto()
+    BLANK_CHECK = enum_auto()
+
+
+class FlashROMPhaseEnum(Enum):
+    READ = enum_auto()
+    ERASE = enum_auto()
+    WRITE = enum_auto()
+    VERIFY = enum_auto()
+
+
+class FlashROMPhaseStatusEnum(Enum):
+    RUNNING = enum_auto()
+    DONE = enum_auto()
+    FAILED = enum_auto()
+
+
+class JobStatusEnum(Enum):
+    PENDING = enum_auto()
+    RUNNING = enum_auto()
+    SUCCEEDED = enum_auto()
+    FAILED = enum_auto()
 
 
 @dataclass
@@ -18,11 +39,131 @@ class FlashROMOpts:
     verbosity: int
     programmer: str
     input_path: Optional[str] = None
+    flash_contents: Optional[str] = None
+    chip: Optional[str] = None
+    layout: Optional[str] = None
+    ifd: bool = False
+    fmap: bool = False
+    include: list[str] = field(default_factory=list)
+    # Only verify the included regions after a write.
+    verify_included_only: bool = False
+
+
+@dataclass
+class FlashROMRegion:
+    start: int
+    # Inclusive, like in FlashROM layout files.
+    end: int
+    name: str
+
+
+@dataclass
+class ImageDiff:
+    size: int
+    block_size: int
+    # (start, end) byte ranges, end exclusive, aligned to blocks.
+    ranges: list[tuple[int, int]]
+    changed_blocks: int
+    changed_bytes: int
+
+
+@dataclass
+class HexRow:
+    offset: int
+    hex: str
+    text: str
+
+
+@dataclass
+class HexPage:
+    size: int
+    offset: int
+    rows: list[HexRow]
+
+
+@dataclass
+class DumpOverviewLevel:
+    block_size: int
+    # One byte per block scaled to 0-255: the entropy out of 8 bits per byte
+    # and the fractions of 0xFF and 0x00 bytes.
+    entropy: bytes
+    erased: bytes
+    zero: bytes
+
+
+@dataclass
+class DumpOverview:
+    size: int
+    # The first level has a value per block, every next level half as many.
+    levels: list[DumpOverviewLevel]
+
+
+@dataclass
+class FlashROMChip:
+    vendor: str
+    name: str
+    size: int
+    bus: str
+
+
+@dataclass
+class FlashROMPhase:
+    phase: FlashROMPhaseEnum
+    status: FlashROMPhaseStatusEnum
+    # Seconds since the FlashROM utility was started, when known.
+    started: Optional[float] = None
+    finished: Optional[float] = None
+
+
+@dataclass
+class FlashROMReport:
+    programmer: Optional[str] = None
+    chips: list[FlashROMChip] = field(default_factory=list)
+    phases: list[FlashROMPhase] = field(default_factory=list)
+    elapsed: Optional[float] = None
+    # Seconds from start until the chip was found, when known.
+    probed: Optional[float] = None
+
+
+@dataclass
+class FlashROMBlankCheck:
+    size: int
+    block_size: int
+    # (start, end) byte ranges, end exclusive, of the blocks that are not
+    # erased. Empty if the whole chip is erased.
+    dirty: list[tuple[int, int]]
+    dirty_blocks: int
+
+
+@dataclass
+class FlashROMHashCheck:
+    expected: str
+    actual: str
+    match: bool
+    # Offset of the first block that differs, when the expected image is known.
+    first_difference: Optional[int] = None
 
 
 @dataclass
 class FlashROMExecResult:
     message: str
     path: Optional[str] = None
+    report: Optional[FlashROMReport] = field(default=None, compare=False)
+    # Seconds spent per step, e.g. "upload", "spawn", "probe" or "write".
+    timings: dict[str, float] = field(default_factory=dict, compare=False)
+    blank_check: Optional[FlashROMBlankCheck] = field(default=None, compare=False)
+    hash_check: Optional[FlashROMHashCheck] = field(default=None, compare=False)
+
+
+@dataclass
+class Job:
+    id: str
+    status: JobStatusEnum = JobStatusEnum.PENDING
+    result: Optional[FlashROMExecResult] = None
+    error: Optional[Exception] = None
+    output: list[str] = field(default_factory=list)
+    output_dropped: int = 0
+    output_size: int = 0
+    progress: Optional[Any] = None
 
 
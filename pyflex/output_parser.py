@@ -0,0 +1,232 @@
+import re
+from copy import deepcopy
+from threading import Lock
+from typing import Optional
+from .models import (
+    FlashROMChip,
+    FlashROMPhase,
+    FlashROMPhaseEnum,
+    FlashROMPhaseStatusEnum,
+    FlashROMReport,
+)
+
+
+# Found Winbond flash chip "W25Q64.V" (8192 kB, SPI) on ch341a_spi.
+_FOUND_CHIP = re.compile(
+    r'^Found (?P<vendor>.+?) flash chip "(?P<name>[^"]+)" '
+    r'\((?P<size>\d+) kB, (?P<bus>[^)]+)\)'
+    r'(?:.* on (?P<programmer>[\w-]+)\.?)?'
+)
+
+
+# Reading old flash chip contents... done.
+# Erasing and writing flash chip... Erase/write done.
+# Verifying flash... VERIFIED.
+_PHASE_START = re.compile(
+    r"(?P<what>Reading old flash chip contents|Reading flash|"
+    r"Erasing and writing flash chip|Erasing flash chip|Verifying flash)\.\.\."
+)
+
+
+_PHASE_DONE = re.compile(r"\b(?:done|VERIFIED)\b")
+
+
+_PHASE_FAILED = re.compile(r"FAILED|\bfailed\b")
+
+
+_PHASES = {
+    "Reading old flash chip contents": [FlashROMPhaseEnum.READ],
+    "Reading flash": [FlashROMPhaseEnum.READ],
+    "Erasing and writing flash chip": [FlashROMPhaseEnum.ERASE, FlashROMPhaseEnum.WRITE],
+    "Erasing flash chip": [FlashROMPhaseEnum.ERASE],
+    "Verifying flash": [FlashROMPhaseEnum.VERIFY],
+}
+
+
+def _make_chip(match: re.Match) -> FlashROMChip:
+    return FlashROMChip(
+        vendor=match["vendor"],
+        name=match["name"],
+        size=int(match["size"]) * 1024,
+        bus=match["bus"],
+    )
+
+
+def parse_chips(text: str) -> list[FlashROMChip]:
+    """Find the chips reported by the FlashROM utility.
+
+    Arguments:
+        text:
+            The output of the FlashROM utility.
+
+    Raises:
+        Nothing
+
+    Returns:
+        list:
+            A FlashROMChip for each chip that was found. Sizes are in bytes.
+    """
+    return [
+        _make_chip(match)
+        for match in map(_FOUND_CHIP.match, (line.strip() for line in text.splitlines()))
+        if match
+    ]
+
+
+class FlashROMOutputParser:
+    """Turn the output of the FlashROM utility into a FlashROMReport.
+
+    Lines are fed one at a time, as they arrive, so that the report can be
+    inspected while the utility is still running. Feeding and reading the
+    report may happen from different threads.
+
+    Methods:
+        feed:
+            Parse a single line of output.
+
+        finish:
+            Settle phases that are still running once the utility has exited.
+
+        report:
+            Get a snapshot of the report parsed so far.
+    """
+
+    def __init__(self) -> None:
+        self._report = FlashROMReport()
+        self._running: list[FlashROMPhase] = []
+        self._lock = Lock()
+
+    def feed(
+        self,
+        line: str,
+        started: Optional[float] = None,
+        finished: Optional[float] = None,
+    ) -> None:
+        """Parse a single line of output.
+
+        Arguments:
+            line:
+                A line written by the FlashROM utility.
+
+            started:
+                When the first part of the line was written, in seconds since
+                the utility was started. Phases are not timed if None.
+
+            finished:
+                When the end of the line was written, in seconds since the
+                utility was started.
+
+        Raises:
+            Nothing
+        """
+        line = line.strip()
+
+        with self._lock:
+            match = _FOUND_CHIP.match(line)
+            if match:
+                self._report.chips.append(_make_chip(match))
+                self._report.programmer = match["programmer"] or self._report.programmer
+                if self._report.probed is None:
+                    self._report.probed = finished
+                return
+
+            match = _PHASE_START.search(line)
+            if match:
+                self._settle(FlashROMPhaseStatusEnum.DONE, started)
+                self._running = [
+                    FlashROMPhase(phase, FlashROMPhaseStatusEnum.RUNNING, started)
+                    for phase in _PHASES[match["what"]]
+                ]
+                self._report.phases.extend(self._running)
+                line = line[match.end():]
+
+            if not self._running:
+                return
+
+            if _PHASE_FAILED.search(line):
+                self._settle(FlashROMPhaseStatusEnum.FAILED, finished)
+
+            elif _PHASE_DONE.search(line):
+                self._settle(FlashROMPhaseStatusEnum.DONE, finished)
+
+    def finish(self, returncode: int, elapsed: Optional[float] = None) -> None:
+        """Settle phases that are still running once the utility has exited.
+
+        Arguments:
+            returncode:
+                The exit code of the FlashROM utility.
+
+            elapsed:
+                The number of seconds the utility ran for, if known.
+
+        Raises:
+            Nothing
+        """
+        with self._lock:
+            self._settle(
+                FlashROMPhaseStatusEnum.DONE if returncode == 0
+                else FlashROMPhaseStatusEnum.FAILED,
+                elapsed,
+            )
+            self._report.elapsed = elapsed
+
+    def report(self) -> FlashROMReport:
+        """Get a snapshot of the report parsed so far.
+
+        Arguments:
+            Nothing
+
+        Raises:
+            Nothing
+
+        Returns:
+            FlashROMReport:
+                A copy of the report that is not changed by later lines.
+        """
+        with self._lock:
+            return deepcopy(self._report)
+
+    def _settle(self, status: FlashROMPhaseStatusEnum, at: Optional[float] = None) -> None:
+        for phase in self._running:
+            phase.status = status
+            phase.finished = at if phase.started is not None else None
+        self._running = []
+
+
+def phase_timings(report: FlashROMReport) -> dict[str, float]:
+    """Sum up how long each phase of an operation took.
+
+    FlashROM erases and writes block by block when writing, so that time is
+    counted as "write" only. "erase" is the time of a separate erase.
+
+    Arguments:
+        report:
+            A report parsed from timed lines.
+
+    Raises:
+        Nothing
+
+    Returns:
+        dict:
+            Seconds by "probe", "read", "erase", "write" and "verify". Steps
+            that did not happen or were not timed are left out.
+    """
+    timings = {}
+
+    if report.probed is not None:
+        timings["probe"] = report.probed
+
+    for phase in report.phases:
+        if phase.started is None or phase.finished is None:
+            continue
+
+        if phase.phase == FlashROMPhaseEnum.ERASE and any(
+            other.phase == FlashROMPhaseEnum.WRITE and other.started == phase.started
+            for other in report.phases
+        ):
+            continue
+
+        name = phase.phase.name.lower()
+        timings[name] = timings.get(name, 0) + phase.finished - phase.started
+
+    return timings
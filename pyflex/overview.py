@@ -0,0 +1,294 @@
+import json
+import math
+import os
+from base64 import b64decode, b64encode
+from collections import Counter
+from logging import getLogger
+from pathlib import Path
+from uuid import uuid4 as uuid
+from .models import DumpOverview, DumpOverviewLevel
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover - depends on the environment
+    numpy = None
+
+
+_log = getLogger(__name__)
+
+
+DEFAULT_BLOCK_SIZE = 4096
+
+
+# Blocks are read this many at a time so memory use does not grow with the
+# size of the dump.
+CHUNK_BLOCKS = 256
+
+
+_SUFFIX = ".overview.json"
+
+
+# Matches cached overviews as well as partial ones left behind by a crash, for
+# use with a DirectoryReaper.
+OVERVIEW_PATTERN = f"*{_SUFFIX}"
+
+
+def _block_stats_numpy(chunk: bytes, block_size: int) -> tuple[bytes, bytes, bytes]:
+    data = numpy.frombuffer(chunk, dtype=numpy.uint8).reshape(-1, block_size)
+    blocks = len(data)
+
+    # A histogram per block, counted in a single pass.
+    index = numpy.arange(blocks, dtype=numpy.int64)[:, None] * 256 + data
+    counts = numpy.bincount(index.ravel(), minlength=blocks * 256).reshape(blocks, 256)
+
+    p = counts / block_size
+    logs = numpy.log2(p, out=numpy.zeros_like(p), where=p > 0)
+    entropy = -(p * logs).sum(axis=1) / 8
+
+    return tuple(
+        numpy.rint(values * 255).astype(numpy.uint8).tobytes()
+        for values in (entropy, p[:, 0xff], p[:, 0x00])
+    )
+
+
+def _block_stats_python(chunk: bytes, block_size: int) -> tuple[bytes, bytes, bytes]:
+    entropy, erased, zero = bytearray(), bytearray(), bytearray()
+
+    for offset in range(0, len(chunk), block_size):
+        block = chunk[offset:offset + block_size]
+        bits = -sum(n / block_size * math.log2(n / block_size) for n in Counter(block).values())
+        entropy.append(round(bits / 8 * 255))
+        erased.append(round(block.count(0xff) / block_size * 255))
+        zero.append(round(block.count(0x00) / block_size * 255))
+
+    return bytes(entropy), bytes(erased), bytes(zero)
+
+
+def _block_stats(chunk: bytes, block_size: int) -> tuple[bytes, bytes, bytes]:
+    if numpy is not None:
+        return _block_stats_numpy(chunk, block_size)
+    return _block_stats_python(chunk, block_size)
+
+
+def _halve(values: bytes) -> bytes:
+    # An odd last value is kept as is.
+    return bytes(
+        (values[i] + values[i + 1] + 1) // 2 if i + 1 < len(values) else values[i]
+        for i in range(0, len(values), 2)
+    )
+
+
+def _to_json(overview: DumpOverview, stat: os.stat_result) -> dict:
+    return {
+        "size": overview.size,
+        "mtime_ns": stat.st_mtime_ns,
+        "levels": [
+            {
+                "block_size": level.block_size,
+                "entropy": b64encode(level.entropy).decode(),
+                "erased": b64encode(level.erased).decode(),
+                "zero": b64encode(level.zero).decode(),
+            }
+            for level in overview.levels
+        ],
+    }
+
+
+def _from_json(data: dict) -> DumpOverview:
+    return DumpOverview(data["size"], [
+        DumpOverviewLevel(
+            level["block_size"],
+            b64decode(level["entropy"]),
+            b64decode(level["erased"]),
+            b64decode(level["zero"]),
+        )
+        for level in data["levels"]
+    ])
+
+
+def compute_overview(path: str, block_size: int = DEFAULT_BLOCK_SIZE) -> DumpOverview:
+    """Summarize a dump block by block.
+
+    The file is read once, CHUNK_BLOCKS blocks at a time. The statistics are
+    computed with numpy when it is installed. The last block may be short.
+
+    Arguments:
+        path:
+            The dump to summarize.
+
+        block_size:
+            The size of a block in bytes.
+
+    Raises:
+        OSError:
+            Raised if the file cannot be read.
+
+    Returns:
+        DumpOverview:
+            The statistics per block, followed by coarser levels down to a
+            single value.
+    """
+    entropy, erased, zero = bytearray(), bytearray(), bytearray()
+    size = 0
+
+    with open(path, "rb") as dump:
+        while chunk := dump.read(block_size * CHUNK_BLOCKS):
+            size += len(chunk)
+            whole = len(chunk) - len(chunk) % block_size
+            parts = [(chunk[:whole], block_size), (chunk[whole:], len(chunk) - whole)]
+
+            for part, part_block_size in parts:
+                if not part:
+                    continue
+                stats = _block_stats(part, part_block_size)
+                entropy += stats[0]
+                erased += stats[1]
+                zero += stats[2]
+
+    levels = [DumpOverviewLevel(block_size, bytes(entropy), bytes(erased), bytes(zero))]
+    while len(levels[-1].entropy) > 1:
+        last = levels[-1]
+        levels.append(DumpOverviewLevel(
+            last.block_size * 2,
+            _halve(last.entropy),
+            _halve(last.erased),
+            _halve(last.zero),
+        ))
+
+    return DumpOverview(size, levels)
+
+
+class DumpOverviews:
+    """Keep an overview next to each dump.
+
+    The overview of `dump.bin` is cached in `dump.bin.overview.json` so that it
+    is computed once, when the dump is made, rather than every time it is
+    looked at. A cached overview is computed again if the dump changed or the
+    overview was removed.
+
+    Arguments:
+        block_size:
+            The size of a block in bytes.
+
+    Methods:
+        create:
+            Compute the overview of a dump and cache it.
+
+        get:
+            Get the overview of a dump, computing it if it is not cached.
+
+        path:
+            Get the path of the cached overview of a dump.
+
+        delete:
+            Delete a dump and its cached overview.
+    """
+
+    def __init__(self, block_size: int = DEFAULT_BLOCK_SIZE) -> None:
+        self._block_size = block_size
+
+    def create(self, path: str) -> DumpOverview:
+        """Compute the overview of a dump and cache it.
+
+        Arguments:
+            path:
+                The dump.
+
+        Raises:
+            OSError:
+                Raised if the dump cannot be read or the overview cannot be
+                written.
+
+        Returns:
+            DumpOverview:
+                The overview.
+        """
+        path = Path(path)
+        stat = path.stat()
+        overview = compute_overview(path, self._block_size)
+
+        # Written under a temporary name so readers never see a partial file.
+        partial = path.with_name(f".{uuid()}{_SUFFIX}")
+        try:
+            partial.write_text(json.dumps(_to_json(overview, stat)))
+            partial.rename(self.path(path))
+        except Exception:
+            partial.unlink(missing_ok=True)
+            raise
+
+        _log.debug("Created overview of %s", path)
+        return overview
+
+    def get(self, path: str) -> DumpOverview:
+        """Get the overview of a dump, computing it if it is not cached.
+
+        Arguments:
+            path:
+                The dump.
+
+        Raises:
+            OSError:
+                Raised if the dump cannot be read.
+
+        Returns:
+            DumpOverview:
+                The overview.
+        """
+        stat = Path(path).stat()
+
+        try:
+            data = json.loads(self.path(path).read_text())
+            if (
+                data["size"] == stat.st_size
+                and data["mtime_ns"] == stat.st_mtime_ns
+                and data["levels"][0]["block_size"] == self._block_size
+            ):
+                return _from_json(data)
+
+        except FileNotFoundError:
+            pass
+
+        except (ValueError, KeyError, IndexError, TypeError):
+            _log.warning("Ignoring invalid overview of %s", path)
+
+        return self.create(path)
+
+    def path(self, path: str) -> Path:
+        """Get the path of the cached overview of a dump.
+
+        Arguments:
+            path:
+                The dump.
+
+        Raises:
+            Nothing
+
+        Returns:
+            Path:
+                The location of the overview. The overview might not exist.
+        """
+        path = Path(path)
+        return path.with_name(path.name + _SUFFIX)
+
+    def delete(self, path: str) -> bool:
+        """Delete a dump and its cached overview.
+
+        This is meant to be the delete callable of the DirectoryReaper that
+        keeps the dumps, so that overviews do not outlive them.
+
+        Arguments:
+            path:
+                The dump.
+
+        Raises:
+            OSError:
+                Raised if either file cannot be deleted.
+
+        Returns:
+            bool:
+                Always True.
+        """
+        path = Path(path)
+        path.unlink(missing_ok=True)
+        self.path(path).unlink(missing_ok=True)
+        return True
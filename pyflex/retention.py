@@ -0,0 +1,208 @@
+import os
+import time
+from dataclasses import dataclass
+from logging import getLogger
+from pathlib import Path
+from threading import Event, Thread
+from typing import Callable, Optional
+from .exceptions import PyFlexException
+
+
+_log = getLogger(__name__)
+
+
+def touch(path: Path) -> None:
+    """Record that a file has been used.
+
+    Only the access time is updated. It is set explicitly because many devices
+    mount their storage with relatime or noatime.
+
+    Arguments:
+        path:
+            The file that was used.
+
+    Raises:
+        Nothing
+    """
+    try:
+        os.utime(path, (time.time(), os.stat(path).st_mtime))
+    except FileNotFoundError:
+        pass
+
+
+def _unlink(path: Path) -> bool:
+    path.unlink(missing_ok=True)
+    return True
+
+
+@dataclass
+class _Entry:
+    path: Path
+    size: int
+    last_used: float
+
+
+class DirectoryReaper:
+    """Keep a directory within a size quota and maximum age.
+
+    Files that have not been used for longer than max_age are deleted. If the
+    remaining files are still larger than max_bytes, the least recently used
+    files are deleted until they fit. A file counts as used when it was last
+    written or when touch was last called for it.
+
+    Arguments:
+        directory:
+            The directory to keep tidy. Sub-directories are included.
+
+        max_bytes:
+            The most space, in bytes, the files may use. Not limited if None.
+
+        max_age:
+            The number of seconds a file may go unused. Not limited if None.
+
+        interval:
+            The number of seconds between passes of the background thread.
+
+        pattern:
+            A glob pattern that selects the files to manage.
+
+        delete:
+            A callable that deletes a file and returns True if it was deleted.
+            It may return False to keep a file that is still needed. Files it
+            raises a PyFlexException for are skipped.
+
+    Methods:
+        reap:
+            Run a single pass and return the deleted files.
+
+        start:
+            Run passes in a background thread.
+
+        stop:
+            Stop the background thread.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        max_bytes: Optional[int] = None,
+        max_age: Optional[float] = None,
+        interval: float = 600,
+        pattern: str = "*.bin",
+        delete: Callable[[Path], bool] = _unlink,
+    ) -> None:
+        self._directory = Path(directory)
+        self._max_bytes = max_bytes
+        self._max_age = max_age
+        self._interval = interval
+        self._pattern = pattern
+        self._delete = delete
+        self._stopped = Event()
+        self._thread = None
+
+    def reap(self) -> list[Path]:
+        """Run a single pass and return the deleted files.
+
+        Arguments:
+            Nothing
+
+        Raises:
+            Nothing
+
+        Returns:
+            list:
+                The paths of the files that were deleted.
+        """
+        now = time.time()
+        deleted = []
+        kept = []
+
+        for entry in sorted(self._scan(), key=lambda e: e.last_used):
+            if self._max_age is not None and now - entry.last_used > self._max_age:
+                if self._try_delete(entry):
+                    deleted.append(entry.path)
+                    continue
+            kept.append(entry)
+
+        total = sum(entry.size for entry in kept)
+
+        # The list is ordered by last use so the least recently used files are
+        # evicted first.
+        for entry in kept:
+            if self._max_bytes is None or total <= self._max_bytes:
+                break
+            if self._try_delete(entry):
+                deleted.append(entry.path)
+                total -= entry.size
+
+        if deleted:
+            _log.info("Reaped %s files from %s", len(deleted), self._directory)
+
+        return deleted
+
+    def start(self) -> None:
+        """Run passes in a background thread.
+
+        Arguments:
+            Nothing
+
+        Raises:
+            Nothing
+        """
+        if self._thread is not None:
+            return
+
+        self._stopped.clear()
+        self._thread = Thread(
+            target=self._run,
+            name=f"pyflex-reaper-{self._directory.name}",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the background thread.
+
+        Arguments:
+            Nothing
+
+        Raises:
+            Nothing
+        """
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            try:
+                self.reap()
+            except Exception:
+                # A failed pass is retried on the next interval rather than
+                # taking the thread down.
+                _log.exception("Unexpected error while reaping %s", self._directory)
+            self._stopped.wait(self._interval)
+
+    def _scan(self) -> list[_Entry]:
+        entries = []
+
+        for path in self._directory.rglob(self._pattern):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            if path.is_file():
+                entries.append(_Entry(path, stat.st_size, max(stat.st_atime, stat.st_mtime)))
+
+        return entries
+
+    def _try_delete(self, entry: _Entry) -> bool:
+        try:
+            if self._delete(entry.path):
+                _log.debug("Deleted %s", entry.path)
+                return True
+        except (OSError, PyFlexException) as ex:
+            # Skip the file, the rest of the pass must still run.
+            _log.warning("Unable to delete %s: %s", entry.path, ex)
+        return False
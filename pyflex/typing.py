@@ -1,5 +1,5 @@
 from abc import ABC, abstractmethod
-from typing import TypeVar
+from typing import ContextManager, TypeVar
 
 from .models import *
 
@@ -22,3 +22,21 @@ class FlashROMAdapter(ABC):
         """Runs the flashrom utility with the given options."""
         ...
 
+
+class AsyncFlashROMAdapter(ABC):
+
+    @abstractmethod
+    async def run_async(self, opts: FlashROMOpts) -> FlashROMExecResult:
+        """Runs the flashrom utility with the given options without blocking the event loop."""
+        ...
+
+
+class SessionFlashROMAdapter(ABC):
+
+    @abstractmethod
+    def session(self, programmer: str) -> ContextManager[None]:
+        """Keeps the programmer open for the operations run inside the block.
+
+        Only to be used while the device is held, e.g. with a DeviceManager.
+        """
+        ...
@@ -0,0 +1,103 @@
+import asyncio
+import pytest
+from unittest.mock import AsyncMock, patch, ANY
+from subprocess import CompletedProcess
+from contextlib import contextmanager
+
+from pyflex.models import FlashROMOpts, FlashROMActionEnum, FlashROMExecResult
+from pyflex.exceptions import PyFlexExecutionError
+from adapters.flashrom import AsyncFlashROMShellCommandAdapter
+
+
+def make_flashrom_opts(action: FlashROMActionEnum, **kwargs):
+    kwargs.setdefault("force", False)
+    kwargs.setdefault("verbosity", 0)
+    kwargs.setdefault("programmer", "dummy:emulate=M25P10.RES")
+    return FlashROMOpts(action=action, **kwargs)
+
+
+def make_flashrom_result(**kwargs):
+    kwargs.setdefault("args", ["flashrom", "-R"])
+    kwargs.setdefault("returncode", 0)
+    kwargs.setdefault("stdout", b'')
+    kwargs.setdefault("stderr", b'')
+    return CompletedProcess(**kwargs)
+
+
+@contextmanager
+def patch_exec(unit, result=None):
+    result = result or make_flashrom_result()
+    with patch.object(
+        unit,
+        "_execute_subprocess_async",
+        new=AsyncMock(return_value=result)
+    ) as _patch:
+        yield _patch
+
+
+@pytest.fixture()
+def output_path(tmp_path_factory):
+    return tmp_path_factory.mktemp("flashrom_async_shell_command_adapter")
+
+
+@pytest.fixture()
+def unit(output_path):
+    return AsyncFlashROMShellCommandAdapter(output_path)
+
+
+def test_flashrom_command_for_probe(unit: AsyncFlashROMShellCommandAdapter):
+    opts = make_flashrom_opts(FlashROMActionEnum.PROBE)
+    with patch_exec(unit) as _exec:
+        asyncio.run(unit.run_async(opts))
+        _exec.assert_called_with([
+            "flashrom",
+            "-p", "dummy:emulate=M25P10.RES",
+        ])
+
+
+def test_flashrom_command_for_read(unit: AsyncFlashROMShellCommandAdapter):
+    opts = make_flashrom_opts(FlashROMActionEnum.READ)
+    with patch_exec(unit) as _exec:
+        assert(asyncio.run(unit.run_async(opts)).path)
+        _exec.assert_called_with([
+            "flashrom",
+            "-p", "dummy:emulate=M25P10.RES",
+            "-r", ANY
+        ])
+
+
+def test_flashrom_should_raise_with_non_zero_exit(unit: AsyncFlashROMShellCommandAdapter):
+    opts = make_flashrom_opts(FlashROMActionEnum.READ)
+    result = make_flashrom_result(returncode=1)
+    with patch_exec(unit, result):
+        with pytest.raises(PyFlexExecutionError):
+            asyncio.run(unit.run_async(opts))
+
+
+def test_flashrom_response_with_message_from_stdout(unit: AsyncFlashROMShellCommandAdapter):
+    opts = make_flashrom_opts(FlashROMActionEnum.PROBE)
+    result = make_flashrom_result(stdout=b"Hello, World!")
+    expected = FlashROMExecResult("Hello, World!", path=None)
+    with patch_exec(unit, result):
+        assert(asyncio.run(unit.run_async(opts)) == expected)
+
+
+def test_flashrom_output_is_forwarded_line_by_line(output_path):
+    lines = []
+    unit = AsyncFlashROMShellCommandAdapter(output_path, on_output=lines.append)
+    result = asyncio.run(unit._execute_subprocess_async(
+        ["sh", "-c", "echo Hello; echo World >&2; exit 3"]
+    ))
+    assert(sorted(lines) == ["Hello", "World"])
+    assert(result.returncode == 3)
+    assert(result.stdout == b"Hello\n")
+    assert(result.stderr == b"World\n")
+
+
+def test_async_lines_are_timed_from_their_first_part(unit):
+    result = asyncio.run(unit._execute_subprocess_async(
+        ["sh", "-c", "printf 'Reading flash... '; sleep 0.2; echo done."]
+    ))
+    [(started, finished, line)] = result.timeline
+    assert(line == b"Reading flash... done.\n")
+    assert(finished - started >= 0.15)
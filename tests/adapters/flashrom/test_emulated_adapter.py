@@ -0,0 +1,242 @@
+import pytest
+from unittest.mock import patch
+
+from pyflex.models import (
+    FlashROMOpts,
+    FlashROMActionEnum,
+    FlashROMPhaseEnum,
+    FlashROMPhaseStatusEnum,
+)
+from pyflex.exceptions import PyFlexExecutionError
+from adapters.flashrom import EmulatedFlashChip, FlashROMEmulatedAdapter
+
+
+SIZE = 64 * 1024
+BLOCK = 4096
+
+
+def make_flashrom_opts(action: FlashROMActionEnum, **kwargs):
+    kwargs.setdefault("force", False)
+    kwargs.setdefault("verbosity", 0)
+    kwargs.setdefault("programmer", "dummy:emulate=M25P10.RES")
+    return FlashROMOpts(action=action, **kwargs)
+
+
+@pytest.fixture()
+def output_path(tmp_path_factory):
+    return tmp_path_factory.mktemp("flashrom_emulated_adapter")
+
+
+@pytest.fixture()
+def chip(tmp_path):
+    chip = EmulatedFlashChip(tmp_path / "chip.bin", size=SIZE, erase_block_size=BLOCK)
+    yield chip
+    chip.close()
+
+
+@pytest.fixture()
+def unit(chip, output_path):
+    return FlashROMEmulatedAdapter(chip, output_path)
+
+
+def make_image(tmp_path, data, name="image.bin"):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_new_chip_is_erased(chip):
+    assert chip.read() == b"\xff" * SIZE
+
+
+def test_chip_contents_persist(tmp_path):
+    chip = EmulatedFlashChip(tmp_path / "chip.bin", size=SIZE, erase_block_size=BLOCK)
+    chip.program(0, b"\x12\x34")
+    chip.close()
+
+    chip = EmulatedFlashChip(tmp_path / "chip.bin", size=SIZE, erase_block_size=BLOCK)
+    assert chip.read(0, 3) == b"\x12\x34\xff"
+    chip.close()
+
+
+def test_program_only_clears_bits(chip):
+    chip.program(0, b"\x0f")
+    chip.program(0, b"\xf1")
+    assert chip.read(0, 1) == b"\x01"
+
+    chip.erase_block(0)
+    assert chip.read(0, BLOCK) == b"\xff" * BLOCK
+
+
+def test_chip_rejects_out_of_range(chip):
+    with pytest.raises(ValueError):
+        chip.program(SIZE - 1, b"\x00\x00")
+
+    with pytest.raises(ValueError):
+        chip.erase_block(SIZE // BLOCK)
+
+
+def test_chip_rejects_bad_geometry(tmp_path):
+    with pytest.raises(ValueError):
+        EmulatedFlashChip(tmp_path / "chip.bin", size=1000, erase_block_size=BLOCK)
+
+
+def test_probe_reports_chip(unit):
+    result = unit.run(make_flashrom_opts(FlashROMActionEnum.PROBE))
+
+    assert result.path is None
+    assert result.report.programmer == "dummy"
+    assert [(chip.name, chip.size) for chip in result.report.chips] == [("EMULATED", SIZE)]
+
+
+def test_probe_named_chip_mismatch_raises(unit):
+    with pytest.raises(PyFlexExecutionError):
+        unit.run(make_flashrom_opts(FlashROMActionEnum.PROBE, chip="W25Q64.V"))
+
+
+def test_write_then_read_round_trip(unit, output_path, tmp_path):
+    data = bytes(range(256)) * (SIZE // 256)
+    image = make_image(tmp_path, data)
+
+    write = unit.run(make_flashrom_opts(FlashROMActionEnum.WRITE, input_path=image))
+    read = unit.run(make_flashrom_opts(FlashROMActionEnum.READ))
+
+    assert [phase.phase for phase in write.report.phases] == [
+        FlashROMPhaseEnum.READ,
+        FlashROMPhaseEnum.ERASE,
+        FlashROMPhaseEnum.WRITE,
+        FlashROMPhaseEnum.VERIFY,
+    ]
+    assert all(phase.status == FlashROMPhaseStatusEnum.DONE for phase in write.report.phases)
+    assert (output_path / read.path).read_bytes() == data
+
+
+def test_write_only_touches_changed_blocks(unit, chip, tmp_path):
+    data = bytearray(b"\xff" * SIZE)
+    data[BLOCK + 1] = 0x00
+
+    with (
+        patch.object(chip, "erase_block", wraps=chip.erase_block) as erase_block,
+        patch.object(chip, "program", wraps=chip.program) as program,
+    ):
+        unit.run(make_flashrom_opts(FlashROMActionEnum.WRITE, input_path=make_image(tmp_path, data)))
+
+        erase_block.assert_not_called()
+        program.assert_called_once_with(BLOCK, bytes(data[BLOCK:2 * BLOCK]))
+
+        data[BLOCK + 1] = 0x01
+        unit.run(make_flashrom_opts(FlashROMActionEnum.WRITE, input_path=make_image(tmp_path, data)))
+
+        erase_block.assert_called_once_with(1)
+
+
+def test_write_with_stale_contents_fails_verify(unit, tmp_path):
+    stale = make_image(tmp_path, b"\x00" * SIZE, "stale.bin")
+    image = make_image(tmp_path, b"\x00" * SIZE)
+
+    with pytest.raises(PyFlexExecutionError, match="FAILED"):
+        unit.run(make_flashrom_opts(
+            FlashROMActionEnum.WRITE,
+            input_path=image,
+            flash_contents=stale,
+        ))
+
+
+def test_wrong_image_size_raises(unit, tmp_path):
+    with pytest.raises(PyFlexExecutionError, match="doesn't match"):
+        unit.run(make_flashrom_opts(
+            FlashROMActionEnum.VERIFY,
+            input_path=make_image(tmp_path, b"\x00" * 16),
+        ))
+
+
+def test_erase_clears_chip(unit, chip):
+    chip.program(0, b"\x00" * BLOCK)
+
+    unit.run(make_flashrom_opts(FlashROMActionEnum.ERASE))
+
+    assert chip.read() == b"\xff" * SIZE
+
+
+LAYOUT = f"00000000:{BLOCK - 1:08x} fd\n{BLOCK:08x}:{SIZE - 1:08x} bios\n"
+
+
+def test_write_only_includes_regions_of_layout(unit, chip, tmp_path):
+    chip.program(0, b"\x12" * BLOCK)
+    layout = make_image(tmp_path, LAYOUT.encode(), "layout.txt")
+
+    unit.run(make_flashrom_opts(
+        FlashROMActionEnum.WRITE,
+        input_path=make_image(tmp_path, b"\x00" * SIZE),
+        layout=layout,
+        include=["bios"],
+    ))
+
+    assert chip.read() == b"\x12" * BLOCK + b"\x00" * (SIZE - BLOCK)
+
+
+def test_write_with_stale_contents_fails_verify_outside_regions(unit, chip, tmp_path):
+    chip.program(0, b"\x12" * BLOCK)
+    stale = make_image(tmp_path, b"\xff" * SIZE, "stale.bin")
+    opts = make_flashrom_opts(
+        FlashROMActionEnum.WRITE,
+        input_path=make_image(tmp_path, b"\x00" * SIZE),
+        flash_contents=stale,
+        layout=make_image(tmp_path, LAYOUT.encode(), "layout.txt"),
+        include=["bios"],
+    )
+
+    with pytest.raises(PyFlexExecutionError, match="FAILED"):
+        unit.run(opts)
+
+    opts.verify_included_only = True
+    unit.run(opts)
+
+
+def test_erase_only_includes_regions_of_layout(unit, chip, tmp_path):
+    chip.program(0, b"\x00" * SIZE)
+
+    unit.run(make_flashrom_opts(
+        FlashROMActionEnum.ERASE,
+        layout=make_image(tmp_path, LAYOUT.encode(), "layout.txt"),
+        include=["fd"],
+    ))
+
+    assert chip.read() == b"\xff" * BLOCK + b"\x00" * (SIZE - BLOCK)
+
+
+def test_read_only_includes_regions_of_layout(unit, chip, output_path, tmp_path):
+    chip.program(0, b"\x00" * SIZE)
+
+    result = unit.run(make_flashrom_opts(
+        FlashROMActionEnum.READ,
+        layout=make_image(tmp_path, LAYOUT.encode(), "layout.txt"),
+        include=["fd"],
+    ))
+
+    assert (output_path / result.path).read_bytes() == b"\x00" * BLOCK + b"\xff" * (SIZE - BLOCK)
+
+
+@pytest.mark.parametrize("options", [
+    {"ifd": True, "include": ["bios"]},
+    {"fmap": True, "include": ["bios"]},
+    {"include": ["bios"]},
+    {"layout": "layout.txt", "include": ["me"]},
+])
+def test_unsupported_regions_raise(unit, chip, tmp_path, options):
+    if "layout" in options:
+        options["layout"] = make_image(tmp_path, LAYOUT.encode(), "layout.txt")
+
+    with pytest.raises(PyFlexExecutionError):
+        unit.run(make_flashrom_opts(FlashROMActionEnum.ERASE, **options))
+
+    assert chip.read() == b"\xff" * SIZE
+
+
+def test_output_listener_receives_lines(chip, output_path):
+    lines = []
+    unit = FlashROMEmulatedAdapter(chip, output_path, on_output=lines.append)
+
+    unit.run(make_flashrom_opts(FlashROMActionEnum.READ))
+
+    assert lines[1:] == ["Reading flash...", "done."]
@@ -82,6 +82,25 @@ def test_flashrom_command_for_write_with_verbosity_and_force(
         ])
 
 
+def test_flashrom_command_for_write_with_known_contents(
+    unit: FlashROMShellCommandAdapter,
+    testing_dir
+):
+    opts = make_flashrom_opts(
+        FlashROMActionEnum.WRITE,
+        input_path=testing_dir / "testfile.bin",
+        flash_contents=testing_dir / "contents.bin",
+    )
+    with patch_exec(unit) as _exec:
+        unit.run(opts)
+        _exec.assert_called_with([
+            "flashrom",
+            "-p", "dummy:emulate=M25P10.RES",
+            "-w", opts.input_path,
+            "--flash-contents", opts.flash_contents,
+        ])
+
+
 def test_flashrom_command_for_erase(unit: FlashROMShellCommandAdapter):
     opts = make_flashrom_opts(FlashROMActionEnum.ERASE)
     with patch_exec(unit) as _exec:
@@ -93,6 +112,56 @@ def test_flashrom_command_for_erase(unit: FlashROMShellCommandAdapter):
         ])
 
 
+def test_flashrom_command_for_erase_with_named_chip(unit: FlashROMShellCommandAdapter):
+    opts = make_flashrom_opts(FlashROMActionEnum.ERASE, chip="W25Q64.V")
+    with patch_exec(unit) as _exec:
+        unit.run(opts)
+        _exec.assert_called_with([
+            "flashrom",
+            "-p", "dummy:emulate=M25P10.RES",
+            "-E",
+            "-c", "W25Q64.V",
+        ])
+
+
+def test_flashrom_command_for_write_with_layout(unit: FlashROMShellCommandAdapter):
+    opts = make_flashrom_opts(
+        FlashROMActionEnum.WRITE,
+        input_path="/tmp/image.bin",
+        layout="/tmp/layout.txt",
+        include=["changed0", "changed1"],
+        verify_included_only=True,
+    )
+    with patch_exec(unit) as _exec:
+        unit.run(opts)
+        _exec.assert_called_with([
+            "flashrom",
+            "-p", "dummy:emulate=M25P10.RES",
+            "-w", "/tmp/image.bin",
+            "-l", "/tmp/layout.txt",
+            "--include", "changed0",
+            "--include", "changed1",
+            "--noverify-all",
+        ])
+
+
+def test_flashrom_command_for_read_with_ifd(unit: FlashROMShellCommandAdapter, output_path):
+    opts = make_flashrom_opts(
+        FlashROMActionEnum.READ,
+        ifd=True,
+        include=["bios"],
+    )
+    with patch_exec(unit) as _exec:
+        unit.run(opts)
+        _exec.assert_called_with([
+            "flashrom",
+            "-p", "dummy:emulate=M25P10.RES",
+            "-r", ANY,
+            "--ifd",
+            "--include", "bios",
+        ])
+
+
 def test_flashrom_command_for_verify(unit: FlashROMShellCommandAdapter, output_path):
     opts = make_flashrom_opts(
         FlashROMActionEnum.VERIFY,
@@ -164,3 +233,80 @@ def test_flashrom_response_with_file(unit: FlashROMShellCommandAdapter):
     opts = make_flashrom_opts(FlashROMActionEnum.READ)
     with patch_exec(unit):
         assert(unit.run(opts).path)
+
+
+def test_flashrom_output_is_forwarded_line_by_line(output_path):
+    lines = []
+    unit = FlashROMShellCommandAdapter(output_path, on_output=lines.append)
+    result = unit._execute_subprocess(["sh", "-c", "echo Hello; echo World"])
+    assert(lines == ["Hello", "World"])
+    assert(result.stdout == b"Hello\nWorld\n")
+
+
+def test_flashrom_output_keeps_stdout_and_stderr_separate(unit: FlashROMShellCommandAdapter):
+    result = unit._execute_subprocess(["sh", "-c", "echo Hello; echo World >&2; exit 3"])
+    assert(result.returncode == 3)
+    assert(result.stdout == b"Hello\n")
+    assert(result.stderr == b"World\n")
+
+
+def test_flashrom_response_with_report(unit: FlashROMShellCommandAdapter):
+    opts = make_flashrom_opts(FlashROMActionEnum.PROBE)
+    result = make_flashrom_result(
+        stdout=b'Found Winbond flash chip "W25Q64.V" (8192 kB, SPI) on ch341a_spi.\n'
+    )
+    with patch_exec(unit, result):
+        report = unit.run(opts).report
+    assert(report.programmer == "ch341a_spi")
+    assert([chip.name for chip in report.chips] == ["W25Q64.V"])
+    assert(report.elapsed is not None)
+
+
+def test_flashrom_lines_are_timed_from_their_first_part(unit: FlashROMShellCommandAdapter):
+    result = unit._execute_subprocess([
+        "sh", "-c", "printf 'Reading flash... '; sleep 0.2; echo done."
+    ])
+    [(started, finished, line)] = result.timeline
+    assert(line == b"Reading flash... done.\n")
+    assert(finished - started >= 0.15)
+    assert(result.spawn >= 0)
+
+
+def test_flashrom_response_with_timings(unit: FlashROMShellCommandAdapter):
+    opts = make_flashrom_opts(FlashROMActionEnum.READ)
+    with patch.object(unit, "_make_command", return_value=([
+        "sh", "-c",
+        "echo 'Found Winbond flash chip \"W25Q64.V\" (8192 kB, SPI) on ch341a_spi.'; "
+        "printf 'Reading flash... '; sleep 0.2; echo done."
+    ], None)):
+        timings = unit.run(opts).timings
+    assert(set(timings) == {"spawn", "probe", "read"})
+    assert(timings["read"] >= 0.15)
+
+
+def test_flashrom_output_keeps_only_the_tail(output_path):
+    lines = []
+    unit = FlashROMShellCommandAdapter(output_path, on_output=lines.append)
+    with patch("adapters.flashrom.shell_command_adapter.MAX_OUTPUT_LINES", 2):
+        result = unit._execute_subprocess([
+            "sh", "-c",
+            "echo 'Found Winbond flash chip \"W25Q64.V\" (8192 kB, SPI) on ch341a_spi.'; "
+            "echo one; echo two; echo three"
+        ])
+    assert(len(lines) == 4)
+    assert(result.stdout == b"[2 earlier lines omitted]\ntwo\nthree\n")
+    assert(len(result.timeline) == 2)
+    assert([chip.name for chip in result.parser.report().chips] == ["W25Q64.V"])
+
+
+def test_flashrom_child_is_reaped_by_hook(output_path):
+    class Measured(FlashROMShellCommandAdapter):
+        def _reap(self, process):
+            self.reaped = process.pid
+            return super()._reap(process)
+
+    unit = Measured(output_path)
+    result = unit._execute_subprocess(["sh", "-c", "echo Hello; exit 3"])
+    assert(unit.reaped > 0)
+    assert(result.returncode == 3)
+    assert(result.stdout == b"Hello\n")
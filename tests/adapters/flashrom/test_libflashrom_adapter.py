@@ -0,0 +1,245 @@
+import ctypes
+import ctypes.util
+import pytest
+
+from pyflex.models import FlashROMOpts, FlashROMActionEnum
+from pyflex.exceptions import PyFlexExecutionError
+from adapters.flashrom import FlashROMLibraryAdapter
+from adapters.flashrom import libflashrom_adapter
+
+
+needs_library = pytest.mark.skipif(
+    ctypes.util.find_library("flashrom") is None,
+    reason="libflashrom is not installed"
+)
+
+
+PROGRAMMER = "dummy:emulate=M25P10.RES"
+
+
+def make_flashrom_opts(action: FlashROMActionEnum, **kwargs):
+    kwargs.setdefault("force", False)
+    kwargs.setdefault("verbosity", 0)
+    kwargs.setdefault("programmer", PROGRAMMER)
+    return FlashROMOpts(action=action, **kwargs)
+
+
+@pytest.fixture()
+def output_path(tmp_path_factory):
+    return tmp_path_factory.mktemp("flashrom_library_adapter")
+
+
+@pytest.fixture()
+def unit(output_path):
+    return FlashROMLibraryAdapter(output_path)
+
+
+class StubLibrary:
+    # Stands in for libflashrom with a chip that can be swapped.
+
+    def __init__(self, size=64 * 1024):
+        self.chip = "W25Q64.V"
+        self.contents = bytearray(b"\xff" * size)
+        self.log = None
+        self.probes = 0
+        self.inits = 0
+        self.open = 0
+
+    def _print(self, text):
+        self.log(2, text.encode(), None)
+
+    def flashrom_init(self, perform_selfcheck):
+        return 0
+
+    def flashrom_set_log_callback(self, callback):
+        self.log = callback
+
+    def flashrom_programmer_init(self, handle, name, params):
+        handle._obj.value = 1
+        self.inits += 1
+        self.open += 1
+        return 0
+
+    def flashrom_programmer_shutdown(self, handle):
+        self.open -= 1
+        return 0
+
+    def flashrom_flash_probe(self, flashctx, handle, chip):
+        self.probes += 1
+        if chip is not None and chip.decode() != self.chip:
+            return 2
+        flashctx._obj.value = 2
+        self._print(f'Found Winbond flash chip "{self.chip}" ({len(self.contents) // 1024} kB, SPI) on dummy.\n')
+        return 0
+
+    def flashrom_flash_release(self, flashctx):
+        pass
+
+    def flashrom_flash_getsize(self, flashctx):
+        return len(self.contents)
+
+    def flashrom_flag_set(self, flashctx, flag, value):
+        pass
+
+    def flashrom_flash_erase(self, flashctx):
+        self._print("Erasing and writing flash chip... ")
+        self.contents[:] = b"\xff" * len(self.contents)
+        self._print("Erase/write done.\n")
+        return 0
+
+    def flashrom_image_read(self, flashctx, buffer, size):
+        self._print("Reading flash... ")
+        ctypes.memmove(buffer, bytes(self.contents), size)
+        self._print("done.\n")
+        return 0
+
+    def flashrom_image_write(self, flashctx, buffer, size, reference):
+        self.contents[:] = buffer.raw[:size]
+        return 0
+
+    def flashrom_image_verify(self, flashctx, buffer, size):
+        return 0 if buffer.raw[:size] == bytes(self.contents) else 3
+
+
+class StubLibc:
+
+    def vsnprintf(self, buffer, size, fmt, args):
+        buffer.value = fmt[:size - 1]
+
+
+@pytest.fixture()
+def library(monkeypatch):
+    library = StubLibrary()
+    monkeypatch.setattr(libflashrom_adapter, "_load_library", lambda path: library)
+    monkeypatch.setattr(libflashrom_adapter, "_load_libc", lambda: StubLibc())
+    return library
+
+
+@pytest.fixture()
+def stubbed(library, output_path):
+    return FlashROMLibraryAdapter(output_path)
+
+
+def test_probe_reports_chip_of_stub(stubbed):
+    result = stubbed.run(make_flashrom_opts(FlashROMActionEnum.PROBE))
+
+    assert result.path is None
+    assert [chip.name for chip in result.report.chips] == ["W25Q64.V"]
+
+
+def test_probe_notices_swapped_chip(stubbed, library):
+    stubbed.run(make_flashrom_opts(FlashROMActionEnum.PROBE))
+    library.chip = "MX25L6405"
+
+    result = stubbed.run(make_flashrom_opts(FlashROMActionEnum.PROBE))
+
+    assert library.probes == 2
+    assert [chip.name for chip in result.report.chips] == ["MX25L6405"]
+
+
+def test_programmer_is_shut_down_after_each_operation(stubbed, library):
+    stubbed.run(make_flashrom_opts(FlashROMActionEnum.PROBE))
+    assert library.open == 0
+
+    with pytest.raises(PyFlexExecutionError):
+        stubbed.run(make_flashrom_opts(FlashROMActionEnum.PROBE, chip="MX25L6405"))
+    assert library.open == 0
+
+
+def test_session_keeps_programmer_open(stubbed, library):
+    with stubbed.session(PROGRAMMER):
+        stubbed.run(make_flashrom_opts(FlashROMActionEnum.READ))
+        stubbed.run(make_flashrom_opts(FlashROMActionEnum.READ))
+        assert (library.inits, library.probes, library.open) == (1, 1, 1)
+
+    assert library.open == 0
+
+
+def test_probe_in_session_probes_again(stubbed, library):
+    with stubbed.session(PROGRAMMER):
+        stubbed.run(make_flashrom_opts(FlashROMActionEnum.PROBE))
+        library.chip = "MX25L6405"
+        result = stubbed.run(make_flashrom_opts(FlashROMActionEnum.PROBE))
+
+    assert (library.inits, library.probes) == (1, 2)
+    assert [chip.name for chip in result.report.chips] == ["MX25L6405"]
+
+
+def test_session_starts_over_after_failure(stubbed, library):
+    with stubbed.session(PROGRAMMER):
+        with pytest.raises(PyFlexExecutionError):
+            stubbed.run(make_flashrom_opts(FlashROMActionEnum.PROBE, chip="MX25L6405"))
+        assert library.open == 0
+        stubbed.run(make_flashrom_opts(FlashROMActionEnum.READ))
+        assert library.inits == 2
+
+    assert library.open == 0
+
+
+def test_write_then_read_round_trip_with_stub(stubbed, library, output_path, tmp_path):
+    image = tmp_path / "image.bin"
+    image.write_bytes(bytes(range(256)) * 256)
+
+    stubbed.run(make_flashrom_opts(FlashROMActionEnum.WRITE, input_path=str(image)))
+    stubbed.run(make_flashrom_opts(FlashROMActionEnum.VERIFY, input_path=str(image)))
+    result = stubbed.run(make_flashrom_opts(FlashROMActionEnum.READ))
+
+    assert (output_path / result.path).read_bytes() == image.read_bytes()
+    assert "Reading flash... done." in result.message
+
+
+def test_failed_verify_raises(stubbed, tmp_path):
+    image = tmp_path / "image.bin"
+    image.write_bytes(b"\x00" * 64 * 1024)
+
+    with pytest.raises(PyFlexExecutionError):
+        stubbed.run(make_flashrom_opts(FlashROMActionEnum.VERIFY, input_path=str(image)))
+
+
+@pytest.mark.parametrize("option", [
+    {"layout": "layout.txt"},
+    {"include": ["bios"]},
+    {"ifd": True},
+    {"fmap": True},
+    {"verify_included_only": True},
+])
+def test_unsupported_options_raise(stubbed, library, option):
+    with pytest.raises(PyFlexExecutionError, match="does not support"):
+        stubbed.run(make_flashrom_opts(FlashROMActionEnum.ERASE, **option))
+    assert library.probes == 0
+
+
+@needs_library
+def test_library_adapter_missing_library_raises(output_path):
+    with pytest.raises(OSError):
+        FlashROMLibraryAdapter(output_path, library="/nonexistent/libflashrom.so")
+
+
+@needs_library
+def test_library_adapter_probe_reports_chip(unit):
+    result = unit.run(make_flashrom_opts(FlashROMActionEnum.PROBE))
+
+    assert result.path is None
+    assert [chip.name for chip in result.report.chips] == ["M25P10.RES"]
+
+
+@needs_library
+def test_library_adapter_write_then_read_round_trip(unit, output_path, tmp_path):
+    image = tmp_path / "image.bin"
+    image.write_bytes(bytes(range(256)) * 512)
+
+    unit.run(make_flashrom_opts(FlashROMActionEnum.WRITE, input_path=str(image)))
+    unit.run(make_flashrom_opts(FlashROMActionEnum.VERIFY, input_path=str(image)))
+    result = unit.run(make_flashrom_opts(FlashROMActionEnum.READ))
+
+    assert (output_path / result.path).read_bytes() == image.read_bytes()
+
+
+@needs_library
+def test_library_adapter_wrong_image_size_raises(unit, tmp_path):
+    image = tmp_path / "image.bin"
+    image.write_bytes(b"\x00" * 16)
+
+    with pytest.raises(PyFlexExecutionError):
+        unit.run(make_flashrom_opts(FlashROMActionEnum.WRITE, input_path=str(image)))
+
@@ -0,0 +1,83 @@
+import pytest
+from unittest.mock import patch
+
+from pyflex.chip_cache import ChipContentsCache, ChipProbeCache
+from pyflex.models import FlashROMChip
+
+
+@pytest.fixture()
+def image(tmp_path_factory):
+    path = tmp_path_factory.mktemp("chip_cache") / "image.bin"
+    path.write_bytes(b"\xff" * 16)
+    return path
+
+
+@pytest.fixture()
+def unit(tmp_path):
+    return ChipContentsCache(tmp_path / "locks", ttl=60)
+
+
+def test_recorded_contents_are_returned(unit, image):
+    unit.record("dummy", "W25Q64.V", image)
+    assert unit.get("dummy", "W25Q64.V") == image
+
+
+def test_contents_are_per_programmer(unit, image):
+    unit.record("dummy", "W25Q64.V", image)
+    assert unit.get("ch341a_spi", "W25Q64.V") is None
+
+
+def test_contents_are_per_chip(unit, image):
+    unit.record("dummy", "W25Q64.V", image)
+    assert unit.get("dummy", "W25Q128.V") is None
+    assert unit.get("dummy", "W25Q64.V") is None
+
+
+def test_contents_of_unknown_chip_are_not_recorded(unit, image):
+    unit.record("dummy", "W25Q64.V", image)
+    unit.record("dummy", None, image)
+    assert unit.get("dummy", "W25Q64.V") is None
+    assert unit.get("dummy", None) is None
+
+
+def test_contents_are_shared_between_caches(unit, image, tmp_path):
+    unit.record("dummy", "W25Q64.V", image)
+    other = ChipContentsCache(tmp_path / "locks", ttl=60)
+    assert other.get("dummy", "W25Q64.V") == image
+    other.invalidate("dummy")
+    assert unit.get("dummy", "W25Q64.V") is None
+
+
+def test_contents_expire(unit, image):
+    with patch("pyflex.chip_cache.time.time", return_value=0):
+        unit.record("dummy", "W25Q64.V", image)
+    with patch("pyflex.chip_cache.time.time", return_value=61):
+        assert unit.get("dummy", "W25Q64.V") is None
+
+
+def test_contents_are_forgotten_when_image_is_deleted(unit, image):
+    unit.record("dummy", "W25Q64.V", image)
+    image.unlink()
+    assert unit.get("dummy", "W25Q64.V") is None
+
+
+def test_contents_can_be_invalidated(unit, image):
+    unit.record("dummy", "W25Q64.V", image)
+    unit.invalidate("dummy")
+    assert unit.get("dummy", "W25Q64.V") is None
+
+
+def test_recorded_chip_is_returned():
+    unit = ChipProbeCache(ttl=60)
+    chip = FlashROMChip("Winbond", "W25Q64.V", 8192 * 1024, "SPI")
+    unit.record("ch341a_spi", chip)
+    assert unit.get("ch341a_spi") == chip
+
+
+def test_recorded_chip_expires():
+    unit = ChipProbeCache(ttl=60)
+    chip = FlashROMChip("Winbond", "W25Q64.V", 8192 * 1024, "SPI")
+    with patch("pyflex.chip_cache.time.monotonic", return_value=0):
+        unit.record("ch341a_spi", chip)
+    with patch("pyflex.chip_cache.time.monotonic", return_value=61):
+        assert unit.get("ch341a_spi") is None
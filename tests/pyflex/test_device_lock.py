@@ -0,0 +1,124 @@
+import asyncio
+import threading
+import pytest
+import time
+from threading import Event, Thread
+
+from pyflex.device_lock import DeviceManager
+
+
+@pytest.fixture()
+def unit(tmp_path_factory):
+    return DeviceManager(tmp_path_factory.mktemp("device_lock"))
+
+
+def hold(unit, programmer, events, name, release=None):
+    def run():
+        with unit.lock(programmer):
+            events.append(name)
+            if release is not None:
+                release.wait()
+    thread = Thread(target=run)
+    thread.start()
+    return thread
+
+
+def wait_for(predicate):
+    for _ in range(500):
+        if predicate():
+            return
+        time.sleep(0.01)
+    raise AssertionError("Timed out")
+
+
+def test_same_programmer_is_serialized_in_order(unit):
+    events = []
+    release = Event()
+    first = hold(unit, "dummy", events, "first", release)
+    wait_for(lambda: events == ["first"])
+    second = hold(unit, "dummy", events, "second")
+    wait_for(lambda: unit.queue_depth("dummy") == 2)
+    third = hold(unit, "dummy", events, "third")
+    wait_for(lambda: unit.queue_depth("dummy") == 3)
+    assert events == ["first"]
+    release.set()
+    for thread in (first, second, third):
+        thread.join()
+    assert events == ["first", "second", "third"]
+    assert unit.queue_depth("dummy") == 0
+
+
+def test_different_programmers_run_in_parallel(unit):
+    events = []
+    release = Event()
+    first = hold(unit, "dummy:bus=1", events, "first", release)
+    second = hold(unit, "dummy:bus=2", events, "second", release)
+    wait_for(lambda: sorted(events) == ["first", "second"])
+    assert unit.queue_depths() == {"dummy:bus=1": 1, "dummy:bus=2": 1}
+    release.set()
+    first.join()
+    second.join()
+
+
+def test_lock_is_shared_between_managers(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("device_lock_shared")
+    events = []
+    release = Event()
+    first = hold(DeviceManager(directory), "dummy", events, "first", release)
+    wait_for(lambda: events == ["first"])
+    second = hold(DeviceManager(directory), "dummy", events, "second")
+    time.sleep(0.05)
+    assert events == ["first"]
+    release.set()
+    first.join()
+    second.join()
+    assert events == ["first", "second"]
+
+
+def test_acquire_async_gives_back_programmer_when_cancelled(unit):
+    events = []
+    release = Event()
+    first = hold(unit, "dummy", events, "first", release)
+    wait_for(lambda: events == ["first"])
+
+    async def cancel():
+        waiter = asyncio.create_task(unit.acquire_async("dummy"))
+        while unit.queue_depth("dummy") < 2:
+            await asyncio.sleep(0.01)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        release.set()
+        while unit.queue_depth("dummy"):
+            await asyncio.sleep(0.01)
+
+    asyncio.run(asyncio.wait_for(cancel(), timeout=5))
+    first.join()
+    assert unit.queue_depths() == {}
+
+
+def test_acquire_async_waits_in_order_without_threads(unit):
+    events = []
+    release = Event()
+    first = hold(unit, "dummy", events, "first", release)
+    wait_for(lambda: events == ["first"])
+
+    async def queue():
+        async def acquire(name):
+            await unit.acquire_async("dummy")
+            events.append(name)
+            await asyncio.sleep(0.01)
+            unit.release("dummy")
+
+        waiters = [asyncio.create_task(acquire(name)) for name in ("second", "third")]
+        while unit.queue_depth("dummy") < 3:
+            await asyncio.sleep(0.01)
+        assert threading.active_count() == threads
+        release.set()
+        await asyncio.gather(*waiters)
+
+    threads = threading.active_count()
+    asyncio.run(asyncio.wait_for(queue(), timeout=5))
+    first.join()
+    assert events == ["first", "second", "third"]
+    assert unit.queue_depths() == {}
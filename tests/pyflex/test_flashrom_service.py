@@ -1,10 +1,20 @@
+import asyncio
+from contextlib import contextmanager
+from hashlib import sha256
 import pytest
+from io import BytesIO
 from pathlib import Path
-from unittest.mock import Mock, ANY
+from unittest.mock import AsyncMock, Mock, ANY
 
 from pyflex import FlashROMService
-from pyflex.models import FlashROMActionEnum, FlashROMExecResult, FlashROMOpts
-from pyflex.typing import FlashROMAdapter
+from pyflex.chip_cache import ChipContentsCache, ChipProbeCache
+from pyflex.device_lock import DeviceManager
+from pyflex.image_store import ImageStore
+from pyflex.metrics import MetricsRegistry, OperationMetrics
+from pyflex.overview import DumpOverviews
+from pyflex.models import FlashROMActionEnum, FlashROMChip, FlashROMExecResult, FlashROMOpts, FlashROMReport
+from pyflex.output_parser import parse_chips
+from pyflex.typing import AsyncFlashROMAdapter, FlashROMAdapter, SessionFlashROMAdapter
 from pyflex.exceptions import PyFlexExecutionError, PyFlexInvalidParameter
 
 
@@ -176,3 +186,786 @@ def test_pyflex_raises_parameter_error_if_not_handed_a_file_with_a_verify_action
     unit.set_programmer("dummy:emulate=M25P10.RES")
     with pytest.raises(PyFlexInvalidParameter) as err:
         unit.execute()
+
+
+def test_can_execute_async_with_blocking_adapter(unit, adapter):
+    expected = make_flashrom_opts(FlashROMActionEnum.PROBE)
+    unit.set_action("probe")
+    unit.set_programmer("dummy:emulate=M25P10.RES")
+    asyncio.run(unit.execute_async())
+    adapter.run.assert_called_with(expected)
+
+
+def test_can_execute_async_with_async_adapter(input_directory):
+    expected = make_flashrom_opts(FlashROMActionEnum.PROBE)
+    adapter = Mock(spec=AsyncFlashROMAdapter)
+    adapter.run_async = AsyncMock(return_value=FlashROMExecResult("Okay", None))
+    unit = FlashROMService(adapter, input_directory)
+    unit.set_action("probe")
+    unit.set_programmer("dummy:emulate=M25P10.RES")
+    assert asyncio.run(unit.execute_async()) == FlashROMExecResult("Okay", None)
+    adapter.run_async.assert_called_with(expected)
+
+
+def test_pyflex_execution_errors_are_forwarded_async(unit, adapter):
+    expected = PyFlexExecutionError("Hello from unittest")
+    adapter.run = Mock(side_effect=expected)
+    unit.set_action("read")
+    unit.set_programmer("dummy:emulate=M25P10.RES")
+    with pytest.raises(PyFlexExecutionError) as err:
+        asyncio.run(unit.execute_async())
+    assert err.value == expected
+
+
+def test_file_is_copied_from_stream_in_chunks(unit, input_directory, monkeypatch):
+    monkeypatch.setattr("pyflex.image_store.CHUNK_SIZE", 4)
+    expected = b"0100100001101001"
+    unit.set_action("write")
+    unit.set_programmer("dummy:emulate=M25P10.RES")
+    unit.set_file(BytesIO(expected))
+    unit.execute()
+    in_file = next(input_directory.rglob("*.bin"))
+    assert in_file.read_bytes() == expected
+
+
+def test_pyflex_raises_parameter_error_if_file_is_too_large(adapter, input_directory):
+    unit = FlashROMService(adapter, input_directory, max_file_size=8)
+    with pytest.raises(PyFlexInvalidParameter):
+        unit.set_file(BytesIO(b"0100100001101001"))
+    assert list(input_directory.iterdir()) == []
+
+
+def test_pyflex_raises_parameter_error_if_file_is_empty(unit, input_directory):
+    with pytest.raises(PyFlexInvalidParameter):
+        unit.set_file(BytesIO(b""))
+    assert list(input_directory.iterdir()) == []
+
+
+def test_input_file_is_referenced_while_executing(unit, adapter, input_directory):
+    images = ImageStore(input_directory)
+    data = b"0100100001101001"
+    digest = images.put(data)
+    adapter.run = Mock(side_effect=lambda opts: FlashROMExecResult(str(images.references(digest))))
+    unit.set_action("write")
+    unit.set_programmer("dummy:emulate=M25P10.RES")
+    unit.set_file(data)
+    assert unit.execute().message == "1"
+    assert images.references(digest) == 0
+
+
+def test_input_file_is_referenced_until_service_is_discarded(adapter, input_directory):
+    images = ImageStore(input_directory)
+    unit = FlashROMService(adapter, input_directory)
+    unit.set_file(b"0100100001101001")
+    digest = images.put(b"0100100001101001")
+    assert images.references(digest) == 1
+    del unit
+    assert images.references(digest) == 0
+
+
+def test_can_write_a_known_image(unit, adapter, input_directory):
+    digest = ImageStore(input_directory).put(b"0100100001101001")
+    expected = make_flashrom_opts(
+        FlashROMActionEnum.WRITE,
+        input_path=ImageStore(input_directory).path(digest)
+    )
+    unit.set_action("write")
+    unit.set_programmer("dummy:emulate=M25P10.RES")
+    unit.set_image(digest)
+    unit.execute()
+    adapter.run.assert_called_with(expected)
+
+
+def test_pyflex_raises_parameter_error_for_unknown_image(unit):
+    with pytest.raises(PyFlexInvalidParameter):
+        unit.set_image("0" * 64)
+
+
+PROGRAMMER = "dummy:emulate=M25P10.RES"
+
+
+CHIP = FlashROMChip("Winbond", "W25Q64.V", 8192 * 1024, "SPI")
+
+
+@pytest.fixture()
+def contents_cache(tmp_path_factory):
+    return ChipContentsCache(tmp_path_factory.mktemp("locks"))
+
+
+def cached_service(adapter, input_directory, contents_cache, **kwargs):
+    # The contents are only used for a chip that is named.
+    probes = ChipProbeCache()
+    probes.record(PROGRAMMER, CHIP)
+    return FlashROMService(
+        adapter,
+        input_directory,
+        output_directory=input_directory,
+        contents_cache=contents_cache,
+        probe_cache=probes,
+        **kwargs,
+    )
+
+
+@pytest.fixture()
+def cached_unit(adapter, input_directory, contents_cache):
+    return cached_service(adapter, input_directory, contents_cache)
+
+
+def write(unit, data=b"0100100001101001"):
+    unit.set_action("write")
+    unit.set_programmer("dummy:emulate=M25P10.RES")
+    unit.set_file(data)
+    return unit.execute()
+
+
+def test_write_uses_contents_of_previous_write(cached_unit, adapter, input_directory, contents_cache):
+    write(cached_unit)
+    first = adapter.run.call_args.args[0]
+    assert first.flash_contents is None
+    write(cached_service(adapter, input_directory, contents_cache), b"1")
+    assert adapter.run.call_args.args[0].flash_contents == first.input_path
+
+
+def test_write_uses_contents_of_previous_read(cached_unit, adapter, input_directory, contents_cache):
+    (input_directory / "dump.bin").write_bytes(b"0100100001101001")
+    adapter.run = Mock(return_value=FlashROMExecResult("Okay", "dump.bin"))
+    cached_unit.set_action("read")
+    cached_unit.set_programmer("dummy:emulate=M25P10.RES")
+    cached_unit.execute()
+    write(cached_service(adapter, input_directory, contents_cache))
+    assert adapter.run.call_args.args[0].flash_contents == input_directory / "dump.bin"
+
+
+def test_write_ignores_contents_of_another_chip(cached_unit, adapter, input_directory, contents_cache):
+    write(cached_unit)
+    probes = ChipProbeCache()
+    probes.record(PROGRAMMER, FlashROMChip("Winbond", "W25Q128.V", 16384 * 1024, "SPI"))
+    write(FlashROMService(adapter, input_directory, contents_cache=contents_cache, probe_cache=probes))
+    assert adapter.run.call_args.args[0].flash_contents is None
+
+
+def test_write_ignores_contents_when_chip_is_not_named(cached_unit, adapter, input_directory, contents_cache):
+    adapter.run.return_value = FlashROMExecResult("Okay", None)
+    write(cached_unit)
+    write(FlashROMService(adapter, input_directory, contents_cache=contents_cache))
+    assert adapter.run.call_args.args[0].flash_contents is None
+
+
+def test_write_reads_chip_when_reuse_is_disabled(cached_unit, adapter, input_directory, contents_cache):
+    write(cached_unit)
+    unit = cached_service(adapter, input_directory, contents_cache)
+    unit.unset_reuse_contents()
+    write(unit)
+    assert adapter.run.call_args.args[0].flash_contents is None
+
+
+def test_contents_are_forgotten_after_erase(cached_unit, adapter, input_directory, contents_cache):
+    write(cached_unit)
+    unit = cached_service(adapter, input_directory, contents_cache)
+    unit.set_action("erase")
+    unit.set_programmer("dummy:emulate=M25P10.RES")
+    unit.execute()
+    assert contents_cache.get(PROGRAMMER, CHIP.name) is None
+
+
+def test_contents_are_forgotten_after_failure(cached_unit, adapter, input_directory, contents_cache):
+    write(cached_unit)
+    adapter.run = Mock(side_effect=PyFlexExecutionError("Hello from unittest"))
+    with pytest.raises(PyFlexExecutionError):
+        write(cached_service(adapter, input_directory, contents_cache))
+    assert contents_cache.get(PROGRAMMER, CHIP.name) is None
+
+
+
+def test_contents_are_forgotten_after_unexpected_failure(cached_unit, adapter, input_directory, contents_cache):
+    write(cached_unit)
+    adapter.run = Mock(side_effect=RuntimeError("Hello from unittest"))
+    with pytest.raises(PyFlexExecutionError):
+        write(cached_service(adapter, input_directory, contents_cache))
+    assert contents_cache.get(PROGRAMMER, CHIP.name) is None
+
+
+@pytest.mark.parametrize("fails", [False, True])
+def test_contents_are_updated_while_device_is_held(adapter, input_directory, contents_cache, tmp_path_factory, fails):
+    devices = DeviceManager(tmp_path_factory.mktemp("flashrom_service_locks"))
+    depths = []
+    contents_cache.record = Mock(side_effect=lambda *args: depths.append(devices.queue_depth(PROGRAMMER)))
+    contents_cache.invalidate = Mock(side_effect=lambda *args: depths.append(devices.queue_depth(PROGRAMMER)))
+    if fails:
+        adapter.run = Mock(side_effect=PyFlexExecutionError("Hello from unittest"))
+    unit = cached_service(adapter, input_directory, contents_cache, device_manager=devices)
+    try:
+        write(unit)
+    except PyFlexExecutionError:
+        pass
+    assert depths == [1]
+
+
+PROBE_MESSAGE = 'Found Winbond flash chip "W25Q64.V" (8192 kB, SPI) on dummy.'
+
+
+@pytest.fixture()
+def probe_cache():
+    return ChipProbeCache()
+
+
+def probe_result(message):
+    return FlashROMExecResult(message, report=FlashROMReport(chips=parse_chips(message)))
+
+
+def probe(adapter, input_directory, probe_cache, message=PROBE_MESSAGE):
+    adapter.run = Mock(return_value=probe_result(message))
+    unit = FlashROMService(adapter, input_directory, probe_cache=probe_cache)
+    unit.set_action("probe")
+    unit.set_programmer("dummy:emulate=M25P10.RES")
+    unit.execute()
+    return FlashROMService(adapter, input_directory, probe_cache=probe_cache)
+
+
+def test_chip_found_by_probe_is_named(adapter, input_directory, probe_cache):
+    expected = make_flashrom_opts(FlashROMActionEnum.ERASE, chip="W25Q64.V")
+    unit = probe(adapter, input_directory, probe_cache)
+    unit.set_action("erase")
+    unit.set_programmer("dummy:emulate=M25P10.RES")
+    unit.execute()
+    adapter.run.assert_called_with(expected)
+
+
+def test_chip_is_not_named_with_autodetect(adapter, input_directory, probe_cache):
+    expected = make_flashrom_opts(FlashROMActionEnum.ERASE)
+    unit = probe(adapter, input_directory, probe_cache)
+    unit.set_action("erase")
+    unit.set_programmer("dummy:emulate=M25P10.RES")
+    unit.set_autodetect()
+    unit.execute()
+    adapter.run.assert_called_with(expected)
+
+
+def test_ambiguous_probe_is_not_remembered(adapter, input_directory, probe_cache):
+    probe(adapter, input_directory, probe_cache, PROBE_MESSAGE + "\n" + PROBE_MESSAGE)
+    assert probe_cache.get("dummy:emulate=M25P10.RES") is None
+
+
+def test_chip_is_remembered_from_report_not_message(adapter, input_directory, probe_cache):
+    # Only the tail of a long output is kept in the message.
+    result = probe_result(PROBE_MESSAGE)
+    result.message = "[5000 earlier lines omitted]\nNo operations were specified."
+    adapter.run = Mock(return_value=result)
+    unit = FlashROMService(adapter, input_directory, probe_cache=probe_cache)
+    unit.set_action("probe")
+    unit.set_programmer("dummy:emulate=M25P10.RES")
+    unit.execute()
+    assert probe_cache.get("dummy:emulate=M25P10.RES").name == "W25Q64.V"
+
+
+def test_chip_is_forgotten_after_failure(adapter, input_directory, probe_cache):
+    unit = probe(adapter, input_directory, probe_cache)
+    adapter.run = Mock(side_effect=PyFlexExecutionError("Hello from unittest"))
+    unit.set_action("erase")
+    unit.set_programmer("dummy:emulate=M25P10.RES")
+    with pytest.raises(PyFlexExecutionError):
+        unit.execute()
+    assert probe_cache.get("dummy:emulate=M25P10.RES") is None
+
+
+def test_device_is_held_while_executing(adapter, input_directory, tmp_path_factory):
+    devices = DeviceManager(tmp_path_factory.mktemp("flashrom_service_locks"))
+    adapter.run = Mock(side_effect=lambda opts: FlashROMExecResult(
+        str(devices.queue_depth(opts.programmer))
+    ))
+    unit = FlashROMService(adapter, input_directory, device_manager=devices)
+    unit.set_action("probe")
+    unit.set_programmer("dummy:emulate=M25P10.RES")
+    assert unit.execute().message == "1"
+    assert devices.queue_depth("dummy:emulate=M25P10.RES") == 0
+
+
+def test_device_is_held_while_executing_async(input_directory, tmp_path_factory):
+    devices = DeviceManager(tmp_path_factory.mktemp("flashrom_service_locks"))
+    adapter = Mock(spec=AsyncFlashROMAdapter)
+    adapter.run_async = AsyncMock(side_effect=lambda opts: FlashROMExecResult(
+        str(devices.queue_depth(opts.programmer))
+    ))
+    unit = FlashROMService(adapter, input_directory, device_manager=devices)
+    unit.set_action("probe")
+    unit.set_programmer("dummy:emulate=M25P10.RES")
+    assert asyncio.run(unit.execute_async()).message == "1"
+    assert devices.queue_depth("dummy:emulate=M25P10.RES") == 0
+
+
+class SessionAdapter(FlashROMAdapter, SessionFlashROMAdapter):
+    pass
+
+
+def test_adapter_session_spans_pipeline_while_device_is_held(input_directory, tmp_path_factory):
+    devices = DeviceManager(tmp_path_factory.mktemp("flashrom_service_locks"))
+    events = []
+
+    @contextmanager
+    def session(programmer):
+        events.append(("open", devices.queue_depth(programmer)))
+        yield
+        events.append(("close", devices.queue_depth(programmer)))
+
+    adapter = Mock(spec=SessionAdapter)
+    adapter.session = Mock(side_effect=session)
+    adapter.run = Mock(side_effect=lambda opts: events.append(opts.action) or FlashROMExecResult("Okay"))
+    unit = FlashROMService(adapter, input_directory, device_manager=devices)
+    unit.set_pipeline(["probe", "erase"])
+    unit.set_programmer("dummy:emulate=M25P10.RES")
+    unit.execute()
+
+    assert events == [("open", 1), FlashROMActionEnum.PROBE, FlashROMActionEnum.ERASE, ("close", 1)]
+
+
+def test_device_is_given_back_when_cancelled_while_queued_async(input_directory, tmp_path_factory):
+    devices = DeviceManager(tmp_path_factory.mktemp("flashrom_service_locks"))
+    adapter = Mock(spec=AsyncFlashROMAdapter)
+    unit = FlashROMService(adapter, input_directory, device_manager=devices)
+    unit.set_action("probe")
+    unit.set_programmer("dummy:emulate=M25P10.RES")
+
+    async def cancel():
+        devices.acquire("dummy:emulate=M25P10.RES")
+        task = asyncio.create_task(unit.execute_async())
+        while devices.queue_depth("dummy:emulate=M25P10.RES") < 2:
+            await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        devices.release("dummy:emulate=M25P10.RES")
+        while devices.queue_depth("dummy:emulate=M25P10.RES"):
+            await asyncio.sleep(0.01)
+
+    asyncio.run(asyncio.wait_for(cancel(), timeout=5))
+    adapter.run_async.assert_not_called()
+
+
+def test_operations_are_measured(adapter, input_directory):
+    metrics = OperationMetrics(MetricsRegistry())
+    unit = FlashROMService(adapter, input_directory, metrics=metrics)
+    unit.set_action("probe")
+    unit.set_programmer("dummy:emulate=M25P10.RES")
+    unit.execute()
+
+    adapter.run = Mock(side_effect=PyFlexExecutionError("Hello from unittest"))
+    with pytest.raises(PyFlexExecutionError):
+        unit.execute()
+
+    assert metrics.operations.value(action="probe", outcome="success") == 1
+    assert metrics.operations.value(action="probe", outcome="failure") == 1
+    assert 'pyflex_flashrom_duration_seconds_count{action="probe"} 2' in metrics.duration.render()
+
+
+def test_invalid_operations_are_counted_but_not_timed(adapter, input_directory):
+    metrics = OperationMetrics(MetricsRegistry())
+    unit = FlashROMService(adapter, input_directory, metrics=metrics)
+    unit.set_action("write")
+    unit.set_programmer("dummy:emulate=M25P10.RES")
+    with pytest.raises(PyFlexInvalidParameter):
+        unit.execute()
+
+    assert metrics.operations.value(action="write", outcome="failure") == 1
+    assert metrics.duration.render()[2:] == []
+
+
+def test_result_carries_service_timings(input_directory, tmp_path_factory):
+    adapter = Mock(spec=FlashROMAdapter)
+    adapter.run = Mock(return_value=FlashROMExecResult("Okay", timings={"spawn": 0.1}))
+    devices = DeviceManager(tmp_path_factory.mktemp("flashrom_service_locks"))
+    unit = FlashROMService(adapter, input_directory, device_manager=devices)
+    unit.set_action("write")
+    unit.set_programmer("dummy:emulate=M25P10.RES")
+    unit.set_file(b"Hello, World!")
+    timings = unit.execute().timings
+    assert set(timings) == {"upload", "queue", "adapter", "spawn"}
+    assert timings["spawn"] == 0.1
+
+
+def capture_layout(adapter):
+    layouts = []
+
+    def run(opts):
+        layouts.append(Path(opts.layout).read_text() if opts.layout else None)
+        return FlashROMExecResult("Okay")
+
+    adapter.run = Mock(side_effect=run)
+    return layouts
+
+
+def test_write_only_includes_changed_blocks(cached_unit, adapter, input_directory, contents_cache):
+    image = bytearray(64 * 1024)
+    write(cached_unit, bytes(image))
+    layouts = capture_layout(adapter)
+
+    image[5000] = 1
+    write(cached_service(adapter, input_directory, contents_cache), bytes(image))
+
+    assert adapter.run.call_args.args[0].include == ["changed0"]
+    # The cached contents may be stale, only a verify of the whole chip notices.
+    assert not adapter.run.call_args.args[0].verify_included_only
+    assert layouts == ["00001000:00001fff changed0\n"]
+    assert not Path(adapter.run.call_args.args[0].layout).exists()
+
+
+def test_write_only_verifies_changed_blocks_read_while_held(adapter, input_directory):
+    image = bytearray(64 * 1024)
+    (input_directory / "dump.bin").write_bytes(bytes(image))
+    layouts = []
+
+    def run(opts):
+        if opts.action == FlashROMActionEnum.READ:
+            return FlashROMExecResult("Okay", "dump.bin")
+        layouts.append(Path(opts.layout).read_text())
+        return FlashROMExecResult("Okay")
+
+    adapter.run = Mock(side_effect=run)
+    image[5000] = 1
+    unit = FlashROMService(adapter, input_directory, output_directory=input_directory)
+    unit.set_pipeline(["read", "write"])
+    unit.set_programmer("dummy:emulate=M25P10.RES")
+    unit.set_file(bytes(image))
+    unit.execute()
+
+    opts = adapter.run.call_args.args[0]
+    assert opts.flash_contents == input_directory / "dump.bin"
+    assert opts.include == ["changed0"]
+    assert opts.verify_included_only
+    assert layouts == ["00001000:00001fff changed0\n"]
+
+
+def test_write_includes_everything_when_most_blocks_changed(cached_unit, adapter, input_directory, contents_cache):
+    write(cached_unit, bytes(64 * 1024))
+    layouts = capture_layout(adapter)
+    write(cached_service(adapter, input_directory, contents_cache), b"\xff" * 64 * 1024)
+    assert layouts == [None]
+    assert adapter.run.call_args.args[0].include == []
+
+
+def test_write_includes_everything_when_partial_write_is_disabled(cached_unit, adapter, input_directory, contents_cache):
+    image = bytearray(64 * 1024)
+    write(cached_unit, bytes(image))
+    capture_layout(adapter)
+    image[5000] = 1
+    unit = cached_service(adapter, input_directory, contents_cache)
+    unit.unset_partial_write()
+    write(unit, bytes(image))
+    assert adapter.run.call_args.args[0].layout is None
+
+
+LAYOUT = "00000000:00000fff fd\n00001000:0000ffff bios\n"
+
+
+def test_read_includes_regions_of_layout(unit, adapter):
+    layouts = capture_layout(adapter)
+    unit.set_action("read")
+    unit.set_programmer("dummy:emulate=M25P10.RES")
+    unit.set_layout(LAYOUT.encode())
+    unit.set_include(["bios"])
+    unit.execute()
+    opts = adapter.run.call_args.args[0]
+    assert opts.include == ["bios"]
+    assert not opts.verify_included_only
+    assert layouts == [LAYOUT]
+    assert not Path(opts.layout).exists()
+
+
+@pytest.mark.parametrize("source", ["set_ifd", "set_fmap"])
+def test_write_includes_regions_of_chip(unit, adapter, source):
+    getattr(unit, source)()
+    unit.set_include(["bios"])
+    write(unit)
+    opts = adapter.run.call_args.args[0]
+    assert (opts.ifd, opts.fmap) == (source == "set_ifd", source == "set_fmap")
+    assert opts.layout is None
+    assert opts.include == ["bios"]
+    assert opts.verify_included_only
+
+
+@pytest.mark.parametrize("configure", [
+    lambda unit: unit.set_include(["bios"]),
+    lambda unit: unit.set_ifd(),
+    lambda unit: (unit.set_ifd(), unit.set_fmap(), unit.set_include(["bios"])),
+    lambda unit: (unit.set_layout(LAYOUT), unit.set_include(["me"])),
+])
+def test_pyflex_raises_parameter_error_for_inconsistent_regions(unit, adapter, configure):
+    unit.set_action("read")
+    unit.set_programmer("dummy:emulate=M25P10.RES")
+    configure(unit)
+    with pytest.raises(PyFlexInvalidParameter):
+        unit.validate()
+    adapter.run.assert_not_called()
+
+
+@pytest.mark.parametrize("action", ["probe", "erase"])
+def test_pyflex_raises_parameter_error_if_handed_regions_with_action(unit, action):
+    unit.set_action(action)
+    unit.set_programmer("dummy:emulate=M25P10.RES")
+    unit.set_ifd()
+    unit.set_include(["bios"])
+    with pytest.raises(PyFlexInvalidParameter):
+        unit.validate()
+
+
+def test_pyflex_raises_parameter_error_for_invalid_include(unit):
+    with pytest.raises(PyFlexInvalidParameter):
+        unit.set_include(["--help"])
+
+
+def test_region_write_forgets_contents(cached_unit, adapter, input_directory, contents_cache):
+    write(cached_unit)
+    unit = cached_service(adapter, input_directory, contents_cache)
+    unit.set_ifd()
+    unit.set_include(["bios"])
+    write(unit, b"1")
+    assert contents_cache.get(PROGRAMMER, CHIP.name) is None
+
+
+def test_read_creates_overview(adapter, input_directory):
+    (input_directory / "dump.bin").write_bytes(bytes(8192))
+    adapter.run = Mock(return_value=FlashROMExecResult("Okay", "dump.bin"))
+    overviews = DumpOverviews()
+    unit = FlashROMService(adapter, input_directory, output_directory=input_directory, overviews=overviews)
+    unit.set_action("read")
+    unit.set_programmer("dummy:emulate=M25P10.RES")
+    result = unit.execute()
+    assert overviews.path(input_directory / "dump.bin").exists()
+    assert "overview" in result.timings
+
+
+def read_dump(unit, adapter, input_directory, data, action="read"):
+    (input_directory / "dump.bin").write_bytes(data)
+    adapter.run = Mock(return_value=FlashROMExecResult("Okay", "dump.bin"))
+    unit.set_action(action)
+    unit.set_programmer("dummy:emulate=M25P10.RES")
+    return unit.execute()
+
+
+def erase(unit, adapter):
+    adapter.run = Mock(return_value=FlashROMExecResult("Okay"))
+    unit.set_action("erase")
+    unit.set_programmer("dummy:emulate=M25P10.RES")
+    return unit.execute()
+
+
+def test_blank_check_reads_chip(cached_unit, adapter, input_directory):
+    result = read_dump(cached_unit, adapter, input_directory, b"\xff" * 4096 + bytes(4096), "blank-check")
+    assert adapter.run.call_args.args[0].action == FlashROMActionEnum.READ
+    assert result.blank_check.dirty == [(4096, 8192)]
+    assert result.message == "Okay\n1 of 2 blocks are not erased."
+
+
+def test_blank_check_requires_output_directory(unit):
+    unit.set_action("blank-check")
+    unit.set_programmer("dummy:emulate=M25P10.RES")
+    with pytest.raises(PyFlexInvalidParameter):
+        unit.validate()
+
+
+def erase_after_blank_check(unit, adapter, input_directory, data):
+    (input_directory / "dump.bin").write_bytes(data)
+    adapter.run = Mock(side_effect=lambda opts: FlashROMExecResult(
+        "Okay", "dump.bin" if opts.action == FlashROMActionEnum.READ else None
+    ))
+    unit.set_pipeline(["blank-check", "erase"])
+    unit.set_programmer("dummy:emulate=M25P10.RES")
+    return unit.execute()
+
+
+def test_erase_is_skipped_when_chip_is_blank(cached_unit, adapter, input_directory, contents_cache):
+    result = erase_after_blank_check(cached_unit, adapter, input_directory, b"\xff" * 8192)
+    adapter.run.assert_called_once()
+    assert result.message.endswith("Chip is already erased.")
+    assert contents_cache.get(PROGRAMMER, CHIP.name) is not None
+
+
+def test_erase_only_includes_dirty_blocks(cached_unit, adapter, input_directory, contents_cache):
+    layouts = []
+
+    def run(opts):
+        if opts.action == FlashROMActionEnum.READ:
+            return FlashROMExecResult("Okay", "dump.bin")
+        layouts.append(Path(opts.layout).read_text())
+        return FlashROMExecResult("Okay")
+
+    (input_directory / "dump.bin").write_bytes(b"\xff" * 4096 * 7 + bytes(4096))
+    adapter.run = Mock(side_effect=run)
+    cached_unit.set_pipeline(["blank-check", "erase"])
+    cached_unit.set_programmer("dummy:emulate=M25P10.RES")
+    cached_unit.execute()
+    assert adapter.run.call_args.args[0].include == ["changed0"]
+    assert layouts == ["00007000:00007fff changed0\n"]
+    assert contents_cache.get(PROGRAMMER, CHIP.name) is None
+
+
+def test_erase_includes_everything_when_most_blocks_are_dirty(cached_unit, adapter, input_directory):
+    erase_after_blank_check(cached_unit, adapter, input_directory, bytes(8192))
+    assert adapter.run.call_args.args[0].action == FlashROMActionEnum.ERASE
+    assert adapter.run.call_args.args[0].include == []
+
+
+def test_erase_includes_everything_when_partial_erase_is_disabled(cached_unit, adapter, input_directory):
+    cached_unit.unset_partial_erase()
+    erase_after_blank_check(cached_unit, adapter, input_directory, b"\xff" * 8192)
+    assert adapter.run.call_count == 2
+
+
+def test_erase_includes_everything_with_cached_contents_only(cached_unit, adapter, input_directory, contents_cache):
+    read_dump(cached_unit, adapter, input_directory, b"\xff" * 8192, "blank-check")
+    assert contents_cache.get(PROGRAMMER, CHIP.name) is not None
+    erase(cached_service(adapter, input_directory, contents_cache), adapter)
+    adapter.run.assert_called_once()
+    assert adapter.run.call_args.args[0].include == []
+
+
+def test_verify_by_hash_reads_chip(adapter, input_directory):
+    dump = bytes(8192)
+    unit = FlashROMService(adapter, input_directory, output_directory=input_directory)
+    unit.set_expected_hash(sha256(dump).hexdigest().upper())
+    result = read_dump(unit, adapter, input_directory, dump, "verify")
+    assert adapter.run.call_args.args[0].action == FlashROMActionEnum.READ
+    assert result.hash_check.match
+    assert result.message == "Okay\nVerifying flash by hash... VERIFIED."
+
+
+def test_verify_by_hash_reports_first_difference_of_known_image(adapter, input_directory):
+    images = ImageStore(input_directory)
+    expected = images.put(bytes(16384))
+    unit = FlashROMService(adapter, input_directory, output_directory=input_directory)
+    unit.set_expected_hash(expected)
+    with pytest.raises(PyFlexExecutionError, match="FAILED at 0x00002000.$"):
+        read_dump(unit, adapter, input_directory, bytes(8192) + b"\x01" + bytes(8191), "verify")
+    assert images.references(expected) == 0
+
+
+def test_verify_by_hash_of_unknown_image(adapter, input_directory):
+    metrics = OperationMetrics(MetricsRegistry())
+    unit = FlashROMService(adapter, input_directory, output_directory=input_directory, metrics=metrics)
+    unit.set_expected_hash("0" * 64)
+    with pytest.raises(PyFlexExecutionError, match="Verifying flash by hash... FAILED.$"):
+        read_dump(unit, adapter, input_directory, bytes(8192), "verify")
+    assert metrics.operations.value(action="verify", outcome="failure") == 1
+    assert metrics.operations.value(action="verify", outcome="success") == 0
+
+
+@pytest.mark.parametrize("action, data", [("read", None), ("verify", b"Hello, World!")])
+def test_pyflex_raises_parameter_error_for_inconsistent_expected_hash(adapter, input_directory, action, data):
+    unit = FlashROMService(adapter, input_directory, output_directory=input_directory)
+    unit.set_action(action)
+    unit.set_programmer("dummy:emulate=M25P10.RES")
+    unit.set_expected_hash("0" * 64)
+    if data:
+        unit.set_file(data)
+    with pytest.raises(PyFlexInvalidParameter):
+        unit.validate()
+
+
+def test_pyflex_raises_parameter_error_for_malformed_expected_hash(unit):
+    with pytest.raises(PyFlexInvalidParameter):
+        unit.set_expected_hash("not a hash")
+
+
+def pipeline_adapter(input_directory, dump=None):
+    results = {
+        FlashROMActionEnum.PROBE: probe_result(
+            'Found Winbond flash chip "W25Q64JV-.Q" (8192 kB, SPI) on ch341a_spi.'
+        ),
+        FlashROMActionEnum.WRITE: FlashROMExecResult("Erase/write done."),
+        FlashROMActionEnum.READ: FlashROMExecResult("Reading flash... done.", "dump.bin"),
+    }
+    if dump is not None:
+        (input_directory / "dump.bin").write_bytes(dump)
+    adapter = Mock(spec=FlashROMAdapter)
+    adapter.run = Mock(side_effect=lambda opts: results[opts.action])
+    return adapter
+
+
+def test_pipeline_runs_steps_in_one_session(input_directory, probe_cache, tmp_path_factory):
+    image = b"Hello, World!"
+    adapter = pipeline_adapter(input_directory, image)
+    devices = DeviceManager(tmp_path_factory.mktemp("flashrom_service_locks"))
+    unit = FlashROMService(
+        adapter,
+        input_directory,
+        output_directory=input_directory,
+        probe_cache=probe_cache,
+        device_manager=devices,
+    )
+    unit.set_pipeline(["probe", "write", "verify", "read"])
+    unit.set_programmer("dummy:emulate=M25P10.RES")
+    unit.set_file(image)
+    result = unit.execute()
+
+    actions = [call.args[0].action for call in adapter.run.call_args_list]
+    assert actions == [FlashROMActionEnum.PROBE, FlashROMActionEnum.WRITE, FlashROMActionEnum.READ]
+    assert [call.args[0].chip for call in adapter.run.call_args_list] == [None, "W25Q64JV-.Q", "W25Q64JV-.Q"]
+    assert result.path == "dump.bin"
+    assert result.hash_check.match
+    assert "Verified while writing." in result.message
+    assert {"upload", "queue", "write.adapter", "read.hash"} <= set(result.timings)
+
+
+def test_pipeline_stops_at_first_failure(adapter, input_directory):
+    adapter.run = Mock(side_effect=PyFlexExecutionError("No EEPROM/flash device found."))
+    unit = FlashROMService(adapter, input_directory)
+    unit.set_pipeline(["probe", "write", "verify"])
+    unit.set_programmer("dummy:emulate=M25P10.RES")
+    unit.set_file(b"Hello, World!")
+    with pytest.raises(PyFlexExecutionError):
+        unit.execute()
+    adapter.run.assert_called_once()
+
+
+def test_pipeline_stops_when_read_back_differs(input_directory):
+    adapter = pipeline_adapter(input_directory, b"Hello, Moon!!")
+    unit = FlashROMService(adapter, input_directory, output_directory=input_directory)
+    unit.set_pipeline(["write", "read", "probe"])
+    unit.set_programmer("dummy:emulate=M25P10.RES")
+    unit.set_file(b"Hello, World!")
+    with pytest.raises(PyFlexExecutionError, match="Verifying flash by hash... FAILED"):
+        unit.execute()
+    assert adapter.run.call_count == 2
+
+
+def test_pipeline_verifies_after_narrowed_write(adapter, input_directory):
+    image = bytearray(64 * 1024)
+    (input_directory / "dump.bin").write_bytes(bytes(image))
+    adapter.run = Mock(side_effect=lambda opts: FlashROMExecResult(
+        "Okay", "dump.bin" if opts.action == FlashROMActionEnum.READ else None
+    ))
+    image[5000] = 1
+    unit = FlashROMService(adapter, input_directory, output_directory=input_directory)
+    unit.set_pipeline(["read", "write", "verify"])
+    unit.set_programmer("dummy:emulate=M25P10.RES")
+    unit.set_file(bytes(image))
+    unit.execute()
+
+    write, verify = [call.args[0] for call in adapter.run.call_args_list[1:]]
+    assert write.verify_included_only
+    assert verify.action == FlashROMActionEnum.VERIFY
+
+
+@pytest.mark.parametrize("configure", [
+    lambda unit: unit.set_action("write"),
+    lambda unit: unit.set_expected_hash("0" * 64),
+])
+def test_pyflex_raises_parameter_error_for_inconsistent_pipeline(unit, configure):
+    unit.set_pipeline(["probe", "write"])
+    unit.set_programmer("dummy:emulate=M25P10.RES")
+    unit.set_file(b"Hello, World!")
+    configure(unit)
+    with pytest.raises(PyFlexInvalidParameter):
+        unit.validate()
+
+
+def test_pyflex_raises_parameter_error_if_pipeline_lacks_file(unit):
+    unit.set_pipeline(["probe", "write"])
+    unit.set_programmer("dummy:emulate=M25P10.RES")
+    with pytest.raises(PyFlexInvalidParameter):
+        unit.validate()
+
+
+@pytest.mark.parametrize("actions", [[], ["probe", "flash"]])
+def test_pyflex_raises_parameter_error_for_invalid_pipeline(unit, actions):
+    with pytest.raises(PyFlexInvalidParameter):
+        unit.set_pipeline(actions)
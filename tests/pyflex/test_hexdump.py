@@ -0,0 +1,44 @@
+import pytest
+
+from pyflex.exceptions import PyFlexInvalidParameter
+from pyflex.hexdump import MAX_PAGE_SIZE, read_page
+from pyflex.models import HexRow
+
+
+@pytest.fixture()
+def dump(tmp_path):
+    path = tmp_path / "dump.bin"
+    path.write_bytes(bytes(range(256)) * 4)
+    return path
+
+
+def test_page_is_rendered_as_hex_and_ascii(dump):
+    page = read_page(dump, 0x40, 20)
+    assert page.size == 1024
+    assert page.offset == 0x40
+    assert page.rows == [
+        HexRow(0x40, "40 41 42 43 44 45 46 47 48 49 4a 4b 4c 4d 4e 4f", "@ABCDEFGHIJKLMNO"),
+        HexRow(0x50, "50 51 52 53", "PQRS"),
+    ]
+
+
+def test_unprintable_bytes_are_dots(dump):
+    assert read_page(dump, 0x7c, 8).rows[0].text == "|}~....."
+
+
+def test_page_stops_at_end_of_file(dump):
+    page = read_page(dump, 1020, 4096)
+    assert [row.offset for row in page.rows] == [1020]
+    assert read_page(dump, 1024).rows == []
+
+
+def test_empty_file_has_no_rows(tmp_path):
+    path = tmp_path / "empty.bin"
+    path.write_bytes(b"")
+    assert read_page(path).rows == []
+
+
+@pytest.mark.parametrize("offset, length", [(-1, 16), (1025, 16), (0, 0), (0, MAX_PAGE_SIZE + 1)])
+def test_invalid_page_is_rejected(dump, offset, length):
+    with pytest.raises(PyFlexInvalidParameter):
+        read_page(dump, offset, length)
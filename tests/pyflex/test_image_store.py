@@ -0,0 +1,157 @@
+import pytest
+import subprocess
+from hashlib import sha256
+from io import BytesIO
+
+from pyflex.image_store import ImageStore
+from pyflex.exceptions import PyFlexInvalidParameter, PyFlexNotFound
+
+
+class UnseekableStream(BytesIO):
+
+    def seekable(self):
+        return False
+
+
+@pytest.fixture()
+def directory(tmp_path_factory):
+    return tmp_path_factory.mktemp("image_store")
+
+
+@pytest.fixture()
+def unit(directory):
+    return ImageStore(directory)
+
+
+def test_image_is_stored_by_digest(unit, directory):
+    data = b"0100100001101001"
+    digest = unit.put(data)
+    assert digest == sha256(data).hexdigest()
+    assert (directory / digest[:2] / f"{digest[2:]}.bin").read_bytes() == data
+
+
+@pytest.mark.parametrize("stream", [BytesIO, UnseekableStream])
+def test_image_is_stored_once(unit, directory, stream):
+    data = b"0100100001101001"
+    first = unit.put(stream(data))
+    second = unit.put(stream(data))
+    assert first == second
+    assert len(list(directory.rglob("*.bin"))) == 1
+    assert list(directory.glob("*.part")) == []
+
+
+def test_known_image_is_not_rewritten(unit, monkeypatch):
+    data = b"0100100001101001"
+    unit.put(data)
+    monkeypatch.setattr("builtins.open", None)
+    unit.put(BytesIO(data))
+
+
+def test_references_are_counted(unit):
+    digest = unit.put(b"0100100001101001")
+    assert unit.acquire(digest) == 1
+    assert unit.acquire(digest) == 2
+    assert unit.release(digest) == 1
+    assert unit.references(digest) == 1
+
+
+def test_referenced_image_is_not_reclaimed(unit):
+    digest = unit.put(b"0100100001101001")
+    unit.acquire(digest)
+    assert not unit.reclaim(digest)
+    assert unit.exists(digest)
+    unit.release(digest)
+    assert unit.reclaim(digest)
+    assert not unit.exists(digest)
+
+
+def test_missing_image_cannot_be_acquired(unit):
+    with pytest.raises(PyFlexNotFound):
+        unit.acquire(sha256(b"missing").hexdigest())
+
+
+def test_malformed_digest_is_rejected(unit):
+    with pytest.raises(PyFlexInvalidParameter):
+        unit.path("../../etc/passwd")
+
+
+def test_oversized_image_is_rejected(directory):
+    unit = ImageStore(directory, max_file_size=4)
+    with pytest.raises(PyFlexInvalidParameter):
+        unit.put(UnseekableStream(b"0100100001101001"))
+    assert list(directory.iterdir()) == []
+
+
+def test_size_of_stored_image(unit):
+    digest = unit.put(b"0100100001101001")
+    assert unit.size(digest) == 16
+
+
+def test_size_of_missing_image_raises_not_found(unit):
+    with pytest.raises(PyFlexNotFound):
+        unit.size(sha256(b"missing").hexdigest())
+
+
+def test_loose_images_are_indexed(unit, directory):
+    data = b"0100100001101001"
+    (directory / "legacy.bin").write_bytes(data)
+    (directory / "duplicate.bin").write_bytes(data)
+    assert unit.index() == [sha256(data).hexdigest()] * 2
+    assert unit.exists(sha256(data).hexdigest())
+    assert list(directory.glob("*.bin")) == []
+
+
+def test_referenced_image_is_not_reclaimed_by_path(unit):
+    digest = unit.put(b"0100100001101001")
+    unit.acquire(digest)
+    assert not unit.reclaim_path(unit.path(digest))
+    unit.release(digest)
+    assert unit.reclaim_path(unit.path(digest))
+
+
+def test_reclaim_path_rejects_other_files(unit, directory):
+    with pytest.raises(PyFlexInvalidParameter):
+        unit.reclaim_path(directory / "legacy.bin")
+
+
+def test_image_can_be_referenced_as_it_is_stored(unit):
+    digest = unit.put(b"0100100001101001", acquire=True)
+    assert unit.references(digest) == 1
+    assert unit.put(UnseekableStream(b"0100100001101001"), acquire=True) == digest
+    assert unit.references(digest) == 2
+
+
+def test_references_of_exited_process_do_not_count(unit, directory):
+    digest = unit.put(b"0100100001101001")
+    exited = subprocess.Popen(["true"])
+    exited.wait()
+    unit.acquire(digest)
+    refs = unit.path(digest).with_suffix(".refs")
+    refs.write_text(refs.read_text() + f"{exited.pid} 3\n")
+    assert unit.references(digest) == 1
+    unit.release(digest)
+    assert unit.reclaim(digest)
+
+
+def test_reading_references_creates_no_files(unit, directory):
+    unit.references(sha256(b"missing").hexdigest())
+    unit.release(sha256(b"missing").hexdigest())
+    with pytest.raises(PyFlexNotFound):
+        unit.acquire(sha256(b"missing").hexdigest())
+    assert list(directory.rglob("*.refs")) == []
+
+
+def test_reference_file_is_removed_with_image(unit, directory):
+    digest = unit.put(b"0100100001101001")
+    unit.acquire(digest)
+    unit.release(digest)
+    assert unit.reclaim(digest)
+    assert list(directory.rglob("*")) == [unit.path(digest).parent]
+
+
+def test_orphaned_reference_files_are_removed_by_index(unit, directory):
+    refs = unit.path(sha256(b"missing").hexdigest()).with_suffix(".refs")
+    refs.parent.mkdir()
+    refs.write_text("3")
+    unit.index()
+    assert not refs.exists()
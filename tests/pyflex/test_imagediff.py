@@ -0,0 +1,138 @@
+import pytest
+
+from pyflex import imagediff
+from pyflex.imagediff import (
+    blank_check,
+    changed_blocks,
+    changed_regions,
+    diff_images,
+    dirty_blocks,
+    merge_blocks,
+    write_layout,
+)
+
+
+@pytest.fixture(params=["numpy", "python"])
+def implementation(request, monkeypatch):
+    if request.param == "numpy":
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(imagediff, "numpy", None)
+    return request.param
+
+
+def test_identical_images_have_no_changed_blocks(implementation):
+    assert changed_blocks(bytes(8192), bytes(8192), 4096) == []
+
+
+def test_changed_blocks_are_found(implementation):
+    new = bytearray(16384)
+    new[0] = 1
+    new[12287] = 1
+    assert changed_blocks(bytes(16384), bytes(new), 4096) == [0, 2]
+
+
+def test_changed_partial_last_block_is_found(implementation):
+    new = bytearray(5000)
+    new[4999] = 1
+    assert changed_blocks(bytes(5000), bytes(new), 4096) == [1]
+
+
+def test_odd_block_sizes_are_compared(implementation):
+    new = bytearray(30)
+    new[11] = 1
+    assert changed_blocks(bytes(30), bytes(new), 10) == [1]
+
+
+def test_images_must_be_the_same_size():
+    with pytest.raises(ValueError):
+        changed_blocks(bytes(10), bytes(20))
+
+
+def test_adjacent_blocks_are_merged():
+    assert merge_blocks([0, 1, 2, 5], 4096, 8 * 4096) == [(0, 3 * 4096), (5 * 4096, 6 * 4096)]
+
+
+def test_closest_regions_are_merged_over_the_limit():
+    assert merge_blocks([0, 2, 10], 1, 11, max_regions=2) == [(0, 3), (10, 11)]
+
+
+def test_last_region_ends_at_image_size():
+    assert merge_blocks([1], 4096, 5000) == [(4096, 5000)]
+
+
+def test_changed_regions_of_files(tmp_path):
+    old = tmp_path / "old.bin"
+    new = tmp_path / "new.bin"
+    old.write_bytes(bytes(8192))
+    new.write_bytes(bytes(4096) + b"\x01" + bytes(4095))
+    assert changed_regions(old, new) == [(4096, 8192)]
+
+
+def test_changed_regions_of_different_sizes(tmp_path):
+    old = tmp_path / "old.bin"
+    new = tmp_path / "new.bin"
+    old.write_bytes(bytes(8192))
+    new.write_bytes(bytes(4096))
+    assert changed_regions(old, new) is None
+
+
+def test_write_layout(tmp_path):
+    path = tmp_path / "layout.txt"
+    assert write_layout([(0, 4096), (65536, 131072)], path) == ["changed0", "changed1"]
+    assert path.read_text() == (
+        "00000000:00000fff changed0\n"
+        "00010000:0001ffff changed1\n"
+    )
+
+
+def test_regions_are_not_limited_without_max_regions():
+    assert merge_blocks([0, 2, 4], 1, 5, max_regions=None) == [(0, 1), (2, 3), (4, 5)]
+
+
+def test_diff_images(tmp_path, implementation):
+    old = tmp_path / "old.bin"
+    new = tmp_path / "new.bin"
+    image = bytearray(5 * 4096)
+    old.write_bytes(bytes(image))
+    image[4096] = image[4097] = image[3 * 4096] = image[4 * 4096 + 1] = 1
+    new.write_bytes(bytes(image))
+
+    diff = diff_images(old, new)
+    assert diff.size == 5 * 4096
+    assert diff.ranges == [(4096, 2 * 4096), (3 * 4096, 5 * 4096)]
+    assert diff.changed_blocks == 3
+    assert diff.changed_bytes == 4
+
+
+def test_diff_identical_images(tmp_path, implementation):
+    old = tmp_path / "old.bin"
+    old.write_bytes(b"\xff" * 8192)
+    diff = diff_images(old, old)
+    assert (diff.ranges, diff.changed_blocks, diff.changed_bytes) == ([], 0, 0)
+
+
+def test_diff_images_of_different_sizes(tmp_path):
+    old = tmp_path / "old.bin"
+    new = tmp_path / "new.bin"
+    old.write_bytes(bytes(8192))
+    new.write_bytes(bytes(4096))
+    with pytest.raises(ValueError):
+        diff_images(old, new)
+
+
+def test_dirty_blocks_are_found(implementation):
+    image = bytearray(b"\xff" * 5000)
+    image[4096] = 0xfe
+    assert dirty_blocks(bytes(image), 4096) == [1]
+    assert dirty_blocks(b"\xff" * 8192, 4096) == []
+    assert dirty_blocks(b"\xff" * 29 + b"\x00", 10) == [2]
+
+
+def test_blank_check_of_file(tmp_path, implementation):
+    path = tmp_path / "dump.bin"
+    path.write_bytes(b"\xff" * 4096 + bytes(8192) + b"\xff" * 4096 + bytes(1))
+    check = blank_check(path)
+    assert check.size == 4 * 4096 + 1
+    assert check.dirty == [(4096, 3 * 4096), (4 * 4096, 4 * 4096 + 1)]
+    assert check.dirty_blocks == 3
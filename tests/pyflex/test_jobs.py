@@ -0,0 +1,137 @@
+import pytest
+from threading import Event
+from unittest.mock import Mock
+
+from pyflex.jobs import JobManager
+from pyflex.models import FlashROMExecResult, JobStatusEnum
+from pyflex.typing import CommandDispatcher
+from pyflex.exceptions import PyFlexExecutionError, PyFlexNotFound
+
+
+@pytest.fixture()
+def unit():
+    manager = JobManager(max_workers=2, max_history=2)
+    yield manager
+    manager.shutdown()
+
+
+def make_dispatcher(**kwargs):
+    kwargs.setdefault("return_value", FlashROMExecResult("Okay", None))
+    dispatcher = Mock(spec=CommandDispatcher)
+    dispatcher.execute = Mock(**kwargs)
+    return dispatcher
+
+
+def test_job_result_is_available_after_execution(unit):
+    job = unit.wait(unit.submit(make_dispatcher()).id)
+    assert job.status == JobStatusEnum.SUCCEEDED
+    assert job.result == FlashROMExecResult("Okay", None)
+
+
+def test_job_records_dispatcher_errors(unit):
+    expected = PyFlexExecutionError("Hello from unittest")
+    job = unit.wait(unit.submit(make_dispatcher(side_effect=expected)).id)
+    assert job.status == JobStatusEnum.FAILED
+    assert job.error == expected
+
+
+def test_submit_does_not_wait_for_execution(unit):
+    release = Event()
+    job = unit.submit(make_dispatcher(side_effect=lambda: release.wait()))
+    try:
+        assert unit.get(job.id).status in {JobStatusEnum.PENDING, JobStatusEnum.RUNNING}
+    finally:
+        release.set()
+
+
+def test_unknown_job_raises_not_found(unit):
+    with pytest.raises(PyFlexNotFound):
+        unit.get("not-a-job")
+
+
+def test_oldest_finished_jobs_are_forgotten(unit):
+    first = unit.wait(unit.submit(make_dispatcher()).id)
+    unit.wait(unit.submit(make_dispatcher()).id)
+    unit.submit(make_dispatcher())
+    with pytest.raises(PyFlexNotFound):
+        unit.get(first.id)
+
+
+def test_follow_yields_output_until_job_finishes(unit):
+    release = Event()
+    job = unit.create()
+    unit.append_output(job.id, "Hello")
+    unit.submit(make_dispatcher(side_effect=lambda: release.wait()), job)
+    lines = unit.follow(job.id)
+    assert next(lines) == "Hello"
+    unit.append_output(job.id, "World")
+    assert next(lines) == "World"
+    release.set()
+    assert list(lines) == []
+
+
+def test_follow_yields_heartbeat_when_idle(unit):
+    release = Event()
+    job = unit.submit(make_dispatcher(side_effect=lambda: release.wait()))
+    try:
+        assert next(unit.follow(job.id, heartbeat=0.01)) is None
+    finally:
+        release.set()
+
+
+def test_output_is_trimmed_to_limit():
+    manager = JobManager(max_output_lines=2)
+    job = manager.create()
+    for line in ["a", "b", "c"]:
+        manager.append_output(job.id, line)
+    manager.submit(make_dispatcher(), job)
+    try:
+        assert list(manager.follow(job.id)) == ["b", "c"]
+    finally:
+        manager.shutdown()
+
+
+def test_discarded_jobs_are_forgotten(unit):
+    job = unit.create()
+    unit.discard(job.id)
+    with pytest.raises(PyFlexNotFound):
+        unit.get(job.id)
+
+
+def test_output_is_trimmed_to_size():
+    manager = JobManager(max_output_bytes=4)
+    job = manager.create()
+    for line in ["aa", "bb", "cc", "dddddd"]:
+        manager.append_output(job.id, line)
+        assert job.output_size <= 4 or job.output == [line]
+    manager.submit(make_dispatcher(), job)
+    try:
+        assert list(manager.follow(job.id)) == ["dddddd"]
+        assert job.output_dropped == 3
+    finally:
+        manager.shutdown()
+
+
+def test_jobs_with_same_key_do_not_hold_up_other_keys(unit):
+    release = Event()
+    order = []
+
+    def hold(name):
+        def execute():
+            order.append(name)
+            release.wait()
+        return make_dispatcher(side_effect=execute)
+
+    first = [unit.submit(hold(f"a{index}"), key="a") for index in range(3)]
+    other = unit.wait(unit.submit(make_dispatcher(), key="b").id, timeout=5)
+
+    try:
+        assert other.status == JobStatusEnum.SUCCEEDED
+        assert order == ["a0"]
+        assert [job.status for job in first[1:]] == [JobStatusEnum.PENDING] * 2
+    finally:
+        release.set()
+
+    for job in first:
+        assert unit.wait(job.id, timeout=5).status == JobStatusEnum.SUCCEEDED
+    assert order == ["a0", "a1", "a2"]
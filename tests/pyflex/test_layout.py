@@ -0,0 +1,45 @@
+import pytest
+
+from pyflex.exceptions import PyFlexInvalidParameter
+from pyflex.layout import MAX_REGIONS, parse_layout, render_layout, validate_region_name
+from pyflex.models import FlashROMRegion
+
+
+def test_layout_is_parsed():
+    text = "00000000:00000fff fd\n\n0x1000:0x1fffff bios\n"
+    assert parse_layout(text) == [
+        FlashROMRegion(0, 0xfff, "fd"),
+        FlashROMRegion(0x1000, 0x1fffff, "bios"),
+    ]
+
+
+def test_layout_is_rendered():
+    regions = [FlashROMRegion(0, 0xfff, "fd"), FlashROMRegion(0x1000, 0x1fffff, "bios")]
+    assert render_layout(regions) == "00000000:00000fff fd\n00001000:001fffff bios\n"
+    assert parse_layout(render_layout(regions)) == regions
+
+
+@pytest.mark.parametrize("text", [
+    "",
+    "0:fff",
+    "0-fff fd",
+    "0:fff fd extra",
+    "1000:fff fd",
+    "0:fff fd\n1000:1fff fd",
+    "0:fff f;d",
+])
+def test_invalid_layout_is_rejected(text):
+    with pytest.raises(PyFlexInvalidParameter):
+        parse_layout(text)
+
+
+def test_layout_with_too_many_regions_is_rejected():
+    text = "".join(f"{index:x}:{index:x} r{index}\n" for index in range(MAX_REGIONS + 1))
+    with pytest.raises(PyFlexInvalidParameter):
+        parse_layout(text)
+
+
+@pytest.mark.parametrize("name", ["", "-", "a b", "$(reboot)", "a" * 64])
+def test_invalid_region_name_is_rejected(name):
+    with pytest.raises(PyFlexInvalidParameter):
+        validate_region_name(name)
@@ -0,0 +1,94 @@
+import pytest
+
+from pyflex.metrics import MetricsRegistry, OperationMetrics
+
+
+@pytest.fixture()
+def registry():
+    return MetricsRegistry()
+
+
+def test_counter_renders_series(registry):
+    counter = registry.counter("ops_total", "Operations.", ["action"])
+    counter.inc(action="read")
+    counter.inc(2, action="read")
+    counter.inc(action="write")
+
+    assert registry.render() == (
+        "# HELP ops_total Operations.\n"
+        "# TYPE ops_total counter\n"
+        'ops_total{action="read"} 3\n'
+        'ops_total{action="write"} 1\n'
+    )
+    assert counter.value(action="read") == 3
+
+
+def test_counter_rejects_decrease(registry):
+    counter = registry.counter("ops_total", "Operations.")
+    with pytest.raises(ValueError):
+        counter.inc(-1)
+
+
+def test_labels_must_match(registry):
+    counter = registry.counter("ops_total", "Operations.", ["action"])
+    with pytest.raises(ValueError):
+        counter.inc(outcome="success")
+
+
+def test_label_values_are_escaped(registry):
+    counter = registry.counter("ops_total", "Operations.", ["programmer"])
+    counter.inc(programmer='a"b\\c\nd')
+    assert 'ops_total{programmer="a\\"b\\\\c\\nd"} 1' in registry.render()
+
+
+def test_histogram_buckets_are_cumulative(registry):
+    histogram = registry.histogram("took_seconds", "Duration.", buckets=[1, 5])
+    histogram.observe(0.5)
+    histogram.observe(1)
+    histogram.observe(3)
+    histogram.observe(10)
+
+    assert registry.render().splitlines()[2:] == [
+        'took_seconds_bucket{le="1"} 2',
+        'took_seconds_bucket{le="5"} 3',
+        'took_seconds_bucket{le="+Inf"} 4',
+        "took_seconds_sum 14.5",
+        "took_seconds_count 4",
+    ]
+
+
+def test_gauge_is_collected_on_render(registry):
+    depths = {}
+    registry.gauge("depth", "Queue depth.", ["programmer"], collect=lambda: depths)
+
+    depths[("ch341a_spi",)] = 2
+    assert 'depth{programmer="ch341a_spi"} 2' in registry.render()
+
+    depths.clear()
+    assert "depth{" not in registry.render()
+
+
+def test_failing_gauge_does_not_break_render(registry):
+    def collect():
+        raise OSError("gone")
+
+    registry.gauge("size", "Size.", collect=collect)
+    registry.counter("ops_total", "Operations.").inc()
+
+    assert "ops_total 1" in registry.render()
+
+
+def test_duplicate_names_are_rejected(registry):
+    registry.counter("ops_total", "Operations.")
+    with pytest.raises(ValueError):
+        registry.counter("ops_total", "Operations.")
+
+
+def test_operation_metrics(registry):
+    unit = OperationMetrics(registry)
+    unit.record_operation("write", "success")
+    unit.record_duration("write", 2)
+
+    text = registry.render()
+    assert 'pyflex_operations_total{action="write",outcome="success"} 1' in text
+    assert 'pyflex_flashrom_duration_seconds_count{action="write"} 1' in text
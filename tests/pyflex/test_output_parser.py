@@ -0,0 +1,121 @@
+from pyflex.models import FlashROMChip, FlashROMPhaseEnum, FlashROMPhaseStatusEnum
+from pyflex.output_parser import FlashROMOutputParser, parse_chips, phase_timings
+
+
+def test_parse_single_chip():
+    text = (
+        "flashrom v1.3.0 on Linux 6.1.0 (x86_64)\n"
+        'Found Winbond flash chip "W25Q64.V" (8192 kB, SPI) on ch341a_spi.\n'
+        "No operations were specified.\n"
+    )
+    assert parse_chips(text) == [FlashROMChip("Winbond", "W25Q64.V", 8192 * 1024, "SPI")]
+
+
+def test_parse_multiple_chips():
+    text = (
+        'Found Macronix flash chip "MX25L6405" (8192 kB, SPI) on ch341a_spi.\n'
+        'Found Macronix flash chip "MX25L6405D" (8192 kB, SPI) on ch341a_spi.\n'
+        "Multiple flash chip definitions match the detected chip(s)\n"
+    )
+    assert [chip.name for chip in parse_chips(text)] == ["MX25L6405", "MX25L6405D"]
+
+
+def test_parse_no_chips():
+    assert parse_chips("No EEPROM/flash device found.\n") == []
+
+
+WRITE_OUTPUT = """\
+flashrom v1.3.0 on Linux 6.1.0 (x86_64)
+Found Winbond flash chip "W25Q64.V" (8192 kB, SPI) on ch341a_spi.
+Reading old flash chip contents... done.
+Erasing and writing flash chip... Erase/write done.
+Verifying flash... VERIFIED.
+"""
+
+
+def phases(report):
+    return [(phase.phase, phase.status) for phase in report.phases]
+
+
+def feed(text):
+    unit = FlashROMOutputParser()
+    for line in text.splitlines():
+        unit.feed(line)
+    return unit
+
+
+def test_parse_write():
+    unit = feed(WRITE_OUTPUT)
+    unit.finish(0, 12.5)
+    report = unit.report()
+    assert report.programmer == "ch341a_spi"
+    assert report.chips == [FlashROMChip("Winbond", "W25Q64.V", 8192 * 1024, "SPI")]
+    assert report.elapsed == 12.5
+    assert phases(report) == [
+        (FlashROMPhaseEnum.READ, FlashROMPhaseStatusEnum.DONE),
+        (FlashROMPhaseEnum.ERASE, FlashROMPhaseStatusEnum.DONE),
+        (FlashROMPhaseEnum.WRITE, FlashROMPhaseStatusEnum.DONE),
+        (FlashROMPhaseEnum.VERIFY, FlashROMPhaseStatusEnum.DONE),
+    ]
+
+
+def test_phase_is_running_until_it_completes():
+    unit = feed("Reading flash...")
+    assert phases(unit.report()) == [
+        (FlashROMPhaseEnum.READ, FlashROMPhaseStatusEnum.RUNNING),
+    ]
+    unit.feed("done.")
+    assert phases(unit.report()) == [
+        (FlashROMPhaseEnum.READ, FlashROMPhaseStatusEnum.DONE),
+    ]
+
+
+def test_failed_verify():
+    unit = feed("Verifying flash... VERIFY FAILED at 0x00001000! Expected=0xff, Found=0x00")
+    unit.finish(1)
+    assert phases(unit.report()) == [
+        (FlashROMPhaseEnum.VERIFY, FlashROMPhaseStatusEnum.FAILED),
+    ]
+
+
+def test_running_phase_fails_with_exit_code():
+    unit = feed("Erasing and writing flash chip...")
+    unit.finish(1)
+    assert {status for _, status in phases(unit.report())} == {FlashROMPhaseStatusEnum.FAILED}
+
+
+def test_report_is_a_snapshot():
+    unit = feed("Reading flash...")
+    report = unit.report()
+    unit.feed("done.")
+    assert report.phases[0].status == FlashROMPhaseStatusEnum.RUNNING
+
+
+def test_timed_lines_time_phases():
+    unit = FlashROMOutputParser()
+    unit.feed("flashrom v1.3.0 on Linux 6.1.0 (x86_64)", 0.0, 0.0)
+    unit.feed('Found Winbond flash chip "W25Q64.V" (8192 kB, SPI) on ch341a_spi.', 0.5, 0.5)
+    unit.feed("Reading old flash chip contents... done.", 1.0, 3.0)
+    unit.feed("Erasing and writing flash chip... Erase/write done.", 3.0, 10.0)
+    unit.feed("Verifying flash... VERIFIED.", 10.0, 12.0)
+    unit.finish(0, 12.5)
+    report = unit.report()
+
+    assert report.probed == 0.5
+    assert [(phase.started, phase.finished) for phase in report.phases] == [
+        (1.0, 3.0), (3.0, 10.0), (3.0, 10.0), (10.0, 12.0),
+    ]
+    assert phase_timings(report) == {"probe": 0.5, "read": 2.0, "write": 7.0, "verify": 2.0}
+
+
+def test_separate_erase_is_timed():
+    unit = FlashROMOutputParser()
+    unit.feed("Erasing flash chip... ", 1.0, 1.0)
+    unit.finish(0, 4.0)
+    assert phase_timings(unit.report()) == {"erase": 3.0}
+
+
+def test_untimed_lines_have_no_timings():
+    unit = feed(WRITE_OUTPUT)
+    unit.finish(0, 12.5)
+    assert phase_timings(unit.report()) == {}
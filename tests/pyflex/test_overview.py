@@ -0,0 +1,94 @@
+import os
+import pytest
+
+from pyflex import overview
+from pyflex.overview import OVERVIEW_PATTERN, DumpOverviews, compute_overview
+from pyflex.retention import DirectoryReaper
+
+
+@pytest.fixture(params=["numpy", "python"])
+def implementation(request, monkeypatch):
+    if request.param == "numpy":
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(overview, "numpy", None)
+    return request.param
+
+
+@pytest.fixture()
+def dump(tmp_path):
+    path = tmp_path / "dump.bin"
+    # Erased, zeroed, every byte value once per 256 bytes and half erased.
+    path.write_bytes(b"\xff" * 4096 + bytes(4096) + bytes(range(256)) * 16 + b"\xff" * 2048 + bytes(2048))
+    return path
+
+
+def test_blocks_are_summarized(dump, implementation):
+    result = compute_overview(dump)
+    assert result.size == 4 * 4096
+    assert result.levels[0].block_size == 4096
+    assert list(result.levels[0].entropy) == [0, 0, 255, 32]
+    assert list(result.levels[0].erased) == [255, 0, 1, 128]
+    assert list(result.levels[0].zero) == [0, 255, 1, 128]
+
+
+def test_levels_halve_down_to_one_block(dump, implementation):
+    result = compute_overview(dump)
+    assert [level.block_size for level in result.levels] == [4096, 8192, 16384]
+    assert list(result.levels[1].erased) == [128, 65]
+    assert list(result.levels[2].erased) == [97]
+
+
+def test_short_last_block_is_summarized(tmp_path, implementation):
+    path = tmp_path / "dump.bin"
+    path.write_bytes(bytes(4096) + b"\xff" * 100)
+    result = compute_overview(path)
+    assert list(result.levels[0].erased) == [0, 255]
+
+
+def test_overview_is_cached_next_to_dump(dump):
+    overviews = DumpOverviews()
+    created = overviews.create(dump)
+    assert overviews.path(dump) == dump.with_name("dump.bin.overview.json")
+    assert overviews.path(dump).exists()
+    assert overviews.get(dump) == created
+
+
+def test_overview_is_computed_when_missing(dump):
+    overviews = DumpOverviews()
+    assert overviews.get(dump).size == 4 * 4096
+    assert overviews.path(dump).exists()
+
+
+def test_overview_is_computed_again_when_dump_changes(dump):
+    overviews = DumpOverviews()
+    overviews.create(dump)
+    dump.write_bytes(bytes(4096))
+    os.utime(dump, ns=(0, 0))
+    assert overviews.get(dump).size == 4096
+
+
+def test_invalid_overview_is_computed_again(dump):
+    overviews = DumpOverviews()
+    overviews.path(dump).write_text("{")
+    assert overviews.get(dump).size == 4 * 4096
+
+
+def test_overview_is_deleted_with_dump(dump):
+    overviews = DumpOverviews()
+    overviews.create(dump)
+    reaper = DirectoryReaper(dump.parent, max_age=0, delete=overviews.delete)
+
+    assert reaper.reap() == [dump]
+    assert not overviews.path(dump).exists()
+
+
+def test_partial_overviews_are_reaped(dump):
+    overviews = DumpOverviews()
+    overviews.create(dump)
+    partial = dump.with_name(".partial.overview.json")
+    partial.write_text("{")
+    reaper = DirectoryReaper(dump.parent, max_age=0, pattern=OVERVIEW_PATTERN)
+
+    assert sorted(reaper.reap()) == sorted([partial, overviews.path(dump)])
+    assert dump.exists()
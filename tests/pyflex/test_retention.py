@@ -0,0 +1,95 @@
+import os
+import pytest
+import time
+
+from pyflex import retention
+from pyflex.image_store import ImageStore
+from pyflex.retention import DirectoryReaper
+
+
+@pytest.fixture()
+def directory(tmp_path_factory):
+    return tmp_path_factory.mktemp("retention")
+
+
+def make_file(directory, name, size=16, age=0):
+    path = directory / name
+    path.write_bytes(b"\xff" * size)
+    then = time.time() - age
+    os.utime(path, (then, then))
+    return path
+
+
+def test_old_files_are_deleted(directory):
+    old = make_file(directory, "old.bin", age=100)
+    new = make_file(directory, "new.bin", age=1)
+    unit = DirectoryReaper(directory, max_age=50)
+    assert unit.reap() == [old]
+    assert new.exists()
+
+
+def test_least_recently_used_files_are_deleted_over_quota(directory):
+    oldest = make_file(directory, "a.bin", age=30)
+    older = make_file(directory, "b.bin", age=20)
+    newest = make_file(directory, "c.bin", age=10)
+    unit = DirectoryReaper(directory, max_bytes=16)
+    assert unit.reap() == [oldest, older]
+    assert newest.exists()
+
+
+def test_touched_files_are_kept(directory):
+    used = make_file(directory, "a.bin", age=30)
+    unused = make_file(directory, "b.bin", age=20)
+    retention.touch(used)
+    unit = DirectoryReaper(directory, max_bytes=16)
+    assert unit.reap() == [unused]
+
+
+def test_files_that_are_still_needed_are_kept(directory):
+    needed = make_file(directory, "a.bin", age=30)
+    unneeded = make_file(directory, "b.bin", age=20)
+
+    def delete(path):
+        if path == needed:
+            return False
+        path.unlink()
+        return True
+
+    unit = DirectoryReaper(directory, max_bytes=16, delete=delete)
+    assert unit.reap() == [unneeded]
+    assert needed.exists()
+
+
+def test_files_that_cannot_be_deleted_are_skipped(directory):
+    store = ImageStore(directory)
+    digest = store.put(b"\x00" * 16)
+    stored = store.path(digest)
+    os.utime(stored, (time.time() - 100, time.time() - 100))
+    # Empty files are left in place by ImageStore.index.
+    loose = make_file(directory, "loose.bin", size=0, age=200)
+    store.index()
+
+    unit = DirectoryReaper(directory, max_age=50, delete=store.reclaim_path)
+    assert unit.reap() == [stored]
+    assert loose.exists()
+
+
+def test_other_files_are_ignored(directory):
+    other = make_file(directory, "a.part", age=100)
+    unit = DirectoryReaper(directory, max_age=50)
+    assert unit.reap() == []
+    assert other.exists()
+
+
+def test_background_thread_reaps(directory):
+    old = make_file(directory, "old.bin", age=100)
+    unit = DirectoryReaper(directory, max_age=50, interval=0.01)
+    unit.start()
+    try:
+        for _ in range(100):
+            if not old.exists():
+                break
+            time.sleep(0.01)
+    finally:
+        unit.stop()
+    assert not old.exists()
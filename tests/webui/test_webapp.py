@@ -0,0 +1,220 @@
+import hashlib
+import io
+import pytest
+from unittest.mock import Mock
+
+from pyflex.chip_cache import ChipContentsCache, ChipProbeCache
+from pyflex.device_lock import DeviceManager
+from pyflex.image_store import ImageStore
+from pyflex.jobs import JobManager
+from pyflex.overview import DumpOverviews
+from adapters.flashrom import EmulatedFlashChip, FlashROMEmulatedAdapter
+from webui import services, webapp
+
+
+SIZE = 64 * 1024
+BLOCK = 4096
+
+
+@pytest.fixture()
+def chip(tmp_path):
+    chip = EmulatedFlashChip(tmp_path / "chip.bin", size=SIZE, erase_block_size=BLOCK)
+    yield chip
+    chip.close()
+
+
+@pytest.fixture()
+def jobs(tmp_path, monkeypatch, chip):
+    # The web tier uses paths relative to the repository root.
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "webui" / "inputs").mkdir(parents=True)
+    (tmp_path / "webui" / "outputs").mkdir(parents=True)
+
+    jobs = JobManager()
+    monkeypatch.setattr(services, "_jobs", jobs)
+    monkeypatch.setattr(services, "_images", ImageStore("webui/inputs/"))
+    monkeypatch.setattr(services, "_contents", ChipContentsCache(tmp_path / "locks"))
+    monkeypatch.setattr(services, "_probes", ChipProbeCache())
+    monkeypatch.setattr(services, "_devices", DeviceManager(tmp_path / "locks"))
+    monkeypatch.setattr(services, "_overviews", DumpOverviews())
+    monkeypatch.setattr(services, "_started", True)
+    monkeypatch.setattr(
+        services,
+        "get_adapter",
+        lambda on_output=None: FlashROMEmulatedAdapter(chip, "webui/outputs/", on_output=on_output),
+    )
+    yield jobs
+    jobs.shutdown()
+
+
+@pytest.fixture()
+def client(jobs):
+    return webapp.app.test_client()
+
+
+def run(client, jobs, **form):
+    response = client.post("/api/flashrom", data=form)
+    assert response.status_code == 202
+    jobs.wait(response.json["id"])
+    return client.get(response.json["url"])
+
+
+def test_services_start_with_first_request(client, monkeypatch):
+    reaper = Mock()
+    monkeypatch.setattr(services, "_started", False)
+    monkeypatch.setattr(services, "_reapers", [reaper])
+
+    client.get("/metrics")
+    client.get("/metrics")
+
+    reaper.start.assert_called_once_with()
+
+
+def test_flashrom_runs_job_that_can_be_polled(client, jobs):
+    response = run(client, jobs, action="probe", programmer="dummy")
+
+    assert response.status_code == 200
+    assert response.json["status"] == "succeeded"
+    assert "EMULATED" in response.json["msg"]
+    assert response.json["report"]["chips"][0]["name"] == "EMULATED"
+
+
+def test_job_carries_request_timings(client, jobs):
+    response = run(
+        client,
+        jobs,
+        action="verify",
+        programmer="dummy",
+        **{"file-upload": (io.BytesIO(b"\xff" * SIZE), "image.bin")},
+    )
+
+    assert response.status_code == 200
+    assert {"parse", "upload", "queue", "adapter"} <= set(response.json["timings"])
+    assert response.headers["Server-Timing"].startswith("serialize;dur=")
+
+
+def test_flashrom_rejects_invalid_request_without_job(client, jobs):
+    response = client.post("/api/flashrom", data={"action": "format", "programmer": "dummy"})
+
+    assert response.status_code == 400
+    assert not jobs._jobs
+
+
+def test_flashrom_forgets_job_after_unexpected_error(client, jobs, monkeypatch):
+    monkeypatch.setattr(services, "get_flashrom", Mock(side_effect=RuntimeError))
+
+    response = client.post("/api/flashrom", data={"action": "probe", "programmer": "dummy"})
+
+    assert response.status_code == 500
+    assert not jobs._jobs
+
+
+def test_failed_job_reports_error(client, jobs):
+    response = run(
+        client,
+        jobs,
+        action="write",
+        programmer="dummy",
+        **{"file-upload": (io.BytesIO(b"\x00" * 16), "image.bin")},
+    )
+
+    assert response.status_code == 500
+    assert b"doesn't match" in response.data
+
+
+def test_unknown_job_is_not_found(client):
+    assert client.get("/api/jobs/unknown").status_code == 404
+    assert client.get("/api/jobs/unknown/stream").status_code == 404
+
+
+def test_job_output_is_streamed(client, jobs):
+    response = client.post("/api/flashrom", data={"action": "read", "programmer": "dummy"})
+    jobs.wait(response.json["id"])
+
+    stream = client.get(response.json["stream"])
+
+    assert stream.mimetype == "text/event-stream"
+    assert "data: Reading flash...\n\n" in stream.text
+    assert stream.text.endswith("event: done\ndata: \n\n")
+
+
+def test_image_is_found_by_digest(client, jobs):
+    data = b"\x00" * SIZE
+    digest = hashlib.sha256(data).hexdigest()
+    run(client, jobs, action="write", programmer="dummy", **{"file-upload": (io.BytesIO(data), "image.bin")})
+
+    assert client.get(f"/api/images/{digest}").json == {"sha256": digest, "size": SIZE}
+    assert client.get(f"/api/images/{digest}?size=1").status_code == 404
+    assert client.get(f"/api/images/{'0' * 64}").status_code == 404
+    assert client.get("/api/images/abc").status_code == 400
+
+
+def test_diff_of_uploads(client):
+    old = bytearray(SIZE)
+    new = bytearray(SIZE)
+    new[BLOCK + 1] = 1
+
+    response = client.post("/api/diff", data={
+        "old-upload": (io.BytesIO(bytes(old)), "old.bin"),
+        "new-upload": (io.BytesIO(bytes(new)), "new.bin"),
+    })
+
+    assert response.status_code == 200
+    assert response.json["ranges"] == [{"start": BLOCK, "end": 2 * BLOCK}]
+    assert response.json["changed_bytes"] == 1
+    assert "Server-Timing" in response.headers
+
+
+def test_diff_of_output_and_image(client, tmp_path):
+    (tmp_path / "webui" / "outputs" / "dump.bin").write_bytes(b"\xff" * SIZE)
+    digest = services.get_images().put(b"\xff" * SIZE)
+
+    response = client.get(f"/api/diff?old-output=dump.bin&new-sha256={digest}")
+
+    assert response.json["ranges"] == []
+    assert services.get_images().references(digest) == 0
+
+
+def test_diff_rejects_invalid_request(client):
+    assert client.get("/api/diff?block-size=0").status_code == 400
+    assert client.get("/api/diff").status_code == 400
+    assert client.get("/api/diff?old-output=missing.bin&new-output=missing.bin").status_code == 404
+
+
+def test_output_is_paged_as_hex(client, tmp_path):
+    (tmp_path / "webui" / "outputs" / "dump.bin").write_bytes(b"AB" * 32)
+
+    response = client.get("/api/outputs/dump.bin/hex?offset=16&length=16")
+
+    assert response.json == {
+        "size": 64,
+        "offset": 16,
+        "rows": [{"offset": 16, "hex": "41 42 " * 7 + "41 42", "text": "AB" * 8}],
+    }
+
+
+def test_hex_rejects_invalid_request(client, tmp_path):
+    (tmp_path / "webui" / "outputs" / "dump.bin").write_bytes(b"AB" * 32)
+
+    assert client.get("/api/outputs/dump.bin/hex?offset=65").status_code == 400
+    assert client.get("/api/outputs/missing.bin/hex").status_code == 404
+
+
+def test_overview_of_output(client, tmp_path):
+    (tmp_path / "webui" / "outputs" / "dump.bin").write_bytes(b"\xff" * SIZE)
+
+    response = client.get("/api/outputs/dump.bin/overview")
+
+    assert response.json["size"] == SIZE
+    assert response.json["levels"][0]["block_size"] == BLOCK
+    assert client.get("/api/outputs/missing.bin/overview").status_code == 404
+    assert client.get("/api/outputs/dump.bin.overview.json/overview").status_code == 404
+
+
+def test_metrics_count_operations(client, jobs):
+    run(client, jobs, action="probe", programmer="dummy")
+
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert 'pyflex_operations_total{action="probe",outcome="success"}' in response.text
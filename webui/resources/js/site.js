@@ -3,11 +3,95 @@ function toTitleCase(str) {
 }
 
 
+const JOB_POLL_INTERVAL = 1000;
+
+
+function pollJob(url, success, error) {
+    // Jobs answer 202 until they are finished. After that the response is the
+    // same as a synchronous request would have given.
+    $.ajax({
+        url: url,
+        type: 'GET',
+        success: (resp, status, xhr) => {
+            if (xhr.status === 202)
+                setTimeout(() => pollJob(url, success, error), JOB_POLL_INTERVAL);
+            else
+                success(resp, status, xhr);
+        },
+        error: error,
+    });
+}
+
+
+function streamJob(url, onLine) {
+    // Live output is a nicety. Browsers without EventSource still get the
+    // final result from polling.
+    if (typeof EventSource === "undefined")
+        return null;
+
+    let source = new EventSource(url);
+    source.onmessage = e => onLine(e.data);
+    source.addEventListener("done", () => source.close());
+    source.onerror = () => source.close();
+    return source;
+}
+
+
+function onJobSubmitted(resp, status, xhr) {
+    if (xhr.status !== 202 || !resp.url) {
+        onFormSuccess(resp, status, xhr);
+        return;
+    }
+
+    let progress = onJobStarted(resp);
+    let source = streamJob(resp.stream, line => progress.append(line));
+
+    let finish = callback => (...args) => {
+        if (source)
+            source.close();
+        progress.remove();
+        callback(...args);
+    };
+
+    pollJob(resp.url, finish(onFormSuccess), finish(onFormError));
+}
+
+
+function toHex(buffer) {
+    return Array.from(new Uint8Array(buffer))
+        .map(b => b.toString(16).padStart(2, '0'))
+        .join('');
+}
+
+
+async function skipKnownUploads(formData) {
+    // WebCrypto is only available in secure contexts. Without it the file is
+    // simply uploaded.
+    if (!window.crypto || !window.crypto.subtle)
+        return;
+
+    for (let [name, file] of Array.from(formData.entries())) {
+        // Only images are kept by the server, not layout files.
+        if (name !== 'file-upload' || !(file instanceof File) || file.size === 0)
+            continue;
+
+        let digest = toHex(await crypto.subtle.digest('SHA-256', await file.arrayBuffer()));
+        let resp = await fetch(`/api/images/${digest}?size=${file.size}`);
+
+        if (resp.ok) {
+            formData.delete(name);
+            formData.set('image-sha256', digest);
+        }
+    }
+}
+
+
 $(() => {
-    $("form").submit(e => {
+    $("form").submit(async e => {
         e.preventDefault();
         let target = $(e.target);
         let formData = new FormData(e.target);
+        await skipKnownUploads(formData);
         console.log(formData);
         $.ajax({
             url: target.attr('action'),
@@ -15,7 +99,7 @@ $(() => {
             contentType: false,
             processData: false,
             data: formData,
-            success: onFormSuccess,
+            success: onJobSubmitted,
             error: onFormError,
         })
     });
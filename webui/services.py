@@ -1,11 +1,172 @@
+import os
+import tempfile
+from pathlib import Path
+from threading import Lock
 from unittest.mock import Mock
 from pyflex import FlashROMService
+from pyflex.chip_cache import ChipContentsCache, ChipProbeCache
+from pyflex.device_lock import DeviceManager
+from pyflex.image_store import ImageStore
+from pyflex.jobs import JobManager
+from pyflex.metrics import MetricsRegistry, OperationMetrics
+from pyflex.overview import OVERVIEW_PATTERN, DumpOverviews
+from pyflex.retention import DirectoryReaper
 from pyflex.typing import FlashROMAdapter, FlashROMExecResult
-from adapters.flashrom import FlashROMShellCommandAdapter
+from adapters.flashrom import (
+    EmulatedFlashChip,
+    FlashROMEmulatedAdapter,
+    FlashROMShellCommandAdapter,
+)
 
 
-def get_flashrom():
-    adapter = FlashROMShellCommandAdapter("webui/outputs/")
-    service = FlashROMService(adapter, "webui/inputs/")
+# Large enough for a 1 Gbit flash chip.
+MAX_INPUT_SIZE = 128 * 1024 * 1024
+
+
+# Storage is small on the devices we deploy to. Files that have not been used
+# for a week are removed, as are the least recently used files over quota.
+INPUT_QUOTA = 1024 * 1024 * 1024
+OUTPUT_QUOTA = 1024 * 1024 * 1024
+MAX_FILE_AGE = 7 * 24 * 60 * 60
+
+
+# Set PYFLEX_ADAPTER=emulated to run against an emulated chip instead of the
+# FlashROM utility, e.g. for load testing without hardware.
+ADAPTER = os.environ.get("PYFLEX_ADAPTER", "shell")
+EMULATED_CHIP_PATH = os.environ.get(
+    "PYFLEX_EMULATED_CHIP",
+    os.path.join(tempfile.gettempdir(), "pyflex-emulated-chip.bin"),
+)
+
+
+_jobs = JobManager()
+_images = ImageStore("webui/inputs/", max_file_size=MAX_INPUT_SIZE)
+_contents = ChipContentsCache()
+_probes = ChipProbeCache()
+_devices = DeviceManager()
+_metrics = MetricsRegistry()
+_operations = OperationMetrics(_metrics)
+_overviews = DumpOverviews()
+_chip = EmulatedFlashChip(EMULATED_CHIP_PATH) if ADAPTER == "emulated" else None
+_reapers = [
+    DirectoryReaper(
+        "webui/inputs/",
+        max_bytes=INPUT_QUOTA,
+        max_age=MAX_FILE_AGE,
+        delete=_images.reclaim_path,
+    ),
+    DirectoryReaper(
+        "webui/outputs/",
+        max_bytes=OUTPUT_QUOTA,
+        max_age=MAX_FILE_AGE,
+        delete=_overviews.delete,
+    ),
+    # Overviews are deleted with their dump. This catches the ones that were
+    # not, e.g. partial overviews left behind by a crash.
+    DirectoryReaper(
+        "webui/outputs/",
+        max_age=MAX_FILE_AGE,
+        pattern=OVERVIEW_PATTERN,
+    ),
+]
+_started = False
+_starting = Lock()
+
+
+def _directory_size(directory):
+    size = 0
+    for path in Path(directory).rglob("*"):
+        try:
+            size += path.stat().st_size if path.is_file() else 0
+        except FileNotFoundError:
+            # Reaped while we were looking.
+            pass
+    return size
+
+
+def _directory_sizes():
+    return {(directory,): _directory_size(directory) for directory in ("webui/inputs", "webui/outputs")}
+
+
+_uploaded = _metrics.counter(
+    "pyflex_uploaded_bytes_total",
+    "Bytes of input files uploaded.",
+)
+_served = _metrics.counter(
+    "pyflex_served_bytes_total",
+    "Bytes of output files served.",
+)
+_metrics.gauge(
+    "pyflex_device_queue_depth",
+    "Operations holding or waiting for a programmer.",
+    ["programmer"],
+    collect=lambda: {(programmer,): depth for programmer, depth in _devices.queue_depths().items()},
+)
+_metrics.gauge(
+    "pyflex_directory_size_bytes",
+    "Size of the files kept in a directory.",
+    ["directory"],
+    collect=_directory_sizes,
+)
+
+
+def get_adapter(on_output=None):
+    if ADAPTER == "emulated":
+        return FlashROMEmulatedAdapter(_chip, "webui/outputs/", on_output=on_output)
+    return FlashROMShellCommandAdapter("webui/outputs/", on_output=on_output)
+
+
+def get_flashrom(on_output=None):
+    adapter = get_adapter(on_output)
+    service = FlashROMService(
+        adapter,
+        "webui/inputs/",
+        max_file_size=MAX_INPUT_SIZE,
+        output_directory="webui/outputs/",
+        contents_cache=_contents,
+        probe_cache=_probes,
+        device_manager=_devices,
+        metrics=_operations,
+        overviews=_overviews,
+    )
     return service
 
+
+def get_jobs():
+    return _jobs
+
+
+def get_images():
+    return _images
+
+
+def get_overviews():
+    return _overviews
+
+
+def get_metrics():
+    return _metrics
+
+
+def count_upload(size):
+    _uploaded.inc(size)
+
+
+def count_served(size):
+    _served.inc(size)
+
+
+def start():
+    # Indexing the input directory and starting the reapers touch the disk and
+    # start threads, so it is done once the app serves requests rather than
+    # whenever this module is imported.
+    global _started
+
+    with _starting:
+        if _started:
+            return
+        _started = True
+
+    _images.index()
+    for reaper in _reapers:
+        reaper.start()
@@ -1,9 +1,16 @@
-from flask import Flask, render_template, abort, request, send_from_directory
+from flask import Flask, Response, render_template, abort, request, send_from_directory
+import time
+from base64 import b64encode
+from dataclasses import asdict
+from pathlib import Path
 from typing import Optional
 from jinja2.exceptions import TemplateNotFound
 from werkzeug.exceptions import NotFound as WerkzeugNotFound
+from werkzeug.security import safe_join
 
-from pyflex import exceptions as pyflex_exceptions
+from pyflex import exceptions as pyflex_exceptions, hexdump, imagediff, retention
+from pyflex.models import DumpOverview, FlashROMBlankCheck, FlashROMReport, ImageDiff, Job, JobStatusEnum
+from pyflex.output_parser import FlashROMOutputParser
 from . import services
 
 
@@ -24,34 +31,187 @@ app.jinja_options = {
 }
 
 
+SSE_HEARTBEAT = 15
+
+
+# A layout holds at most 64 short lines.
+MAX_LAYOUT_SIZE = 64 * 1024
+
+
+# Erase blocks range from 256 bytes to 256 KiB on common chips.
+MAX_DIFF_BLOCK_SIZE = 16 * 1024 * 1024
+
+
 def file_to_url(path: str) -> Optional[str]:
     return f"/outputs/{path}" if path else None
 
 
+def report_to_dict(report: FlashROMReport) -> dict:
+    return {
+        "programmer": report.programmer,
+        "chips": [asdict(chip) for chip in report.chips],
+        "phases": [
+            {
+                "phase": phase.phase.name.lower(),
+                "status": phase.status.name.lower(),
+                "started": phase.started,
+                "finished": phase.finished,
+            }
+            for phase in report.phases
+        ],
+        "elapsed": report.elapsed,
+    }
+
+
+def server_timing(timings: dict) -> str:
+    # https://www.w3.org/TR/server-timing/ takes durations in milliseconds.
+    return ", ".join(f"{name};dur={seconds * 1000:.3f}" for name, seconds in timings.items())
+
+
+def diff_to_dict(diff: ImageDiff) -> dict:
+    return {
+        "size": diff.size,
+        "block_size": diff.block_size,
+        "changed_blocks": diff.changed_blocks,
+        "changed_bytes": diff.changed_bytes,
+        "ranges": [{"start": start, "end": end} for start, end in diff.ranges],
+    }
+
+
+def blank_check_to_dict(check: FlashROMBlankCheck) -> dict:
+    return {
+        "size": check.size,
+        "block_size": check.block_size,
+        "blank": not check.dirty,
+        "dirty_blocks": check.dirty_blocks,
+        "dirty": [{"start": start, "end": end} for start, end in check.dirty],
+    }
+
+
+def overview_to_dict(overview: DumpOverview) -> dict:
+    return {
+        "size": overview.size,
+        "levels": [
+            {
+                "block_size": level.block_size,
+                "entropy": b64encode(level.entropy).decode(),
+                "erased": b64encode(level.erased).decode(),
+                "zero": b64encode(level.zero).decode(),
+            }
+            for level in overview.levels
+        ],
+    }
+
+
+def job_to_dict(job: Job) -> dict:
+    ret = {
+        "id": job.id,
+        "status": job.status.name.lower(),
+        "url": f"/api/jobs/{job.id}",
+        "stream": f"/api/jobs/{job.id}/stream",
+    }
+
+    if job.result:
+        ret["msg"] = job.result.message
+        ret["out"] = file_to_url(job.result.path)
+        ret["timings"] = job.result.timings
+
+    if job.result and job.result.hash_check:
+        ret["hash_check"] = asdict(job.result.hash_check)
+
+    if job.result and job.result.blank_check:
+        ret["blank_check"] = blank_check_to_dict(job.result.blank_check)
+
+    if job.result and job.result.report:
+        ret["report"] = report_to_dict(job.result.report)
+
+    elif job.progress:
+        ret["report"] = report_to_dict(job.progress.report())
+
+    return ret
+
+
+@app.before_request
+def start_services() -> None:
+    services.start()
+
+
 @app.route("/api/flashrom", methods=["POST"])
 def flashrom():
 
-    service = services.get_flashrom()
+    jobs = services.get_jobs()
+    job = jobs.create()
 
-    action = request.form.get("action")
-    programmer = request.form.get("programmer")
-    file = request.files.get("file-upload")
-    file_data = file.read() if file else None
+    def on_output(line: str) -> None:
+        jobs.append_output(job.id, line)
+        job.progress.feed(line)
 
-    service.set_action(action)
-    service.set_programmer(programmer)
+    try:
+        job.progress = FlashROMOutputParser()
+        service = services.get_flashrom(on_output=on_output)
 
-    if file_data:
-        service.set_file(file_data)
+        # The form is parsed on first access, which includes spooling the upload.
+        started = time.perf_counter()
+        action = request.form.get("action")
+        programmer = request.form.get("programmer")
+        file = request.files.get("file-upload")
+        timings = {"parse": time.perf_counter() - started}
+        service.add_timing("parse", timings["parse"])
 
-    if "force" in request.form:
-        service.set_force()
+        if action == "pipeline":
+            service.set_pipeline(request.form.get("steps", "").replace(",", " ").split())
+        else:
+            service.set_action(action)
+        service.set_programmer(programmer)
 
-    if "very-very-verbose" in request.form:
-        service.set_verbosity(3)
+        if file and file.filename:
+            started = time.perf_counter()
+            service.set_file(file.stream)
+            timings["upload"] = time.perf_counter() - started
+            services.count_upload(file.stream.seek(0, 2))
 
-    try:
-        result = service.execute()
+        elif request.form.get("image-sha256"):
+            service.set_image(request.form["image-sha256"])
+
+        if request.form.get("expected-sha256"):
+            service.set_expected_hash(request.form["expected-sha256"].strip())
+
+        if "force" in request.form:
+            service.set_force()
+
+        if "very-very-verbose" in request.form:
+            service.set_verbosity(3)
+
+        if "reread" in request.form:
+            service.unset_reuse_contents()
+            service.unset_partial_erase()
+
+        if "autodetect" in request.form:
+            service.set_autodetect()
+
+        regions = request.form.get("regions", "all")
+        layout = request.files.get("layout-upload")
+
+        if regions == "layout" and layout and layout.filename:
+            text = layout.stream.read(MAX_LAYOUT_SIZE + 1)
+            if len(text) > MAX_LAYOUT_SIZE:
+                raise pyflex_exceptions.PyFlexInvalidParameter("Invalid value for LAYOUT.")
+            service.set_layout(text)
+
+        elif regions == "ifd":
+            service.set_ifd()
+
+        elif regions == "fmap":
+            service.set_fmap()
+
+        if regions != "all":
+            service.set_include(request.form.get("include", "").replace(",", " ").split())
+
+        # Reject bad requests now rather than after they have been queued.
+        service.validate()
+        # Jobs for a busy programmer wait without taking a worker from jobs
+        # for other programmers.
+        jobs.submit(service, job, key=programmer)
 
     except pyflex_exceptions.PyFlexInvalidParameter as ex:
         return str(ex), 400
@@ -59,22 +219,209 @@ def flashrom():
     except pyflex_exceptions.PyFlexException as ex:
         return str(ex), 500
 
+    finally:
+        # A job that was not submitted would be PENDING forever. Submitted
+        # jobs are left alone.
+        jobs.discard(job.id)
+
+    return job_to_dict(job), 202, {"Server-Timing": server_timing(timings)}
+
+
+@app.route("/api/images/<digest>")
+def get_image(digest: str):
+    # Lets clients skip the upload of an image the server already holds.
+    images = services.get_images()
+
+    try:
+        size = images.size(digest)
+
+    except pyflex_exceptions.PyFlexInvalidParameter as ex:
+        return str(ex), 400
+
+    except pyflex_exceptions.PyFlexNotFound:
+        abort(404)
+
+    if request.args.get("size", size, type=int) != size:
+        abort(404)
+
+    return {"sha256": digest.lower(), "size": size}
+
+
+def diff_image(side: str, digests: list) -> Path:
+    # An image is given as an upload, the digest of an input image or the name
+    # of an output file. Input images are referenced until the diff is done.
+    images = services.get_images()
+    upload = request.files.get(f"{side}-upload")
+    digest = request.values.get(f"{side}-sha256")
+    output = request.values.get(f"{side}-output")
+
+    if upload and upload.filename:
+        digest = images.put(upload.stream, acquire=True)
+        digests.append(digest)
+        services.count_upload(upload.stream.seek(0, 2))
+        return images.path(digest)
+
+    elif digest:
+        images.acquire(digest)
+        digests.append(digest)
+        return images.path(digest)
+
+    elif output:
+        path = safe_join("webui/outputs", output)
+        if path is None or not Path(path).is_file():
+            raise pyflex_exceptions.PyFlexNotFound("Output not found.")
+        retention.touch(path)
+        return Path(path)
+
+    raise pyflex_exceptions.PyFlexInvalidParameter(f"Missing value for {side.upper()}.")
+
+
+@app.route("/api/diff", methods=["GET", "POST"])
+def diff():
+    # Compares two images so that operators need not download both.
+    images = services.get_images()
+    block_size = request.values.get("block-size", imagediff.DEFAULT_BLOCK_SIZE, type=int)
+    digests = []
+
+    try:
+        if not 0 < block_size <= MAX_DIFF_BLOCK_SIZE:
+            raise pyflex_exceptions.PyFlexInvalidParameter("Invalid value for BLOCK-SIZE.")
+
+        old = diff_image("old", digests)
+        new = diff_image("new", digests)
+
+        started = time.perf_counter()
+        result = imagediff.diff_images(old, new, block_size)
+        timings = {"diff": time.perf_counter() - started}
+
+    except (pyflex_exceptions.PyFlexInvalidParameter, ValueError) as ex:
+        return str(ex), 400
+
+    except pyflex_exceptions.PyFlexNotFound:
+        abort(404)
+
+    finally:
+        for digest in digests:
+            images.release(digest)
+
+    return diff_to_dict(result), {"Server-Timing": server_timing(timings)}
+
+
+@app.route("/api/jobs/<job_id>")
+def get_job(job_id: str):
+    try:
+        job = services.get_jobs().get(job_id)
+
+    except pyflex_exceptions.PyFlexNotFound:
+        abort(404)
+
+    if job.status == JobStatusEnum.FAILED:
+        status = 400 if isinstance(job.error, pyflex_exceptions.PyFlexInvalidParameter) else 500
+        return str(job.error), status
+
+    elif job.status == JobStatusEnum.SUCCEEDED:
+        started = time.perf_counter()
+        body = app.json.dumps(job_to_dict(job))
+        timings = {"serialize": time.perf_counter() - started}
+        return Response(
+            body,
+            mimetype=app.json.mimetype,
+            headers={"Server-Timing": server_timing(timings)},
+        )
+
     else:
-        return {
-            "msg": result.message,
-            "out": file_to_url(result.path)
-        }
+        return job_to_dict(job), 202
+
+
+@app.route("/api/jobs/<job_id>/stream")
+def stream_job(job_id: str):
+    try:
+        lines = services.get_jobs().follow(job_id, heartbeat=SSE_HEARTBEAT)
+
+    except pyflex_exceptions.PyFlexNotFound:
+        abort(404)
+
+    def generate():
+        for line in lines:
+            if line is None:
+                # Comment lines keep proxies from closing an idle stream.
+                yield ": keep-alive\n\n"
+                continue
+            for part in line.splitlines() or [""]:
+                yield f"data: {part}\n\n"
+        yield "event: done\ndata: \n\n"
+
+    return Response(
+        generate(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @app.route("/outputs/<file>")
 def get_output(file) -> str:
     try:
-        return send_from_directory('webui/outputs', file)
+        response = send_from_directory('webui/outputs', file)
+        retention.touch(safe_join('webui/outputs', file))
+        services.count_served(response.content_length or 0)
+        return response
 
     except WerkzeugNotFound as ex:
         abort(404)
 
 
+@app.route("/api/outputs/<file>/hex")
+def get_output_hex(file: str):
+    # Pages of an output file, so that a dump can be inspected without
+    # downloading it.
+    path = safe_join('webui/outputs', file)
+    if path is None:
+        abort(404)
+
+    try:
+        page = hexdump.read_page(
+            path,
+            request.args.get("offset", 0, type=int),
+            request.args.get("length", 4096, type=int),
+        )
+
+    except pyflex_exceptions.PyFlexInvalidParameter as ex:
+        return str(ex), 400
+
+    except (FileNotFoundError, IsADirectoryError):
+        abort(404)
+
+    retention.touch(path)
+    return asdict(page)
+
+
+@app.route("/api/outputs/<file>/overview")
+def get_output_overview(file: str):
+    # Only dumps have an overview, not e.g. the overviews themselves.
+    path = safe_join('webui/outputs', file)
+    if path is None or not file.endswith(".bin"):
+        abort(404)
+
+    try:
+        started = time.perf_counter()
+        overview = services.get_overviews().get(path)
+        timings = {"overview": time.perf_counter() - started}
+
+    except (FileNotFoundError, IsADirectoryError):
+        abort(404)
+
+    retention.touch(path)
+    return overview_to_dict(overview), {"Server-Timing": server_timing(timings)}
+
+
+@app.route("/metrics")
+def get_metrics():
+    return Response(
+        services.get_metrics().render(),
+        content_type=services.get_metrics().CONTENT_TYPE,
+    )
+
+
 @app.route("/")
 @app.route("/<page>")
 def get_index(page: str = 'home') -> str: